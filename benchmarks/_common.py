@@ -0,0 +1,42 @@
+"""
+Общие утилиты бенчмарков: временная БД и перцентили
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# main.py монтирует ./static, поэтому запускаемся из корня проекта
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+
+
+def setup_db(name: str = "bench.db") -> str:
+    """Создать пустую БД во временном каталоге и направить на неё main"""
+    path = os.path.join(tempfile.mkdtemp(prefix="ai_service_bench_"), name)
+    main.DATABASE_PATH = path
+    main.init_database()
+    return path
+
+
+def percentile(values, pct: float) -> float:
+    """Перцентиль по отсортированной выборке (без numpy)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(title: str, latencies_ms) -> None:
+    """Вывести p50/p95/p99/max для списка задержек в миллисекундах"""
+    print(
+        f"{title}: p50={percentile(latencies_ms, 50):.2f}ms "
+        f"p95={percentile(latencies_ms, 95):.2f}ms "
+        f"p99={percentile(latencies_ms, 99):.2f}ms "
+        f"max={max(latencies_ms, default=0):.2f}ms"
+    )
@@ -0,0 +1,148 @@
+"""
+Горячие и холодные данные: задержка горячих запросов при большой истории
+
+Сравнивает две БД с одинаковыми данными: вся история в живых таблицах
+и история в архивной БД (как после archive_old_jobs). Затем измеряет
+скорость самого переноса в архив.
+
+    python benchmarks/bench_archive.py --history 10000000 --live 50000
+"""
+import argparse
+import os
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+from _common import main, report, setup_db
+
+CATEGORIES = ["electrical", "plumbing", "appliance", "general"]
+MASTERS = 5000
+
+
+def job_rows(count: int, rng: random.Random, statuses, age_sql: str, start_id: int):
+    for i in range(count):
+        yield (start_id + i, rng.choice(CATEGORIES), rng.choice(statuses),
+               rng.randint(1, MASTERS), round(rng.uniform(1000, 5000), 2), age_sql)
+
+
+def load(conn, schema: str, count: int, statuses, age_days: int, start_id: int, seed: int) -> None:
+    """Массовая загрузка заказов и транзакций к завершённым"""
+    rng = random.Random(seed)
+    batch_jobs, batch_tx = [], []
+    for job_id, category, status, master_id, amount, _ in job_rows(count, rng, statuses, "", start_id):
+        created = f"-{rng.randint(age_days, age_days + 700)} days" if age_days else f"-{rng.randint(0, 3)} days"
+        batch_jobs.append((job_id, category, status, master_id, amount, created))
+        if status == "completed":
+            fees = main.calculate_platform_fee(amount)
+            batch_tx.append((job_id, amount, fees['platform_commission'], fees['master_earnings'], created))
+        if len(batch_jobs) == 100_000:
+            flush(conn, schema, batch_jobs, batch_tx)
+    flush(conn, schema, batch_jobs, batch_tx)
+
+
+def flush(conn, schema, batch_jobs, batch_tx) -> None:
+    conn.executemany(
+        f"""INSERT INTO {schema}.jobs (id, client_name, client_phone, category, problem_description,
+                                       address, estimated_price, status, master_id, created_at)
+            VALUES (?, 'Клиент', '+79990000000', ?, 'Не работает розетка', 'ул. Ленина, 1',
+                    ?, ?, ?, datetime('now', ?))""",
+        [(job_id, category, amount, status, master_id, created)
+         for job_id, category, status, master_id, amount, created in batch_jobs],
+    )
+    conn.executemany(
+        f"""INSERT INTO {schema}.transactions (job_id, amount, payment_method, platform_fee,
+                                               master_earnings, created_at)
+            VALUES (?, ?, 'card', ?, ?, datetime('now', ?))""",
+        batch_tx,
+    )
+    conn.commit()
+    batch_jobs.clear()
+    batch_tx.clear()
+
+
+def prepare(history: int, live: int, tiered: bool) -> None:
+    path = setup_db("tiered.db" if tiered else "flat.db")
+    main.ARCHIVE_DATABASE_PATH = os.path.join(os.path.dirname(path), "archive.db")
+    main.sync_master_loads()
+    conn = main.get_db_connection()
+    # Для загрузки истории полнотекстовый индекс не нужен
+    conn.executescript("DROP TRIGGER jobs_fts_insert; DROP TRIGGER jobs_fts_delete;")
+    conn.executemany(
+        "INSERT INTO masters (id, full_name, phone, specializations, city, terminal_active) "
+        "VALUES (?, 'Мастер', ?, '[\"electrical\"]', 'Москва', 1)",
+        [(i, f"+7900{i:07d}") for i in range(1, MASTERS + 1)],
+    )
+    conn.commit()
+    started = time.perf_counter()
+    if tiered:
+        conn.execute("ATTACH DATABASE ? AS archive", (main.ARCHIVE_DATABASE_PATH,))
+        main.init_archive_database(conn.cursor())
+        load(conn, "archive", history, ["completed"] * 9 + ["cancelled"], 120, 1, seed=1)
+        conn.execute("""
+            INSERT INTO archive.archive_totals (status, jobs, revenue)
+            SELECT j.status, COUNT(DISTINCT j.id), COALESCE(SUM(t.amount), 0)
+            FROM archive.jobs j LEFT JOIN archive.transactions t ON t.job_id = j.id
+            GROUP BY j.status
+        """)
+        conn.commit()
+    else:
+        load(conn, "main", history, ["completed"] * 9 + ["cancelled"], 120, 1, seed=1)
+    load(conn, "main", live, ["pending", "accepted", "in_progress", "completed"], 0, history + 1, seed=2)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    print(f"  загрузка {'(архив)' if tiered else '(всё в живых таблицах)'}: {time.perf_counter() - started:.0f}s")
+
+
+def measure(title: str, repeat: int) -> dict:
+    client = TestClient(main.app)
+    rng = random.Random(3)
+    calls = {
+        "активный заказ": lambda m: client.get(f"/api/v1/terminal/jobs/{m}/active"),
+        "заказы мастера (accepted)": lambda m: client.get(f"/api/v1/terminal/jobs/{m}", params={"status": "accepted"}),
+        "все заказы мастера": lambda m: client.get(f"/api/v1/terminal/jobs/{m}"),
+        "заработок": lambda m: client.get(f"/api/v1/terminal/earnings/{m}"),
+        "статистика": lambda m: client.get("/api/v1/stats"),
+    }
+    results = {}
+    print(title)
+    for name, call in calls.items():
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call(rng.randint(1, MASTERS)).raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+        report(f"  {name:<26}", latencies)
+        results[name] = latencies
+    return client.get("/api/v1/stats").json()
+
+
+def archive_throughput(jobs: int) -> None:
+    path = setup_db("archiving.db")
+    main.ARCHIVE_DATABASE_PATH = os.path.join(os.path.dirname(path), "archive.db")
+    conn = main.get_db_connection()
+    load(conn, "main", jobs, ["completed"] * 9 + ["cancelled"], 120, 1, seed=4)
+    conn.close()
+    result = main.archive_old_jobs()
+    print(f"перенос в архив: {result['archived_jobs']} заказов, {result['archived_transactions']} транзакций, "
+          f"{result['batches']} пачек за {result['seconds']}s "
+          f"({result['archived_jobs'] / max(result['seconds'], 1e-9):.0f} заказов/с)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, default=10_000_000)
+    parser.add_argument("--live", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--archive-sample", type=int, default=200_000)
+    args = parser.parse_args()
+
+    main.DISPATCH_INTERVAL_SECONDS = 0
+    prepare(args.history, args.live, tiered=False)
+    flat = measure(f"история {args.history} заказов в живых таблицах:", args.repeat)
+    prepare(args.history, args.live, tiered=True)
+    tiered = measure(f"история {args.history} заказов в архиве:", args.repeat)
+    assert flat["jobs"] == tiered["jobs"], "статистика с архивом расходится"
+    assert abs(flat["revenue"]["total"] - tiered["revenue"]["total"]) < 1, "выручка с архивом расходится"
+    archive_throughput(args.archive_sample)
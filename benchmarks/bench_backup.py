@@ -0,0 +1,146 @@
+"""
+Резервное копирование под нагрузкой: длительность снимка и задержка записи
+
+БД генерируется datagen.py, сервер - uvicorn в отдельном процессе. Клиент
+держит постоянный темп записывающих запросов (приём заявок и оплаты
+заказов) и в середине прогона запускает /api/v1/backups/run. Задержки
+записи до и во время копирования сравниваются для каждого размера шага
+BACKUP_PAGES_PER_STEP (-1 - все страницы за один шаг). В конце снимок
+проверяется восстановлением в отдельный файл.
+
+    python benchmarks/bench_backup.py --jobs 1000000 --masters 20000 --rate 40 --steps 256,-1
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from _common import ROOT, main, percentile
+from bench_upload import free_port
+from datagen import generate
+
+FORM = {
+    "name": "Анна", "category": "electrical",
+    "problem_description": "Не работает розетка на кухне", "address": "ул. Баумана, 1",
+}
+
+
+def open_jobs(limit: int) -> list:
+    conn = main.get_db_connection()
+    ids = [row[0] for row in conn.execute(
+        "SELECT id FROM jobs WHERE status IN ('accepted', 'in_progress') ORDER BY id DESC LIMIT ?", (limit,)
+    )]
+    conn.close()
+    return ids
+
+
+async def write_load(client: httpx.AsyncClient, rate: float, seconds: float, jobs: list, samples: list) -> None:
+    """Открытая нагрузка: запросы уходят по расписанию, не дожидаясь ответов"""
+    async def one(index: int) -> None:
+        started = time.perf_counter()
+        if index % 2 and jobs:
+            response = await client.post("/api/v1/terminal/payment/process",
+                                         json={"job_id": jobs.pop(), "amount": 2500, "payment_method": "card"})
+        else:
+            response = await client.post("/api/v1/ai/web-form", json=dict(FORM, phone=f"+7912{index:07d}"))
+        samples.append((time.perf_counter(), (time.perf_counter() - started) * 1000, response.status_code))
+
+    tasks = []
+    begin = time.perf_counter()
+    for index in range(int(rate * seconds)):
+        delay = begin + index / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(index)))
+    await asyncio.gather(*tasks)
+
+
+def window_p99(samples: list, start: float, end: float) -> tuple:
+    values = [ms for finished, ms, _ in samples if start <= finished < end]
+    return len(values), percentile(values, 50), percentile(values, 99)
+
+
+async def run_config(path: str, workdir: str, pages: int, args) -> str:
+    port = free_port()
+    env = dict(os.environ, DATABASE_PATH=path, ARCHIVE_DATABASE_PATH=path + ".archive",
+               BACKUP_PATH=os.path.join(workdir, "backups"), BACKUP_PAGES_PER_STEP=str(pages),
+               BACKUP_STEP_SLEEP_MS=str(args.sleep_ms), DISPATCH_INTERVAL_SECONDS="0",
+               NOTIFY_INTERVAL_SECONDS="0", PRESENCE_FLUSH_SECONDS="0", JOB_EVENTS_INTERVAL_SECONDS="0",
+               THUMBNAIL_WORKERS="0", TRACE_SLOW_MS="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--no-access-log"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+            samples = []
+            load = asyncio.create_task(write_load(client, args.rate, args.seconds, open_jobs(10 ** 5), samples))
+            await asyncio.sleep(args.seconds / 3)
+            backup_started = time.perf_counter()
+            result = (await client.post("/api/v1/backups/run")).json()
+            backup_ended = time.perf_counter()
+            await load
+
+        duration = backup_ended - backup_started
+        before = window_p99(samples, backup_started - duration, backup_started)
+        during = window_p99(samples, backup_started, backup_ended)
+        errors = sum(1 for _, _, status in samples if status >= 500)
+        print(f"\nшаг {pages if pages > 0 else 'все'} страниц: снимок {result['last_bytes'] / 1024 / 1024:.0f} МБ "
+              f"за {result['last_seconds']}s (копирование {result['last_copy_seconds']}s в {result['last_steps']} "
+              f"шагов, integrity_check {result['last_check_seconds']}s), ошибок записи: {errors}")
+        print(f"  запись до:      n={before[0]:4} p50={before[1]:7.2f}ms p99={before[2]:7.2f}ms")
+        print(f"  запись во время: n={during[0]:4} p50={during[1]:7.2f}ms p99={during[2]:7.2f}ms")
+        print(f"  метрики сервера: p99 до {result['write_p99_ms_before']}ms, "
+              f"во время {result['write_p99_ms_during']}ms")
+        return result["snapshot"]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def restore_check(snapshot: str, workdir: str) -> None:
+    main.DATABASE_PATH = os.path.join(workdir, "restored.db")
+    main.BACKUP_PATH = os.path.join(workdir, "restore_backups")
+    result = main.restore_database(snapshot)
+    conn = sqlite3.connect(main.DATABASE_PATH)
+    jobs = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+    conn.close()
+    print(f"восстановление из {os.path.basename(snapshot)}: {result['seconds']}s, заказов {jobs:,}")
+
+
+async def run(args) -> None:
+    workdir = tempfile.mkdtemp(prefix="ai_service_backup_")
+    path = os.path.join(workdir, "bench.db")
+    generate(path, args.masters, args.jobs)
+
+    snapshot = None
+    for pages in [int(value) for value in args.steps.split(",")]:
+        snapshot = await run_config(path, workdir, pages, args)
+    restore_check(snapshot, workdir)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=1000000)
+    parser.add_argument("--masters", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=40, help="записывающих запросов в секунду")
+    parser.add_argument("--seconds", type=float, default=60, help="длительность прогона на конфигурацию")
+    parser.add_argument("--steps", default="256,-1", help="BACKUP_PAGES_PER_STEP через запятую")
+    parser.add_argument("--sleep-ms", type=float, default=2)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,98 @@
+"""
+Конкурентный захват заказов: сотни мастеров одновременно разбирают pending-заказы
+
+Проверяет, что каждый заказ достаётся ровно одному мастеру и ни один
+мастер не превышает лимит активных заказов, и измеряет пропускную
+способность и задержку claim_pending_job. По умолчанию лимит снят, чтобы
+разобрать все заказы; --max-active 3 проверяет лимит под конкуренцией.
+
+    python benchmarks/bench_claim.py --masters 300 --jobs 3000
+    python benchmarks/bench_claim.py --masters 300 --jobs 3000 --max-active 3
+"""
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+
+from _common import main, report, setup_db
+
+
+def seed(masters: int, jobs: int) -> None:
+    conn = main.get_db_connection()
+    conn.executemany(
+        """INSERT INTO masters (full_name, phone, specializations, city, terminal_active)
+           VALUES (?, ?, ?, 'Москва', 1)""",
+        [(f"Мастер {i}", f"+7900{i:07d}", json.dumps(["electrical", "plumbing"]))
+         for i in range(masters)],
+    )
+    conn.executemany(
+        """INSERT INTO jobs (client_name, client_phone, category, problem_description, address, city)
+           VALUES ('Клиент', '+79990000000', ?, 'Не работает розетка', 'ул. Ленина, 1', 'Москва')""",
+        [("electrical" if i % 2 else "plumbing",) for i in range(jobs)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(masters: int, jobs: int, max_active: int) -> None:
+    setup_db()
+    seed(masters, jobs)
+    main.MAX_ACTIVE_JOBS_PER_MASTER = max_active or jobs
+    expected = min(jobs, masters * main.MAX_ACTIVE_JOBS_PER_MASTER)
+
+    barrier = threading.Barrier(masters)
+    latencies = []
+    claimed = []
+    lock = threading.Lock()
+
+    def claimant(master_id: int) -> None:
+        local_latencies, local_claimed = [], []
+        barrier.wait()
+        while True:
+            started = time.perf_counter()
+            job = main.claim_pending_job(master_id)
+            local_latencies.append((time.perf_counter() - started) * 1000)
+            if job is None:
+                break
+            local_claimed.append(job["id"])
+        with lock:
+            latencies.extend(local_latencies)
+            claimed.extend(local_claimed)
+
+    threads = [threading.Thread(target=claimant, args=(i + 1,)) for i in range(masters)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    duplicates = [job_id for job_id, count in Counter(claimed).items() if count > 1]
+    assert not duplicates, f"заказы захвачены дважды: {duplicates[:10]}"
+    assert len(claimed) == expected, f"захвачено {len(claimed)} из {expected}"
+
+    conn = main.get_db_connection()
+    left = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+    busiest = conn.execute("""
+        SELECT COALESCE(MAX(active), 0) FROM (
+            SELECT COUNT(*) as active FROM jobs WHERE status = 'accepted' GROUP BY master_id
+        )
+    """).fetchone()[0]
+    conn.close()
+    assert left == jobs - expected, f"осталось {left} pending-заказов, ожидалось {jobs - expected}"
+    assert busiest <= main.MAX_ACTIVE_JOBS_PER_MASTER, \
+        f"у мастера {busiest} активных заказов при лимите {main.MAX_ACTIVE_JOBS_PER_MASTER}"
+
+    print(f"мастеров={masters} заказов={jobs} лимит={main.MAX_ACTIVE_JOBS_PER_MASTER} время={elapsed:.2f}s "
+          f"пропускная способность={len(claimed) / elapsed:.0f} захватов/с")
+    report("задержка claim", latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--masters", type=int, default=300)
+    parser.add_argument("--jobs", type=int, default=3000)
+    parser.add_argument("--max-active", type=int, default=0, help="лимит активных заказов (0 - без лимита)")
+    args = parser.parse_args()
+    run(args.masters, args.jobs, args.max_active)
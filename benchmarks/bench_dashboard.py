@@ -0,0 +1,118 @@
+"""
+Панель терминала: один запрос против трёх и условный запрос с ETag
+
+БД генерируется datagen.py, сервер - uvicorn в отдельном процессе.
+Сравниваются: прежняя последовательность active + jobs + earnings,
+/dashboard и /dashboard с If-None-Match (304). Помимо локальной задержки
+выводится оценка для мобильной сети: + RTT на каждый последовательный запрос.
+
+    python benchmarks/bench_dashboard.py --jobs 1000000 --masters 20000 --rtt-ms 80
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from _common import ROOT, main, percentile
+from bench_upload import free_port
+from datagen import generate
+
+
+def summary(title: str, latencies: list, sizes: list, round_trips: int, rtt_ms: float) -> None:
+    p50, p95 = percentile(latencies, 50), percentile(latencies, 95)
+    print(f"{title:34} p50={p50:7.2f}ms p95={p95:7.2f}ms  тело p50={percentile(sizes, 50) / 1024:7.1f}КБ  "
+          f"с RTT {rtt_ms:g}ms: p50~{p50 + round_trips * rtt_ms:.0f}ms")
+
+
+def run(jobs: int, masters: int, samples: int, rtt_ms: float) -> None:
+    workdir = tempfile.mkdtemp(prefix="ai_service_dashboard_")
+    path = os.path.join(workdir, "bench.db")
+    generate(path, masters, jobs)
+
+    # Выборка мастеров: половина - самые загруженные (длинная история), половина - случайные
+    conn = main.get_db_connection()
+    heavy = [row[0] for row in conn.execute(
+        "SELECT master_id FROM jobs WHERE master_id IS NOT NULL GROUP BY master_id ORDER BY COUNT(*) DESC LIMIT ?",
+        (samples // 2,)
+    )]
+    conn.close()
+    sample = heavy + [random.randint(1, masters) for _ in range(samples - len(heavy))]
+
+    port = free_port()
+    env = dict(os.environ, DATABASE_PATH=path, ARCHIVE_DATABASE_PATH=path + ".archive",
+               DISPATCH_INTERVAL_SECONDS="0", NOTIFY_INTERVAL_SECONDS="0", PRESENCE_FLUSH_SECONDS="0",
+               THUMBNAIL_WORKERS="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--no-access-log"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            for _ in range(100):
+                try:
+                    client.get("/health")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+
+            results = {"three": ([], []), "dashboard": ([], []), "revalidate": ([], [])}
+            etags = {}
+            for master_id in sample:
+                started = time.perf_counter()
+                size = 0
+                for url in (f"/api/v1/terminal/jobs/{master_id}/active",
+                            f"/api/v1/terminal/jobs/{master_id}",
+                            f"/api/v1/terminal/earnings/{master_id}"):
+                    size += len(client.get(url).content)
+                results["three"][0].append((time.perf_counter() - started) * 1000)
+                results["three"][1].append(size)
+
+                started = time.perf_counter()
+                response = client.get(f"/api/v1/terminal/{master_id}/dashboard")
+                results["dashboard"][0].append((time.perf_counter() - started) * 1000)
+                results["dashboard"][1].append(len(response.content))
+                etags[master_id] = response.headers["etag"]
+
+                started = time.perf_counter()
+                response = client.get(f"/api/v1/terminal/{master_id}/dashboard",
+                                      headers={"If-None-Match": etags[master_id]})
+                results["revalidate"][0].append((time.perf_counter() - started) * 1000)
+                results["revalidate"][1].append(len(response.content))
+                assert response.status_code == 304
+
+            print()
+            summary("3 запроса (active, jobs, earnings)", *results["three"], 3, rtt_ms)
+            summary("/dashboard", *results["dashboard"], 1, rtt_ms)
+            summary("/dashboard, не изменилась (304)", *results["revalidate"], 1, rtt_ms)
+
+            # Смена статуса меняет версию: старый ETag больше не даёт 304
+            master_id = heavy[0]
+            conn = main.get_db_connection()
+            job = conn.execute("SELECT id FROM jobs WHERE master_id = ? AND status = 'accepted' LIMIT 1",
+                               (master_id,)).fetchone()
+            conn.close()
+            if job:
+                client.patch(f"/api/v1/terminal/jobs/{master_id}/status/{job[0]}", json={"status": "in_progress"})
+                response = client.get(f"/api/v1/terminal/{master_id}/dashboard",
+                                      headers={"If-None-Match": etags[master_id]})
+                print(f"\nпосле смены статуса: {response.status_code}, ETag {etags[master_id]} -> "
+                      f"{response.headers['etag']}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=1000000)
+    parser.add_argument("--masters", type=int, default=20000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=80)
+    args = parser.parse_args()
+    run(args.jobs, args.masters, args.samples, args.rtt_ms)
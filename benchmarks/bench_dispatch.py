@@ -0,0 +1,93 @@
+"""
+Фоновый диспетчер: один цикл распределения большого бэклога pending-заказов
+
+Проверяет лимит загрузки мастеров и приоритет срочных заказов,
+выводит время цикла и остаток очереди.
+
+    python benchmarks/bench_dispatch.py --jobs 100000 --masters 2000
+"""
+import argparse
+import json
+import random
+import time
+
+from _common import main, setup_db
+
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Калининград"]
+CATEGORIES = ["electrical", "plumbing", "appliance", "general"]
+
+
+def seed(jobs: int, masters: int) -> None:
+    rng = random.Random(42)
+    conn = main.get_db_connection()
+    conn.executemany(
+        """INSERT INTO masters (full_name, phone, specializations, city, rating, terminal_active)
+           VALUES (?, ?, ?, ?, ?, 1)""",
+        [(f"Мастер {i}", f"+7900{i:07d}",
+          json.dumps(rng.sample(CATEGORIES, rng.randint(1, 2))),
+          rng.choice(CITIES), round(rng.uniform(3.5, 5.0), 1))
+         for i in range(masters)],
+    )
+    conn.executemany(
+        """INSERT INTO jobs (client_name, client_phone, category, problem_description, address, city)
+           VALUES ('Клиент', '+79990000000', ?, ?, 'ул. Ленина, 1', ?)""",
+        [(rng.choice(CATEGORIES),
+          "Срочно! Течёт кран на кухне" if rng.random() < 0.1 else "Течёт кран на кухне",
+          rng.choice(CITIES))
+         for _ in range(jobs)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def check(conn) -> None:
+    over = conn.execute(
+        """SELECT COUNT(*) FROM (
+               SELECT master_id FROM jobs WHERE status IN ('accepted', 'in_progress')
+               GROUP BY master_id HAVING COUNT(*) > ?)""",
+        (main.MAX_ACTIVE_JOBS_PER_MASTER,),
+    ).fetchone()[0]
+    assert over == 0, f"{over} мастеров превысили лимит загрузки"
+
+    # В каждой корзине (город, категория) обычный заказ не может быть назначен,
+    # пока в ней остаётся срочный
+    rows = conn.execute(
+        "SELECT city, category, status, problem_description FROM jobs"
+    ).fetchall()
+    urgent_pending, normal_assigned = set(), set()
+    for row in rows:
+        key = (row["city"], row["category"])
+        if main.is_urgent(row["problem_description"]):
+            if row["status"] == "pending":
+                urgent_pending.add(key)
+        elif row["status"] == "accepted":
+            normal_assigned.add(key)
+    assert not urgent_pending & normal_assigned, "срочные заказы обойдены обычными"
+
+
+def run(jobs: int, masters: int) -> None:
+    setup_db()
+    seed(jobs, masters)
+
+    started = time.perf_counter()
+    first = main.dispatch_pending_jobs()
+    wall = (time.perf_counter() - started) * 1000
+    print(f"цикл 1: назначено={first['last_assigned']} бэклог={first['backlog']} "
+          f"срочных в бэклоге={first['urgent_backlog']} время={wall:.0f}ms")
+
+    conn = main.get_db_connection()
+    check(conn)
+    conn.close()
+
+    # Повторный цикл при полностью загруженных мастерах - чистый проход по бэклогу
+    second = main.dispatch_pending_jobs()
+    print(f"цикл 2: назначено={second['last_assigned']} бэклог={second['backlog']} "
+          f"время={second['last_cycle_ms']:.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=100_000)
+    parser.add_argument("--masters", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.jobs, args.masters)
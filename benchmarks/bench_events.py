@@ -0,0 +1,184 @@
+"""
+Журнал событий заказов: цена записи, потребители и статистика
+
+1) Смена статуса: транзакция UPDATE с триггерами журнала и проверки
+   переходов против той же транзакции без них.
+2) Пропускная способность потребителя status_counts (событий/с).
+3) Недопустимые переходы отклоняются и обработчиком, и триггером в БД.
+4) /api/v1/stats на БД из datagen.py: сканирование jobs против счётчиков
+   job_status_counts; после случайных переходов счётчики сверяются с
+   GROUP BY по таблице.
+
+    python benchmarks/bench_events.py --transitions 20000 --jobs 1000000 --masters 20000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from fastapi import HTTPException
+
+from _common import main, report, setup_db
+from datagen import generate
+
+EVENT_TRIGGERS = ("jobs_status_guard", "jobs_events_insert", "jobs_events_update")
+LIFECYCLE = ("accepted", "in_progress", "completed")
+
+
+def seed_jobs(count: int) -> list:
+    conn = main.get_db_connection()
+    conn.execute("INSERT INTO masters (full_name, phone, specializations, city) "
+                 "VALUES ('Мастер', '+79000000000', '[\"electrical\"]', 'Москва')")
+    conn.executemany(
+        "INSERT INTO jobs (client_name, client_phone, category, problem_description, address, city, status) "
+        "VALUES ('Анна', ?, 'electrical', 'Не работает розетка', 'ул. Ленина, 1', 'Москва', 'pending')",
+        [(f"+7911{i:07d}",) for i in range(count)],
+    )
+    conn.commit()
+    ids = [row[0] for row in conn.execute("SELECT id FROM jobs WHERE status = 'pending' ORDER BY id")]
+    conn.close()
+    return ids
+
+
+def transitions(job_ids: list) -> list:
+    """Задержки (мс) транзакций смены статуса: каждый заказ проходит весь жизненный цикл"""
+    conn = main.get_db_connection()
+    latencies = []
+    for status in LIFECYCLE:
+        for job_id in job_ids:
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE jobs SET status = ?, master_id = 1 WHERE id = ?", (status, job_id))
+            conn.commit()
+            latencies.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    return latencies
+
+
+def write_overhead(count: int) -> None:
+    job_ids = seed_jobs(count * 2)
+    with_log, without_log = job_ids[:count], job_ids[count:]
+
+    conn = main.get_db_connection()
+    ddl = [row[0] for row in conn.execute(
+        f"SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({','.join('?' * len(EVENT_TRIGGERS))})",
+        EVENT_TRIGGERS,
+    )]
+    for name in EVENT_TRIGGERS:
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.commit()
+    plain = transitions(without_log)
+    for sql in ddl:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+    logged = transitions(with_log)
+
+    report("смена статуса без журнала", plain)
+    report("смена статуса с журналом  ", logged)
+    print(f"  накладные расходы: {sum(logged) / sum(plain) * 100 - 100:+.1f}% среднего времени транзакции")
+
+
+def consumer_throughput() -> None:
+    conn = main.get_db_connection()
+    conn.execute("DELETE FROM event_consumers")
+    conn.execute("INSERT INTO event_consumers (name, position) VALUES ('status_counts', 0)")
+    conn.execute("DELETE FROM job_status_counts")
+    conn.commit()
+    backlog = conn.execute("SELECT COUNT(*) FROM job_events").fetchone()[0]
+    conn.close()
+
+    started = time.perf_counter()
+    processed = main.run_job_event_consumers()["status_counts"]
+    elapsed = time.perf_counter() - started
+    print(f"потребитель status_counts: {processed:,} из {backlog:,} событий за {elapsed * 1000:.0f}ms "
+          f"({processed / elapsed:,.0f} событий/с, пачка {main.JOB_EVENTS_BATCH_SIZE})")
+
+
+def rejected_transitions() -> None:
+    conn = main.get_db_connection()
+    job = conn.execute("SELECT id, master_id FROM jobs WHERE status = 'completed' LIMIT 1").fetchone()
+    try:
+        conn.execute("UPDATE jobs SET status = 'pending' WHERE id = ?", (job['id'],))
+        print("триггер: переход completed -> pending ПРОПУЩЕН")
+    except main.sqlite3.IntegrityError as e:
+        print(f"триггер: completed -> pending отклонён ({e})")
+    conn.rollback()
+    conn.close()
+
+    try:
+        asyncio.run(main.update_job_status(job['master_id'], job['id'], main.JobStatusUpdate(status="accepted")))
+        print("обработчик: переход completed -> accepted ПРОПУЩЕН")
+    except HTTPException as e:
+        print(f"обработчик: {e.status_code} {e.detail}")
+
+
+def stats_latency(jobs: int, masters: int, samples: int) -> None:
+    path = os.path.join(tempfile.mkdtemp(prefix="ai_service_events_"), "bench.db")
+    generate(path, masters, jobs)
+    main.ARCHIVE_DATABASE_PATH = path + ".archive"
+
+    def measure() -> list:
+        latencies = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            result = asyncio.run(main.get_statistics())
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies, result
+
+    scan, expected = measure()
+    main.run_job_event_consumers()  # первый запуск: счётчики строятся по таблице
+    derived, actual = measure()
+    report(f"/api/v1/stats, сканирование {jobs:,} заказов", scan)
+    report(f"/api/v1/stats, job_status_counts       ", derived)
+    print(f"  совпадение с подсчётом по таблице: {expected['jobs'] == actual['jobs']}")
+
+    # Случайные переходы: часть событий обработана, хвост - нет
+    conn = main.get_db_connection()
+    rng = random.Random(1)
+    active = [tuple(row) for row in conn.execute(
+        "SELECT id, status FROM jobs WHERE status IN ('pending', 'accepted', 'in_progress') LIMIT 20000"
+    )]
+    conn.close()
+    for index, (job_id, status) in enumerate(active):
+        conn = main.get_db_connection()
+        conn.execute("UPDATE jobs SET status = ?, master_id = COALESCE(master_id, 1) WHERE id = ?",
+                     (rng.choice(main.JOB_TRANSITIONS[status]), job_id))
+        conn.commit()
+        conn.close()
+        if index == len(active) // 2:
+            main.run_job_event_consumers()
+
+    conn = main.get_db_connection()
+    truth = {row[0]: row[1] for row in conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+    conn.close()
+    with_tail = asyncio.run(main.get_statistics())["jobs"]["by_status"]
+    main.run_job_event_consumers()
+    caught_up = asyncio.run(main.get_statistics())["jobs"]["by_status"]
+    print(f"после {len(active):,} переходов: счётчики+хвост == GROUP BY: {with_tail == truth}, "
+          f"после догоняния: {caught_up == truth}")
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def run(args) -> None:
+    setup_db()
+    main.ARCHIVE_DATABASE_PATH = main.DATABASE_PATH + ".archive"
+    write_overhead(args.transitions)
+    consumer_throughput()
+    rejected_transitions()
+    if args.jobs:
+        stats_latency(args.jobs, args.masters, args.samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transitions", type=int, default=20000, help="заказов на каждый вариант записи")
+    parser.add_argument("--jobs", type=int, default=1000000, help="0 - без замера статистики")
+    parser.add_argument("--masters", type=int, default=20000)
+    parser.add_argument("--samples", type=int, default=20)
+    run(parser.parse_args())
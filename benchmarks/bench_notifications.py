@@ -0,0 +1,164 @@
+"""
+Уведомления через outbox: задержка приёма заявки и доставка
+
+Поднимает заглушку провайдеров (notify_stub.py) в отдельном процессе.
+1) Приём заявок /api/v1/ai/web-form: outbox в транзакции заказа против
+   отправки двух уведомлений прямо в обработчике.
+2) Доставка накопленной очереди: пропускная способность по каналам,
+   задержка от постановки в outbox до ответа провайдера, повторы
+   при ошибках 500/429, дубли и пиковый темп на стороне провайдера.
+
+    python benchmarks/bench_notifications.py --jobs 1000 --latency-ms 50 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from _common import ROOT, main, percentile, report, setup_db
+from bench_upload import free_port
+
+FORM = {
+    "name": "Анна", "phone": "+79001112233", "category": "electrical",
+    "problem_description": "Не работает розетка на кухне", "address": "ул. Баумана, 1",
+}
+
+
+def seed_masters(masters: int) -> None:
+    conn = main.get_db_connection()
+    conn.executemany(
+        "INSERT INTO masters (full_name, phone, specializations, city, terminal_active, telegram_chat_id) "
+        "VALUES (?, ?, '[\"electrical\"]', 'Москва', 1, ?)",
+        [(f"Мастер {i}", f"+7900{i:07d}", str(100000 + i) if i % 2 == 0 else None) for i in range(masters)],
+    )
+    conn.commit()
+    conn.close()
+
+
+async def intake(client: httpx.AsyncClient, stub: httpx.AsyncClient, jobs: int, inline: bool) -> list:
+    latencies = []
+    for i in range(jobs):
+        started = time.perf_counter()
+        response = await client.post("/api/v1/ai/web-form", json=dict(FORM, phone=f"+7911{i:07d}"))
+        response.raise_for_status()
+        if inline:
+            # Так выглядела бы отправка прямо в обработчике: мастеру и клиенту
+            await stub.post(f"/bot{main.TELEGRAM_BOT_TOKEN}/sendMessage", json={"chat_id": "1", "text": "inline"})
+            await stub.post("/sms", json={"to": FORM["phone"], "text": "inline"})
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def outbox_summary() -> dict:
+    conn = main.get_db_connection()
+    rows = conn.execute("""
+        SELECT channel, status, COUNT(*) as count, MIN(enqueued_at) as first_enqueued,
+            MAX(sent_at) as last_sent, SUM(attempts) as attempts
+        FROM notifications GROUP BY channel, status
+    """).fetchall()
+    lags = [row[0] * 1000 for row in conn.execute(
+        "SELECT sent_at - enqueued_at FROM notifications WHERE status = 'sent'"
+    )]
+    conn.close()
+    return {"rows": [dict(row) for row in rows], "lags": lags}
+
+
+async def run(args) -> None:
+    port = free_port()
+    stub_env = dict(
+        os.environ,
+        STUB_LATENCY_MS=str(args.latency_ms),
+        STUB_ERROR_RATE=str(args.error_rate),
+        STUB_RATE_LIMIT=str(args.stub_rate_limit),
+    )
+    stub_process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "notify_stub:app", "--app-dir", str(ROOT / "benchmarks"),
+         "--port", str(port), "--log-level", "warning"],
+        env=stub_env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        setup_db()
+        seed_masters(args.masters)
+        main.MAX_ACTIVE_JOBS_PER_MASTER = 10 ** 9
+        main.TELEGRAM_BOT_TOKEN = "bench"
+        main.TELEGRAM_API_URL = base
+        main.SMS_API_URL = f"{base}/sms"
+        main.NOTIFY_RETRY_BASE_SECONDS = 0.2
+        main.NOTIFY_CHANNEL_LIMITS = {
+            "telegram": (args.concurrency, args.rate),
+            "sms": (args.concurrency, args.rate),
+        }
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(base_url=base) as stub, \
+                httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(100):
+                try:
+                    await stub.get("/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+            inline = await intake(client, stub, min(200, args.jobs), inline=True)
+            report("приём заявки, отправка в обработчике", inline)
+            outbox = await intake(client, stub, args.jobs, inline=False)
+            report("приём заявки, outbox           ", outbox)
+            await stub.post("/reset")
+
+            # Очередь накоплена - доставляем её так же, как фоновый цикл
+            conn = main.get_db_connection()
+            conn.execute("DELETE FROM notifications WHERE job_id IN (SELECT id FROM jobs ORDER BY id LIMIT ?)",
+                         (min(200, args.jobs),))
+            conn.execute("UPDATE notifications SET enqueued_at = ?, next_attempt_at = ?", (time.time(), time.time()))
+            conn.commit()
+            queued = conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+            conn.close()
+
+            started = time.perf_counter()
+            while True:
+                counts = await main.drain_notifications(args.batch)
+                if counts["claimed"]:
+                    continue
+                conn = main.get_db_connection()
+                left = conn.execute(
+                    "SELECT COUNT(*) FROM notifications WHERE status IN ('pending', 'sending')"
+                ).fetchone()[0]
+                conn.close()
+                if not left:
+                    break
+                await asyncio.sleep(0.05)  # ждём срок повтора
+            elapsed = time.perf_counter() - started
+            await main.close_notification_senders()
+
+            summary = outbox_summary()
+            provider = (await stub.get("/stats")).json()
+
+        print(f"\nдоставка {queued} уведомлений: {elapsed:.1f}s, {queued / elapsed:.0f} сообщ/с "
+              f"(лимит {args.rate:g}/с на канал, параллельность {args.concurrency})")
+        for row in summary["rows"]:
+            print(f"  {row['channel']:8} {row['status']:7} {row['count']:6} попыток={row['attempts']}")
+        report("задержка доставки (outbox -> провайдер)", summary["lags"])
+        print(f"  p99 задержки: {percentile(summary['lags'], 99):.0f}ms")
+        for name, state in provider.items():
+            print(f"  провайдер {name}: {state}")
+    finally:
+        stub_process.terminate()
+        stub_process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--masters", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--stub-rate-limit", type=int, default=0, help="429 сверх N сообщений/с на канал")
+    parser.add_argument("--rate", type=float, default=300, help="темп отправки на канал, сообщ/с")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,183 @@
+"""
+Присутствие мастеров: пропускная способность heartbeat и пакетный сброс
+
+1) record_heartbeat в процессе.
+2) POST /api/v1/terminal/{id}/heartbeat через весь ASGI-стек приложения
+   (для сравнения - GET /health через роутинг FastAPI).
+3) Реальный HTTP: uvicorn в отдельном процессе, клиент на сырых сокетах с
+   keep-alive. Ёмкость воркера = запросов / CPU-время сервера, поэтому
+   результат не зависит от того, что клиент делит с сервером ядро.
+4) Сброс в БД: сколько строк пишет flush_presence и за какое время.
+5) Истечение TTL: замолчавшие мастера гаснут в БД и не получают заказы.
+
+    python benchmarks/bench_presence.py --masters 100000 --heartbeats 500000 --http-seconds 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+from _common import ROOT, main, setup_db
+from bench_upload import free_port
+
+
+def seed_masters(masters: int) -> None:
+    conn = main.get_db_connection()
+    conn.executemany(
+        "INSERT INTO masters (full_name, phone, specializations, city) VALUES (?, ?, '[\"electrical\"]', 'Москва')",
+        [(f"Мастер {i}", f"+7900{i:07d}") for i in range(masters)],
+    )
+    conn.commit()
+    conn.close()
+
+
+async def asgi_call(method: str, path: str) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await main.app(scope, receive, send)
+    return status[0]
+
+
+async def asgi_throughput(masters: int, requests: int) -> None:
+    ids = [random.randint(1, masters) for _ in range(requests)]
+    started = time.perf_counter()
+    for master_id in ids:
+        assert await asgi_call("POST", f"/api/v1/terminal/{master_id}/heartbeat") == 200
+    heartbeat_rate = requests / (time.perf_counter() - started)
+
+    count = max(1, requests // 10)
+    started = time.perf_counter()
+    for _ in range(count):
+        await asgi_call("GET", "/health")
+    health_rate = count / (time.perf_counter() - started)
+    print(f"ASGI-стек: heartbeat {heartbeat_rate:,.0f}/с, GET /health через FastAPI {health_rate:,.0f}/с")
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def http_connection(port: int, masters: int, deadline: float, counter: list) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    while time.monotonic() < deadline:
+        writer.write(f"POST /api/v1/terminal/{random.randint(1, masters)}/heartbeat HTTP/1.1\r\n"
+                     f"Host: bench\r\nContent-Length: 0\r\n\r\n".encode())
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+        await reader.readexactly(length)
+        counter[0] += 1
+    writer.close()
+
+
+async def http_throughput(path: str, masters: int, seconds: float, connections: int) -> None:
+    port = free_port()
+    env = dict(os.environ, DATABASE_PATH=path, DISPATCH_INTERVAL_SECONDS="0", NOTIFY_INTERVAL_SECONDS="0",
+               THUMBNAIL_WORKERS="0", TRACE_SLOW_MS="0", ARCHIVE_DATABASE_PATH=path + ".archive")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--no-access-log"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        for _ in range(100):
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.close()
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        counter = [0]
+        await asyncio.gather(*(http_connection(port, masters, time.monotonic() + 0.5, [0])
+                               for _ in range(connections)))  # прогрев
+        cpu_before = cpu_seconds(server.pid)
+        started = time.perf_counter()
+        await asyncio.gather(*(http_connection(port, masters, time.monotonic() + seconds, counter)
+                               for _ in range(connections)))
+        elapsed = time.perf_counter() - started
+        server_cpu = cpu_seconds(server.pid) - cpu_before
+        print(f"HTTP (uvicorn, {connections} соединений): {counter[0] / elapsed:,.0f}/с по часам, "
+              f"CPU сервера {server_cpu * 1e6 / counter[0]:.1f} мкс/запрос -> "
+              f"ёмкость воркера {counter[0] / server_cpu:,.0f} heartbeat/с")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def flush_and_expiry(masters: int) -> None:
+    # Все мастера отметились - первый сброс пишет каждого
+    for master_id in range(1, masters + 1):
+        main.record_heartbeat(master_id)
+    stats = await main.flush_presence()
+    print(f"сброс {stats['last_written']:,} отметок: {stats['last_flush_ms']:.0f}ms")
+
+    # Повторные heartbeat в пределах PRESENCE_WRITE_INTERVAL в БД не пишутся
+    for master_id in range(1, masters + 1):
+        main.record_heartbeat(master_id)
+    stats = await main.flush_presence()
+    print(f"повторный сброс через <{main.PRESENCE_WRITE_INTERVAL}s: записано {stats['last_written']} строк")
+
+    # Половина мастеров замолкает: после TTL они гаснут и не получают заказы
+    main.PRESENCE_TTL_SECONDS = 2
+    main.PRESENCE_WRITE_INTERVAL = 1
+    silent = set(range(1, masters + 1, 2))
+    deadline = time.time() + main.PRESENCE_TTL_SECONDS + 1.5
+    while time.time() < deadline:
+        for master_id in range(2, masters + 1, 2):
+            main.record_heartbeat(master_id)
+        await main.flush_presence()
+        await asyncio.sleep(0.5)
+    stats = await main.flush_presence()
+
+    conn = main.get_db_connection()
+    active = conn.execute("SELECT COUNT(*) FROM masters WHERE terminal_active = 1").fetchone()[0]
+    conn.close()
+    picked = {main.find_available_master("electrical", "Москва") for _ in range(200)}
+    with main.master_load_lock:
+        main.master_load.clear()
+    print(f"после TTL: terminal_active={active:,} из {masters:,} (ожидалось {masters - len(silent):,}), "
+          f"замолчавших среди подобранных: {len(picked & silent)}")
+
+
+async def run(args) -> None:
+    path = setup_db()
+    seed_masters(args.masters)
+
+    ids = [random.randint(1, args.masters) for _ in range(args.heartbeats)]
+    main.grow_presence(args.masters)
+    started = time.perf_counter()
+    for master_id in ids:
+        main.record_heartbeat(master_id)
+    print(f"record_heartbeat: {args.heartbeats / (time.perf_counter() - started):,.0f}/с, "
+          f"таблица {len(main.presence_seen) * main.presence_seen.itemsize * 2 / 1024:.0f} КБ "
+          f"на {args.masters:,} мастеров")
+
+    await asgi_throughput(args.masters, min(args.heartbeats, 50000))
+    if args.http_seconds > 0:
+        await http_throughput(path, args.masters, args.http_seconds, args.connections)
+    await flush_and_expiry(args.masters)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--masters", type=int, default=100000)
+    parser.add_argument("--heartbeats", type=int, default=500000)
+    parser.add_argument("--http-seconds", type=float, default=5)
+    parser.add_argument("--connections", type=int, default=32)
+    asyncio.run(run(parser.parse_args()))
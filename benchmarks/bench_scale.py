@@ -0,0 +1,157 @@
+"""
+Масштабирование SQL-запросов приложения на синтетических данных
+
+Для каждой точки масштаба генерируется БД (datagen.py), после чего
+обработчики терминала, подбор мастера, поиск, статистика и диспетчер
+вызываются под активным трейсом: каждый их SQL-запрос попадает в спан
+db.execute, так что тексты запросов не дублируются в бенчмарке. В отчёте -
+медиана каждого запроса в каждой точке и показатель роста k (время ~ N^k):
+k около 0 - запрос идёт по индексу, k около 1 - полный просмотр.
+
+    python benchmarks/bench_scale.py --scales 100000,1000000,5000000 --csv scale.csv
+"""
+import argparse
+import asyncio
+import csv
+import math
+import os
+import random
+import tempfile
+import time
+
+from _common import main, percentile
+from datagen import generate
+
+
+def traced(call):
+    """Выполнить вызов под трейсом; вернуть [(запрос, мс)] в порядке выполнения"""
+    trace = main.Trace(sampled=True)
+    token = main.current_trace.set(trace)
+    try:
+        call()
+    finally:
+        main.current_trace.reset(token)
+    statements = []
+    for _, _, name, start, end, attributes in sorted(trace.spans, key=lambda span: span[3]):
+        duration = (end - start) / 1e6
+        if name in ("db.execute", "db.executemany"):
+            statements.append([attributes["db.statement"], duration])
+        elif name == "db.fetchall" and statements:
+            statements[-1][1] += duration
+    return statements
+
+
+def operations(loop, masters: int, rng: random.Random) -> list:
+    """(название, вызов, повторов) - горячие пути приложения"""
+    def master():
+        return rng.randint(1, masters)
+
+    def find_master():
+        with main.master_load_lock:
+            main.master_load.clear()
+        main.find_available_master(rng.choice(("plumbing", "electrical")), "Москва")
+
+    return [
+        ("find_available_master", find_master, 1),
+        ("get_master_jobs", lambda: loop.run_until_complete(main.get_master_jobs(master())), 1),
+        ("get_master_jobs?status", lambda: loop.run_until_complete(main.get_master_jobs(master(), "completed")), 1),
+        ("get_active_job", lambda: loop.run_until_complete(main.get_active_job(master())), 1),
+        ("get_master_earnings", lambda: loop.run_until_complete(main.get_master_earnings(master())), 1),
+        ("search_jobs", lambda: main.search_jobs(rng.choice(("кран", "розетка", "Ленина")), limit=20), 1),
+        ("claim_pending_job", lambda: main.claim_pending_job(master()), 1),
+        ("get_statistics", lambda: loop.run_until_complete(main.get_statistics()), 0.2),
+        # Диспетчер назначает все pending-заказы, поэтому запускается последним и один раз
+        ("dispatch_pending_jobs", main.dispatch_pending_jobs, 0),
+    ]
+
+
+def measure(path: str, masters: int, repeat: int, seed: int) -> dict:
+    """{(операция, №, запрос): [мс, ...]} для одной БД"""
+    main.DATABASE_PATH = path
+    main.ARCHIVE_DATABASE_PATH = path + ".archive"  # без архива: только живые таблицы
+    main.sync_master_loads()
+    rng = random.Random(seed)
+    loop = asyncio.new_event_loop()
+    timings = {}
+    for name, call, share in operations(loop, masters, rng):
+        runs = max(1, int(repeat * share))
+        for _ in range(runs):
+            for index, (statement, ms) in enumerate(traced(call)):
+                timings.setdefault((name, index, statement), []).append(ms)
+    loop.close()
+    return timings
+
+
+def growth(scales: list, medians: list) -> str:
+    """Показатель k из time ~ N^k по крайним точкам"""
+    pairs = [(n, t) for n, t in zip(scales, medians) if t is not None and t > 0]
+    if len(pairs) < 2:
+        return "-"
+    (n0, t0), (n1, t1) = pairs[0], pairs[-1]
+    return f"{math.log(t1 / t0) / math.log(n1 / n0):.2f}"
+
+
+def run(scales: list, masters_ratio: float, repeat: int, seed: int, workdir: str, csv_path: str) -> None:
+    results = {}
+    for jobs in scales:
+        masters = max(100, int(jobs * masters_ratio))
+        path = os.path.join(workdir, f"scale_{jobs}.db")
+        generate(path, masters, jobs, seed)
+        started = time.perf_counter()
+        results[jobs] = measure(path, masters, repeat, seed)
+        print(f"  замеры: {time.perf_counter() - started:.1f}s")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    keys = []
+    for timings in results.values():
+        keys.extend(key for key in timings if key not in keys)
+
+    header = ["операция", "запрос"] + [f"N={jobs:,}" for jobs in scales] + ["k"]
+    rows = []
+    for name, index, statement in keys:
+        medians = [
+            percentile(results[jobs][(name, index, statement)], 50) if (name, index, statement) in results[jobs] else None
+            for jobs in scales
+        ]
+        rows.append([name, f"#{index + 1} {statement[:70]}"]
+                    + [f"{ms:.2f}" if ms is not None else "-" for ms in medians]
+                    + [growth(scales, medians)])
+
+    print()
+    print("| " + " | ".join(header) + " |")
+    print("|" + "---|" * len(header))
+    for row in rows:
+        print("| " + " | ".join(row) + " |")
+    print("\nМедиана в мс; k - показатель роста (время ~ N^k), k > 0.5 - запрос растёт с объёмом данных.")
+
+    if csv_path:
+        with open(csv_path, "w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(["operation", "index", "statement"] + [f"p50_ms_{jobs}" for jobs in scales]
+                            + [f"p95_ms_{jobs}" for jobs in scales])
+            for name, index, statement in keys:
+                values = [results[jobs].get((name, index, statement), []) for jobs in scales]
+                writer.writerow([name, index + 1, statement]
+                                + [f"{percentile(v, 50):.3f}" if v else "" for v in values]
+                                + [f"{percentile(v, 95):.3f}" if v else "" for v in values])
+        print(f"CSV: {csv_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", default="100000,1000000",
+                        help="число заказов в каждой точке через запятую (до 50000000)")
+    parser.add_argument("--masters-ratio", type=float, default=0.02,
+                        help="мастеров на заказ (1M мастеров на 50M заказов = 0.02)")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", default=None, help="каталог для БД (по умолчанию временный)")
+    parser.add_argument("--csv", default=None)
+    args = parser.parse_args()
+    run(
+        [int(value) for value in args.scales.split(",")],
+        args.masters_ratio, args.repeat, args.seed,
+        args.workdir or tempfile.mkdtemp(prefix="ai_service_scale_"), args.csv,
+    )
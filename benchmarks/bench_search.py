@@ -0,0 +1,105 @@
+"""
+Полнотекстовый поиск заказов: задержка запросов на миллионе заказов
+
+    python benchmarks/bench_search.py --jobs 1000000
+"""
+import argparse
+import random
+import time
+
+from _common import main, report, setup_db
+
+PROBLEMS = [
+    "Протекает кран на кухне", "Течёт труба под раковиной", "Не работает розетка",
+    "Искрит выключатель в коридоре", "Сломалась стиральная машина", "Не греет бойлер",
+    "Засор в ванной", "Выбивает автомат при включении чайника", "Холодильник не морозит",
+    "Нужно повесить люстру", "Протекающий стояк в туалете", "Мигает свет в комнате",
+]
+DETAILS = ["срочно", "вечером", "после 18:00", "есть фото", "второй раз за месяц", "", ""]
+STREETS = [
+    "ул. Ленина", "Ленинградский проспект", "ул. Пушкина", "Проспект Мира", "ул. Гагарина",
+    "ул. Советская", "Садовая ул.", "ул. Кирова", "Набережная ул.", "ул. Чехова",
+]
+CATEGORIES = ["electrical", "plumbing", "appliance", "general"]
+STATUSES = ["pending", "accepted", "in_progress", "completed", "completed", "completed", "cancelled"]
+
+QUERIES = [
+    ("частое слово", {"q": "протекает"}),
+    ("префикс", {"q": "протека"}),
+    ("два слова", {"q": "стиральная машина"}),
+    ("улица", {"q": "пушкина"}),
+    ("редкое сочетание", {"q": "люстру чехова"}),
+    ("фильтр статуса", {"q": "розетка", "status": "pending"}),
+    ("фильтр категории", {"q": "кран", "category": "plumbing"}),
+    ("фильтр мастера", {"q": "засор", "master_id": 17}),
+    ("глубокая страница", {"q": "свет", "offset": 500}),
+    ("нет совпадений", {"q": "кондиционер"}),
+]
+
+
+def seed(jobs: int) -> None:
+    rng = random.Random(1)
+    conn = main.get_db_connection()
+    batch = []
+    for i in range(jobs):
+        batch.append((
+            rng.choice(CATEGORIES),
+            f"{rng.choice(PROBLEMS)}, {rng.choice(DETAILS)}",
+            f"{rng.choice(STREETS)}, д. {rng.randint(1, 200)}, кв. {rng.randint(1, 300)}",
+            rng.choice(STATUSES),
+            rng.randint(1, 5000),
+        ))
+        if len(batch) == 50_000 or i == jobs - 1:
+            conn.executemany(
+                """INSERT INTO jobs (client_name, client_phone, category, problem_description,
+                                     address, status, master_id)
+                   VALUES ('Клиент', '+79990000000', ?, ?, ?, ?, ?)""",
+                batch,
+            )
+            conn.commit()
+            batch.clear()
+    conn.close()
+
+
+def run(jobs: int, repeat: int) -> None:
+    setup_db()
+    started = time.perf_counter()
+    seed(jobs)
+    print(f"загружено {jobs} заказов (с индексированием триггерами) за {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    main.rebuild_job_search_index()
+    print(f"fts-rebuild: {time.perf_counter() - started:.1f}s")
+
+    for title, params in QUERIES:
+        latencies = []
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            result = main.search_jobs(
+                params["q"], params.get("status"), params.get("category"),
+                params.get("master_id"), 20, params.get("offset", 0),
+            )
+            latencies.append((time.perf_counter() - begin) * 1000)
+        report(f"{title:<18} ({len(result['jobs'])} строк)", latencies)
+
+    # Для сравнения: прежний способ - LIKE со сканированием всей таблицы
+    latencies = []
+    conn = main.get_db_connection()
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        conn.execute(
+            """SELECT id FROM jobs
+               WHERE problem_description LIKE '%кондиционер%' OR address LIKE '%кондиционер%'
+               LIMIT 20"""
+        ).fetchall()
+        latencies.append((time.perf_counter() - begin) * 1000)
+    conn.close()
+    report("LIKE нет совпадений", latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run(args.jobs, args.repeat)
@@ -0,0 +1,96 @@
+"""
+Симуляция выбора мастера: выполненные заказы в час для каждой стратегии
+
+Дискретно-событийная модель одного города и категории: заказы приходят
+пуассоновским потоком, мастер выполняет свои заказы по очереди.
+Назначение идёт через main.choose_master с той же таблицей загрузки,
+что и в приложении; заказ без свободного мастера ждёт освобождения
+слота (как при фоновом диспетчере).
+
+    python benchmarks/bench_selection.py --masters 20 --rate 20 --hours 8
+"""
+import argparse
+import heapq
+import random
+from collections import deque
+
+from _common import main
+
+
+def simulate(strategy: str, masters: int, rate: float, service_minutes: float,
+             hours: float, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    candidates = [(i, round(rng.uniform(3.5, 5.0), 1)) for i in range(1, masters + 1)]
+    loads = {}
+    queues = {master_id: deque() for master_id, _ in candidates}
+    busy = set()
+    pending = deque()
+    events = []  # (время в часах, тип, данные)
+
+    t = 0.0
+    while t < hours:
+        t += rng.expovariate(rate)
+        heapq.heappush(events, (t, "arrive", t))
+
+    completed = 0
+    turnaround = []
+
+    def start_next(master_id: int, now: float) -> None:
+        if master_id in busy or not queues[master_id]:
+            return
+        busy.add(master_id)
+        arrived = queues[master_id][0]
+        duration = rng.expovariate(60 / service_minutes)
+        heapq.heappush(events, (now + duration, "done", (master_id, arrived)))
+
+    def assign(arrived: float, now: float) -> bool:
+        master_id = main.choose_master(candidates, loads, strategy)
+        if master_id is None:
+            return False
+        loads[master_id] = loads.get(master_id, 0) + 1
+        queues[master_id].append(arrived)
+        start_next(master_id, now)
+        return True
+
+    while events:
+        now, kind, data = heapq.heappop(events)
+        if now > hours:
+            break
+        if kind == "arrive":
+            if not assign(data, now):
+                pending.append(data)
+        else:
+            master_id, arrived = data
+            queues[master_id].popleft()
+            busy.discard(master_id)
+            loads[master_id] -= 1
+            completed += 1
+            turnaround.append((now - arrived) * 60)
+            while pending and assign(pending[0], now):
+                pending.popleft()
+            start_next(master_id, now)
+
+    busiest = max(loads.values(), default=0)
+    return {
+        "completed_per_hour": completed / hours,
+        "mean_turnaround_min": sum(turnaround) / len(turnaround) if turnaround else 0.0,
+        "unfinished": sum(loads.values()) + len(pending),
+        "busiest_queue": busiest,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--masters", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=20.0, help="заказов в час")
+    parser.add_argument("--service-minutes", type=float, default=45.0)
+    parser.add_argument("--hours", type=float, default=8.0)
+    args = parser.parse_args()
+
+    print(f"мастеров={args.masters} поток={args.rate}/ч обслуживание={args.service_minutes}мин "
+          f"лимит={main.MAX_ACTIVE_JOBS_PER_MASTER}")
+    for strategy in ("top_rated", "load_aware"):
+        result = simulate(strategy, args.masters, args.rate, args.service_minutes, args.hours)
+        print(f"{strategy:>10}: выполнено {result['completed_per_hour']:.1f} заказов/ч, "
+              f"среднее время до завершения {result['mean_turnaround_min']:.0f} мин, "
+              f"незавершено {result['unfinished']}, макс. очередь мастера {result['busiest_queue']}")
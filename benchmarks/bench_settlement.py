@@ -0,0 +1,88 @@
+"""
+Расчёт выплат: миллион транзакций за один проход и сверка до копейки
+
+Транзакции записываются так же, как в process_payment (через
+calculate_platform_fee), а суммы, которые мастерам сообщили по каждому
+платежу, накапливаются отдельно и сверяются с таблицей payouts.
+
+    python benchmarks/bench_settlement.py --transactions 1000000 --masters 20000
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+
+from _common import main, setup_db
+
+
+def seed(transactions: int, masters: int) -> dict:
+    rng = random.Random(5)
+    expected = defaultdict(int)
+    conn = main.get_db_connection()
+    conn.executemany(
+        "INSERT INTO masters (id, full_name, phone, specializations, city) "
+        "VALUES (?, 'Мастер', ?, '[\"general\"]', 'Москва')",
+        [(i, f"+7900{i:07d}") for i in range(1, masters + 1)],
+    )
+    jobs, payments = [], []
+    for job_id in range(1, transactions + 1):
+        master_id = rng.randint(1, masters)
+        amount = round(rng.uniform(300, 20000), rng.choice([0, 2]))
+        fees = main.calculate_platform_fee(amount)
+        expected[master_id] += main.to_kopecks(fees["master_earnings"])
+        day = rng.randint(1, 30)
+        jobs.append((job_id, master_id))
+        payments.append((job_id, fees["total"], fees["platform_commission"], fees["master_earnings"],
+                         f"2026-09-{day:02d} 12:00:00"))
+        if len(jobs) == 100_000 or job_id == transactions:
+            conn.executemany(
+                "INSERT INTO jobs (id, client_name, client_phone, category, problem_description, "
+                "address, status, master_id) VALUES (?, 'Клиент', '+79990000000', 'general', "
+                "'Повесить полку', 'ул. Ленина, 1', 'completed', ?)",
+                jobs,
+            )
+            conn.executemany(
+                "INSERT INTO transactions (job_id, amount, payment_method, platform_fee, "
+                "master_earnings, created_at) VALUES (?, ?, 'card', ?, ?, ?)",
+                payments,
+            )
+            conn.commit()
+            jobs.clear()
+            payments.clear()
+    conn.close()
+    return expected
+
+
+def run(transactions: int, masters: int) -> None:
+    setup_db()
+    started = time.perf_counter()
+    expected = seed(transactions, masters)
+    print(f"загружено {transactions} транзакций за {time.perf_counter() - started:.0f}s")
+
+    result = main.settle_payouts("2026-09-01", "2026-10-01")
+    print(f"расчёт: мастеров={result['masters']} платежей={result['payments']} "
+          f"к выплате={result['payout_kopecks'] / 100:,.2f}₽ "
+          f"расхождение={result['discrepancy_kopecks']} коп. время={result['seconds']}s")
+
+    conn = main.get_db_connection()
+    payouts = dict(conn.execute(
+        "SELECT master_id, payout_kopecks FROM payouts WHERE period_start = '2026-09-01'"
+    ).fetchall())
+    conn.close()
+    mismatched = [m for m, kopecks in expected.items() if payouts.get(m) != kopecks]
+    assert not mismatched, f"выплаты расходятся с разбивками платежей: {mismatched[:10]}"
+    assert result["payments"] == transactions
+    print(f"сверка с разбивками process_payment: {len(expected)} мастеров совпали до копейки")
+
+    again = main.settle_payouts("2026-09-01", "2026-10-01")
+    assert {k: v for k, v in again.items() if k != "seconds"} == \
+        {k: v for k, v in result.items() if k != "seconds"}, "повторный расчёт изменил итоги"
+    print(f"повторный расчёт идемпотентен, время={again['seconds']}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--masters", type=int, default=20_000)
+    args = parser.parse_args()
+    run(args.transactions, args.masters)
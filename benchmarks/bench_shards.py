@@ -0,0 +1,115 @@
+"""
+Шардирование по городам: пропускная способность приёма заявок от числа шардов
+
+Несколько процессов-писателей одновременно принимают заявки через
+process_client_request (заказ, FTS, журнал событий, outbox уведомлений
+одной транзакцией). Города распределены по шардам через SHARD_CITY_MAP,
+писатель i пишет в город i % cities. При одном шарде все писатели стоят
+в очереди за одной блокировкой записи SQLite, с несколькими - пишут
+в разные файлы. Выводятся заявок/с, задержки и число ошибок
+"database is locked".
+
+    python benchmarks/bench_shards.py --shards 1,2,4 --writers 8 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from _common import percentile
+
+CITIES = ["Москва", "Казань", "Самара", "Пермь", "Уфа", "Омск", "Томск", "Сочи"]
+
+
+def shard_env(path: str, shards: int, cities: int) -> dict:
+    city_map = ";".join(f"{city}={index % shards}" for index, city in enumerate(CITIES[:cities]))
+    return dict(os.environ, DATABASE_PATH=path, ARCHIVE_DATABASE_PATH=path + ".archive",
+                SHARD_COUNT=str(shards), SHARD_CITY_MAP=city_map, TRACE_SLOW_MS="0")
+
+
+def setup(cities: int) -> None:
+    """Схема всех шардов и по мастеру на город (запускается с окружением конфигурации)"""
+    from _common import main
+    main.init_database()
+    for index, city in enumerate(CITIES[:cities]):
+        conn = main.get_db_connection(main.shard_for_city(city))
+        conn.execute("""INSERT INTO masters (full_name, phone, specializations, city, terminal_active)
+                        VALUES (?, ?, '["electrical"]', ?, 1)""", (f"Мастер {index}", f"+7900{index:07d}", city))
+        conn.commit()
+        conn.close()
+
+
+def writer(index: int, cities: int, requests: int, start_at: float) -> None:
+    """Один процесс-писатель; результат - строка JSON в stdout"""
+    from _common import main
+    city = CITIES[index % cities]
+
+    async def go() -> dict:
+        latencies, errors = [], 0
+        while time.time() < start_at:
+            await asyncio.sleep(0.001)
+        started = time.time()
+        for number in range(requests):
+            request = main.ClientRequest(
+                name="Анна", phone=f"+79{index:02d}{number:08d}", category="electrical", city=city,
+                problem_description="Не работает розетка на кухне", address="ул. Ленина, 1",
+            )
+            begin = time.perf_counter()
+            try:
+                await main.process_client_request(request)
+            except main.sqlite3.OperationalError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - begin) * 1000)
+        return {"started": started, "finished": time.time(), "latencies": latencies, "errors": errors}
+
+    print(json.dumps(asyncio.run(go())))
+
+
+def run_config(shards: int, args) -> None:
+    workdir = tempfile.mkdtemp(prefix="ai_service_shards_")
+    env = shard_env(os.path.join(workdir, "bench.db"), shards, args.cities)
+    script = os.path.abspath(__file__)
+    subprocess.run([sys.executable, script, "--role", "setup", "--cities", str(args.cities)], env=env, check=True)
+
+    start_at = time.time() + 2  # все писатели успевают импортировать main
+    procs = [
+        subprocess.Popen([sys.executable, script, "--role", "writer", "--index", str(index),
+                          "--cities", str(args.cities), "--requests", str(args.requests),
+                          "--start-at", str(start_at)], env=env, stdout=subprocess.PIPE, text=True)
+        for index in range(args.writers)
+    ]
+    results = [json.loads(proc.communicate()[0].strip().splitlines()[-1]) for proc in procs]
+
+    latencies = [ms for result in results for ms in result["latencies"]]
+    errors = sum(result["errors"] for result in results)
+    elapsed = max(result["finished"] for result in results) - min(result["started"] for result in results)
+    print(f"шардов {shards}: {len(latencies) / elapsed:7.1f} заявок/с "
+          f"p50={percentile(latencies, 50):6.2f}ms p99={percentile(latencies, 99):7.2f}ms "
+          f"database is locked: {errors}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shards", default="1,2,4", help="числа шардов через запятую")
+    parser.add_argument("--writers", type=int, default=8, help="процессов-писателей")
+    parser.add_argument("--requests", type=int, default=500, help="заявок на писателя")
+    parser.add_argument("--cities", type=int, default=4)
+    parser.add_argument("--role", choices=["bench", "setup", "writer"], default="bench")
+    parser.add_argument("--index", type=int, default=0)
+    parser.add_argument("--start-at", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.role == "setup":
+        setup(args.cities)
+    elif args.role == "writer":
+        writer(args.index, args.cities, args.requests, args.start_at)
+    else:
+        print(f"писателей {args.writers}, городов {args.cities}, заявок на писателя {args.requests}, "
+              f"CPU {os.cpu_count()}")
+        for shards in [int(value) for value in args.shards.split(",")]:
+            run_config(shards, args)
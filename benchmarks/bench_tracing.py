@@ -0,0 +1,84 @@
+"""
+Накладные расходы трассировки на /api/v1/ai/web-form
+
+Режимы: трассировка выключена, только захват медленных (по умолчанию),
+сэмплирование 10% и 100%. Плюс микробенчмарк Span() без активного трейса.
+
+    python benchmarks/bench_tracing.py --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import time
+import timeit
+
+import httpx
+
+from _common import main, percentile, setup_db
+
+MODES = [
+    ("выключена", 0.0, 0),
+    ("только медленные", 0.0, 500),
+    ("сэмплирование 10%", 0.1, 500),
+    ("сэмплирование 100%", 1.0, 500),
+]
+
+FORM = {
+    "name": "Пётр", "phone": "+79001112234", "category": "electrical",
+    "problem_description": "Искрит розетка на кухне", "address": "ул. Баумана, 1",
+}
+
+
+async def measure(requests: int) -> list:
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(50):
+            await client.post("/api/v1/ai/web-form", json=FORM)
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = await client.post("/api/v1/ai/web-form", json=FORM)
+            latencies.append((time.perf_counter() - started) * 1000)
+            response.raise_for_status()
+    return latencies
+
+
+def run(requests: int) -> None:
+    path = setup_db()
+    main.TRACE_PATH = os.path.join(os.path.dirname(path), "traces.jsonl")
+    conn = main.get_db_connection()
+    conn.execute(
+        "INSERT INTO masters (full_name, phone, specializations, city, terminal_active) "
+        "VALUES ('Мастер', '+79000000001', '[\"electrical\"]', 'Москва', 1)"
+    )
+    conn.commit()
+    conn.close()
+    main.MAX_ACTIVE_JOBS_PER_MASTER = 10 ** 9
+
+    def bare():
+        pass
+
+    def with_span():
+        with main.Span("noop"):
+            pass
+
+    loops = 200_000
+    print(f"Span() без трейса: {(timeit.timeit(with_span, number=loops) - timeit.timeit(bare, number=loops)) / loops * 1e9:.0f} нс")
+
+    baseline = None
+    for title, sample_rate, slow_ms in MODES:
+        main.TRACE_SAMPLE_RATE = sample_rate
+        main.TRACE_SLOW_MS = slow_ms
+        main.recent_traces.clear()
+        latencies = asyncio.run(measure(requests))
+        p50 = percentile(latencies, 50)
+        baseline = baseline or p50
+        print(f"{title:<20} p50={p50:.3f}ms p99={percentile(latencies, 99):.3f}ms "
+              f"накладные={(p50 / baseline - 1) * 100:+.1f}% сохранено трейсов={len(main.recent_traces)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.requests)
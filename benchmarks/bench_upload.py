@@ -0,0 +1,113 @@
+"""
+Потоковая загрузка фото: пропускная способность и пиковый RSS сервера
+
+Поднимает uvicorn с main:app в отдельном процессе, параллельно грузит
+файлы по 10 МБ (часть - дубликаты) и читает VmHWM процесса из /proc.
+Пиковая память не должна расти пропорционально объёму загрузок.
+
+    python benchmarks/bench_upload.py --uploads 32 --concurrency 16 --size-mb 10
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from _common import ROOT
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mb(pid: int, field: str) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def run(uploads: int, concurrency: int, size_mb: int, duplicates: float) -> None:
+    workdir = tempfile.mkdtemp(prefix="ai_service_upload_")
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_PATH=os.path.join(workdir, "bench.db"),
+        UPLOADS_PATH=os.path.join(workdir, "uploads"),
+        DISPATCH_INTERVAL_SECONDS="0",
+        THUMBNAIL_WORKERS="0",
+        MAX_UPLOAD_BYTES=str((size_mb + 1) * 1024 * 1024),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        # Исходные файлы: уникальные и повторяющиеся
+        unique = max(1, int(uploads * (1 - duplicates)))
+        sources = []
+        for i in range(unique):
+            path = os.path.join(workdir, f"src_{i}.jpg")
+            with open(path, "wb") as handle:
+                handle.write(os.urandom(size_mb * 1024 * 1024))
+            sources.append(path)
+
+        base = f"http://127.0.0.1:{port}"
+        async with httpx.AsyncClient(timeout=120) as client:
+            for _ in range(100):
+                try:
+                    await client.get(f"{base}/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            baseline = rss_mb(server.pid, "VmRSS")
+
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies = []
+
+            async def upload(i: int) -> bool:
+                async with semaphore:
+                    started = time.perf_counter()
+                    with open(sources[i % unique], "rb") as handle:
+                        response = await client.post(
+                            f"{base}/api/v1/photos/upload",
+                            files={"file": (f"photo_{i}.jpg", handle, "image/jpeg")},
+                        )
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+                    return response.json()["photos"][0]["deduplicated"]
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(upload(i) for i in range(uploads)))
+            elapsed = time.perf_counter() - started
+
+        stored = sum(
+            len(files) for _, _, files in os.walk(env["UPLOADS_PATH"]) if files
+        )
+        total_mb = uploads * size_mb
+        print(f"загрузок={uploads} по {size_mb}МБ, параллельно={concurrency}, "
+              f"время={elapsed:.2f}s, {total_mb / elapsed:.0f} МБ/с")
+        print(f"дубликатов={sum(results)}, файлов в хранилище={stored}")
+        print(f"RSS сервера: до={baseline:.0f}МБ пик={rss_mb(server.pid, 'VmHWM'):.0f}МБ "
+              f"(объём загрузок {total_mb}МБ)")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uploads", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--size-mb", type=int, default=10)
+    parser.add_argument("--duplicates", type=float, default=0.25, help="доля повторных файлов")
+    args = parser.parse_args()
+    asyncio.run(run(args.uploads, args.concurrency, args.size_mb, args.duplicates))
@@ -0,0 +1,238 @@
+"""
+Генератор синтетических данных: мастера, заказы и транзакции в масштабе
+
+Распределения по городам и категориям неравномерные, активность мастеров
+скошена (немногие мастера выполняют большую часть заказов). Загрузка идёт
+через executemany пачками, индексы и триггеры полнотекстового поиска
+снимаются на время загрузки и строятся в конце, PRAGMA настроены на
+массовую запись.
+
+    python benchmarks/datagen.py --masters 1000000 --jobs 50000000 --db ./data/scale.db
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import main
+
+CITIES = {
+    "Москва": 35, "Санкт-Петербург": 18, "Новосибирск": 7, "Екатеринбург": 7, "Ростов-на-Дону": 7,
+    "Казань": 6, "Краснодар": 6, "Нижний Новгород": 5, "Самара": 5, "Калининград": 4,
+}
+CATEGORIES = {"plumbing": 35, "electrical": 30, "appliance": 20, "general": 15}
+PROBLEMS = {
+    "plumbing": ["Протекает кран на кухне", "Засор в ванной", "Течёт труба под раковиной",
+                 "Не сливается унитаз", "Протекающий стояк в туалете"],
+    "electrical": ["Не работает розетка", "Искрит выключатель", "Выбивает автомат",
+                   "Мигает свет в комнате", "Нужно повесить люстру"],
+    "appliance": ["Сломалась стиральная машина", "Холодильник не морозит", "Не греет бойлер",
+                  "Посудомойка не сливает воду"],
+    "general": ["Повесить полку", "Собрать шкаф", "Заменить замок в двери", "Повесить карниз"],
+}
+STREETS = ["ул. Ленина", "ул. Пушкина", "Проспект Мира", "ул. Гагарина", "ул. Советская",
+           "Садовая ул.", "ул. Кирова", "Набережная ул.", "ул. Чехова", "ул. Победы"]
+BATCH = 100_000
+HISTORY_DAYS = 730
+
+
+def tune_for_bulk_load(conn) -> None:
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def restore_pragmas(conn) -> None:
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("PRAGMA journal_mode=WAL")
+
+
+def defer_indexes(conn) -> list:
+    """Снять индексы и триггеры поиска; вернуть их DDL для восстановления"""
+    ddl = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL "
+        "AND tbl_name IN ('masters', 'jobs', 'transactions')"
+    )]
+    for kind, name in conn.execute(
+        "SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL "
+        "AND tbl_name IN ('masters', 'jobs', 'transactions')"
+    ).fetchall():
+        conn.execute(f"DROP {kind.upper()} {name}")
+    return ddl
+
+
+def weighted(choices: dict):
+    keys = list(choices)
+    return keys, list(itertools.accumulate(choices[key] for key in keys))
+
+
+def generate_masters(conn, masters: int, rng: random.Random) -> dict:
+    """Мастера по городам и специализациям; возвращает корзины (город, категория)"""
+    cities, city_weights = weighted(CITIES)
+    categories, category_weights = weighted(CATEGORIES)
+    buckets = {}
+    batch = []
+    for master_id in range(1, masters + 1):
+        city = rng.choices(cities, cum_weights=city_weights)[0]
+        specs = sorted(set(rng.choices(categories, cum_weights=category_weights, k=rng.choice((1, 1, 2, 3)))))
+        rating = round(min(5.0, max(1.0, rng.gauss(4.5, 0.4))), 1)
+        for category in specs:
+            buckets.setdefault((city, category), []).append(master_id)
+        batch.append((master_id, f"Мастер {master_id}", f"+7{9000000000 + master_id}",
+                      json.dumps(specs), city, rating, int(rng.random() < 0.3)))
+        if len(batch) == BATCH or master_id == masters:
+            conn.executemany(
+                "INSERT INTO masters (id, full_name, phone, specializations, city, rating, terminal_active) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+
+    # Скошенная активность: вес мастера в корзине ~ 1 / ранг^0.9
+    skewed = {}
+    for key, ids in buckets.items():
+        rng.shuffle(ids)
+        skewed[key] = (ids, list(itertools.accumulate(1 / (rank + 1) ** 0.9 for rank in range(len(ids)))))
+    return skewed
+
+
+def job_status(age_days: float, rng: random.Random) -> str:
+    roll = rng.random()
+    if age_days > 7:
+        return "completed" if roll < 0.88 else "cancelled"
+    if roll < 0.10:
+        return "pending"
+    if roll < 0.35:
+        return "accepted"
+    if roll < 0.50:
+        return "in_progress"
+    return "completed" if roll < 0.95 else "cancelled"
+
+
+def generate_jobs(conn, jobs: int, buckets: dict, rng: random.Random) -> int:
+    """Заказы и транзакции к выполненным; возвращает число транзакций"""
+    keys = list(buckets)
+    key_weights = list(itertools.accumulate(CITIES[city] * CATEGORIES[category] for city, category in keys))
+    total_weight = key_weights[-1]
+    # Описания, цены и метки времени заранее: в цикле только выбор по индексу
+    descriptions = {
+        category: [(text + suffix, main.calculate_pricing(category, text + suffix))
+                   for text in PROBLEMS[category] for suffix in ("",) * 11 + (", срочно",)]
+        for category in CATEGORIES
+    }
+    addresses = [f"{street}, д. {house}" for street in STREETS for house in range(1, 151)]
+    now = datetime.now()
+    days = [(now - timedelta(days=day)).strftime("%Y-%m-%d ") for day in range(HISTORY_DAYS + 1)]
+    times = [f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}" for second in range(86400)]
+    apartments = [f", кв. {number}" for number in range(1, 301)]
+    clients = [f"Клиент {number}" for number in range(10000)]
+    methods = ("cash", "card", "card", "sbp")
+    random_ = rng.random
+    bisect_ = bisect.bisect
+    fee_cache = {}
+
+    job_batch, tx_batch = [], []
+    transactions = 0
+    for job_id in range(1, jobs + 1):
+        city, category = keys[bisect_(key_weights, random_() * total_weight)]
+        ids, weights = buckets[(city, category)]
+        age_days = random_() ** 2 * HISTORY_DAYS  # больше свежих заказов
+        created_at = days[int(age_days)] + times[int(age_days % 1 * 86400)]
+        status = job_status(age_days, rng)
+        master_id = None if status == "pending" else ids[bisect_(weights, random_() * weights[-1])]
+        options = descriptions[category]
+        description, price = options[int(random_() * len(options))]
+        job_batch.append((job_id, clients[job_id % 10000], "+7" + str(9100000000 + job_id % 10 ** 9),
+                          category, description,
+                          addresses[int(random_() * len(addresses))] + apartments[int(random_() * 300)],
+                          city, price, status, master_id, created_at))
+        if status == "completed":
+            kopecks = int(price * (80 + random_() * 80))  # от 0.8 до 1.6 оценки
+            if random_() < 0.5:
+                kopecks -= kopecks % 100
+            fees = fee_cache.get(kopecks)
+            if fees is None:
+                fees = fee_cache[kopecks] = main.split_payment_kopecks(kopecks)
+            tx_batch.append((job_id, fees["total"] / 100, methods[int(random_() * 4)],
+                             fees["platform_commission"] / 100, fees["master_earnings"] / 100, created_at))
+        if len(job_batch) == BATCH or job_id == jobs:
+            conn.executemany(
+                "INSERT INTO jobs (id, client_name, client_phone, category, problem_description, address, "
+                "city, estimated_price, status, master_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                job_batch)
+            conn.executemany(
+                "INSERT INTO transactions (job_id, amount, payment_method, platform_fee, master_earnings, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?)", tx_batch)
+            transactions += len(tx_batch)
+            job_batch.clear()
+            tx_batch.clear()
+    return transactions
+
+
+def generate(path: str, masters: int, jobs: int, seed: int = 1, verbose: bool = True) -> dict:
+    """Создать БД по пути path и заполнить её синтетическими данными"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    main.DATABASE_PATH = path
+    main.init_database()
+
+    rng = random.Random(seed)
+    conn = main.sqlite3.connect(path, isolation_level=None)
+    tune_for_bulk_load(conn)
+    ddl = defer_indexes(conn)
+    conn.execute("INSERT INTO jobs_fts (jobs_fts) VALUES ('delete-all')")
+
+    timings = {}
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+    buckets = generate_masters(conn, masters, rng)
+    conn.execute("COMMIT")
+    timings["masters"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    conn.execute("BEGIN")
+    transactions = generate_jobs(conn, jobs, buckets, rng)
+    conn.execute("COMMIT")
+    timings["jobs"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for statement in ddl:
+        if "TRIGGER" not in statement.upper().split("(")[0]:
+            conn.execute(statement)
+    timings["indexes"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    conn.execute("INSERT INTO jobs_fts (jobs_fts) VALUES ('rebuild')")
+    for statement in ddl:
+        if "TRIGGER" in statement.upper().split("(")[0]:
+            conn.execute(statement)
+    timings["search_index"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    conn.execute("ANALYZE")
+    restore_pragmas(conn)
+    conn.close()
+    timings["analyze"] = time.perf_counter() - started
+
+    rows = masters + jobs + transactions
+    load_seconds = timings["masters"] + timings["jobs"]
+    if verbose:
+        print(f"{path}: мастеров={masters} заказов={jobs} транзакций={transactions}")
+        print("  " + ", ".join(f"{name}={seconds:.1f}s" for name, seconds in timings.items())
+              + f", загрузка {rows / load_seconds:,.0f} строк/с")
+    return {"masters": masters, "jobs": jobs, "transactions": transactions, "timings": timings}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--masters", type=int, default=10_000)
+    parser.add_argument("--jobs", type=int, default=500_000)
+    parser.add_argument("--db", default="./data/synthetic.db")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    generate(os.path.abspath(args.db), args.masters, args.jobs, args.seed)
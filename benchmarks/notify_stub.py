@@ -0,0 +1,91 @@
+"""
+Заглушка провайдеров уведомлений (Telegram Bot API и SMS-шлюз)
+
+Отвечает с задержкой STUB_LATENCY_MS, часть запросов отклоняет с 500
+(STUB_ERROR_RATE), сверх STUB_RATE_LIMIT сообщений в секунду на канал
+отвечает 429 с Retry-After. GET /stats - принятые, отклонённые, дубли
+и пиковый темп по каналам, POST /reset - обнулить счётчики.
+
+    STUB_LATENCY_MS=50 python -m uvicorn notify_stub:app --app-dir benchmarks --port 8025
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "20"))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+RATE_LIMIT = int(os.getenv("STUB_RATE_LIMIT", "0"))  # 0 - без ограничения
+
+app = FastAPI(title="Notification provider stub")
+channels = {}
+
+
+def channel_state(name: str) -> dict:
+    if name not in channels:
+        channels[name] = {
+            "received": 0, "accepted": 0, "rejected_429": 0, "errors_500": 0,
+            "duplicates": 0, "peak_per_second": 0, "seen": set(), "window": deque(),
+        }
+    return channels[name]
+
+
+async def handle(name: str, key: tuple) -> JSONResponse:
+    state = channel_state(name)
+    state["received"] += 1
+    await asyncio.sleep(LATENCY_MS / 1000)
+
+    now = time.monotonic()
+    window = state["window"]
+    while window and window[0] <= now - 1:
+        window.popleft()
+    if RATE_LIMIT and len(window) >= RATE_LIMIT:
+        state["rejected_429"] += 1
+        return JSONResponse({"ok": False, "description": "Too Many Requests"}, status_code=429,
+                            headers={"Retry-After": "1"})
+    if random.random() < ERROR_RATE:
+        state["errors_500"] += 1
+        return JSONResponse({"ok": False}, status_code=500)
+
+    window.append(now)
+    state["peak_per_second"] = max(state["peak_per_second"], len(window))
+    state["accepted"] += 1
+    if key in state["seen"]:
+        state["duplicates"] += 1
+    state["seen"].add(key)
+    return JSONResponse({"ok": True})
+
+
+@app.post("/bot{token}/sendMessage")
+async def telegram_send(token: str, request: Request):
+    body = await request.json()
+    return await handle("telegram", (body["chat_id"], body["text"]))
+
+
+@app.post("/sms")
+async def sms_send(request: Request):
+    body = await request.json()
+    return await handle("sms", (body["to"], body["text"]))
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        name: {key: value for key, value in state.items() if key not in ("seen", "window")}
+        for name, state in channels.items()
+    }
+
+
+@app.post("/reset")
+async def reset():
+    channels.clear()
+    return {"ok": True}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
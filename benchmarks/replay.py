@@ -0,0 +1,275 @@
+"""
+Воспроизведение записанного трафика (CAPTURE_PATH) на восстановленном снимке БД
+
+Снимки из заголовка записи (или --snapshot) восстанавливаются во временный
+каталог через restore_database, после чего запросы отправляются в том же
+порядке и с теми же интервалами: --speed 1 - реальное время, 10 - в десять
+раз быстрее, 0 - строго по одному (детерминированно, для сравнения ответов).
+По умолчанию запросы идут в main.app внутри процесса (фоновые задачи не
+запускаются); --server поднимает uvicorn на восстановленной БД.
+
+Отчёт: задержки по эндпоинтам рядом со временем ответа в продакшене и
+расхождения статусов с продакшеном (запрос, не получивший ответа, считается
+со статусом 599). --save сохраняет ответы, --compare
+сравнивает их с ответами прошлого прогона (например, предыдущей сборки)
+без полей времени.
+
+    python benchmarks/replay.py data/capture.jsonl --speed 10 --save new.jsonl --compare old.jsonl
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from _common import ROOT, main, percentile
+from bench_upload import free_port
+
+ID_SEGMENT = re.compile(r"^\d+$")
+PHOTO_SEGMENT = re.compile(r"^[0-9a-f]{64}$")
+VOLATILE_KEYS = re.compile(r"(_at|_ms|_seconds|^timestamp|^last_run|^seconds)$")
+
+
+def endpoint(method: str, path: str) -> str:
+    """Шаблон пути: /api/v1/terminal/jobs/42/active -> /api/v1/terminal/jobs/{id}/active"""
+    segments = ["{id}" if ID_SEGMENT.match(part) else "{photo_id}" if PHOTO_SEGMENT.match(part) else part
+                for part in path.split("/")]
+    return f"{method} {'/'.join(segments)}"
+
+
+def load_capture(paths: list, exclude: list) -> tuple:
+    """Заголовки и запросы всех файлов записи (включая ротированные и .gz) по времени прихода"""
+    headers, requests, skipped = [], [], 0
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as handle:
+            for line in handle:
+                entry = json.loads(line)
+                if "capture" in entry:
+                    headers.append(entry)
+                elif "skip" in entry or any(entry["p"].startswith(prefix) for prefix in exclude):
+                    skipped += 1
+                else:
+                    requests.append(entry)
+    requests.sort(key=lambda entry: entry["t"])
+    return headers, requests, skipped
+
+
+def prepare_database(snapshots: list, workdir: str) -> None:
+    """Восстановить снимки в рабочий каталог; имя БД то же, чтобы шард определялся по имени снимка"""
+    backups = Path(main.BACKUP_PATH)
+    resolved = [str(Path(name) if Path(name).exists() else backups / name) for name in snapshots]
+    main.DATABASE_PATH = os.path.join(workdir, Path(main.DATABASE_PATH).name)
+    main.ARCHIVE_DATABASE_PATH = os.path.join(workdir, Path(main.ARCHIVE_DATABASE_PATH).name)
+    main.BACKUP_PATH = os.path.join(workdir, "backups")
+    for snapshot in resolved:
+        result = main.restore_database(snapshot)
+        print(f"снимок {Path(snapshot).name} -> шард {result['shard']} за {result['seconds']}s")
+
+
+def normalize(value):
+    """Ответ без полей времени, которые отличаются при любом прогоне"""
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items() if not VOLATILE_KEYS.search(key)}
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    return value
+
+
+def first_difference(left, right, path: str = "") -> str:
+    if type(left) is not type(right):
+        return path or "/"
+    if isinstance(left, dict):
+        for key in sorted(set(left) | set(right)):
+            if key not in left or key not in right:
+                return f"{path}/{key}"
+            found = first_difference(left[key], right[key], f"{path}/{key}")
+            if found:
+                return found
+        return ""
+    if isinstance(left, list):
+        if len(left) != len(right):
+            return f"{path}[len {len(left)} != {len(right)}]"
+        for index, (a, b) in enumerate(zip(left, right)):
+            found = first_difference(a, b, f"{path}[{index}]")
+            if found:
+                return found
+        return ""
+    return "" if left == right else path or "/"
+
+
+async def replay(client: httpx.AsyncClient, requests: list, speed: float) -> list:
+    """Отправить запросы по расписанию записи; результат - в порядке записи"""
+    results = [None] * len(requests)
+
+    async def one(index: int, entry: dict) -> None:
+        url = entry["p"] + (f"?{entry['q']}" if entry.get("q") else "")
+        started = time.perf_counter()
+        try:
+            response = await client.request(entry["m"], url, json=entry.get("b"), headers=entry.get("h"))
+        except Exception as error:
+            # Обрыв соединения, таймаут или упавший сервер - синтетический статус 599
+            results[index] = {"i": index, "k": endpoint(entry["m"], entry["p"]), "s": 599,
+                              "ms": (time.perf_counter() - started) * 1000,
+                              "body": {"error": type(error).__name__}}
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        try:
+            body = normalize(response.json())
+        except ValueError:
+            body = {"bytes": len(response.content)}
+        results[index] = {"i": index, "k": endpoint(entry["m"], entry["p"]), "s": response.status_code,
+                          "ms": elapsed, "body": body}
+
+    if speed <= 0:
+        for index, entry in enumerate(requests):
+            await one(index, entry)
+        return results
+
+    tasks = []
+    first = requests[0]["t"]
+    begin = time.perf_counter()
+    for index, entry in enumerate(requests):
+        delay = begin + (entry["t"] - first) / speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(index, entry)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def report(requests: list, results: list, elapsed: float) -> None:
+    by_endpoint = {}
+    for entry, result in zip(requests, results):
+        by_endpoint.setdefault(result["k"], []).append((entry, result))
+
+    print(f"\n{len(results)} запросов за {elapsed:.1f}s ({len(results) / elapsed:.1f} запросов/с)")
+    print(f"{'эндпоинт':58} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'прод p50':>9} "
+          f"{'5xx':>5} {'статус≠':>8}")
+    for key, pairs in sorted(by_endpoint.items(), key=lambda item: -len(item[1])):
+        latencies = [result["ms"] for _, result in pairs]
+        production = [entry["ms"] for entry, _ in pairs if entry.get("ms") is not None]
+        errors = sum(1 for _, result in pairs if result["s"] >= 500)
+        mismatched = sum(1 for entry, result in pairs if entry.get("s") is not None and entry["s"] != result["s"])
+        print(f"{key[:58]:58} {len(pairs):6} {percentile(latencies, 50):8.2f} {percentile(latencies, 95):8.2f} "
+              f"{percentile(latencies, 99):8.2f} {max(latencies):8.2f} {percentile(production, 50):9.2f} "
+              f"{errors:5} {mismatched:8}")
+
+
+def compare(results: list, baseline_path: str, show: int) -> None:
+    """Расхождения статусов и тел с сохранённым прогоном по номеру запроса"""
+    with open(baseline_path, encoding="utf-8") as handle:
+        baseline = {item["i"]: item for item in map(json.loads, handle)}
+
+    diffs = {}
+    examples = []
+    for result in results:
+        before = baseline.get(result["i"])
+        if before is None:
+            continue
+        if before["s"] != result["s"]:
+            where = f"статус {before['s']} -> {result['s']}"
+        else:
+            where = first_difference(before["body"], result["body"])
+        if where:
+            diffs[result["k"]] = diffs.get(result["k"], 0) + 1
+            if len(examples) < show:
+                examples.append(f"  #{result['i']} {result['k']}: {where}")
+
+    compared = sum(1 for result in results if result["i"] in baseline)
+    print(f"\nсравнение с {baseline_path}: {compared} запросов, отличаются {sum(diffs.values())}")
+    for key, count in sorted(diffs.items(), key=lambda item: -item[1]):
+        print(f"  {key}: {count}")
+    for line in examples:
+        print(line)
+
+
+async def run(args) -> None:
+    headers, requests, skipped = load_capture(args.logs, args.exclude.split(","))
+    if args.limit:
+        requests = requests[:args.limit]
+    if not requests:
+        sys.exit("в записи нет воспроизводимых запросов")
+    header = headers[0] if headers else {}
+    if header.get("shards", main.SHARD_COUNT) != main.SHARD_COUNT:
+        print(f"⚠️ запись сделана при SHARD_COUNT={header['shards']}, сейчас {main.SHARD_COUNT}")
+    span = requests[-1]["t"] - requests[0]["t"]
+    print(f"запросов {len(requests)} за {span:.0f}s записи, пропущено {skipped} "
+          f"(тела не сохранены или --exclude), скорость {args.speed or 'по одному'}")
+
+    workdir = tempfile.mkdtemp(prefix="ai_service_replay_")
+    snapshots = args.snapshot or header.get("snapshots", [])
+    if snapshots:
+        prepare_database(snapshots, workdir)
+    else:
+        print("⚠️ снимок не задан: воспроизведение на пустой БД, id из записи не найдутся")
+        prepare_database([], workdir)
+    main.init_database()
+    main.CAPTURE_PATH = ""
+
+    server = None
+    if args.server:
+        port = free_port()
+        env = dict(os.environ, DATABASE_PATH=main.DATABASE_PATH, ARCHIVE_DATABASE_PATH=main.ARCHIVE_DATABASE_PATH,
+                   BACKUP_PATH=main.BACKUP_PATH, CAPTURE_PATH="", BACKUP_INTERVAL_SECONDS="0")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+             "--no-access-log"],
+            cwd=ROOT, env=env,
+        )
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120)
+        for _ in range(100):
+            try:
+                await client.get("/health")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    else:
+        main.sync_master_loads()
+        # Необработанное исключение приложения - ответ 500, как у uvicorn, а не исключение в клиенте
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        client = httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=120)
+
+    try:
+        started = time.perf_counter()
+        results = await replay(client, requests, args.speed)
+        elapsed = time.perf_counter() - started
+    finally:
+        await client.aclose()
+        if server:
+            server.terminate()
+            server.wait()
+
+    report(requests, results, elapsed)
+    if args.compare:
+        compare(results, args.compare, args.show_diffs)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as handle:
+            for result in results:
+                handle.write(json.dumps({key: result[key] for key in ("i", "k", "s", "body")},
+                                        ensure_ascii=False, default=str) + "\n")
+        print(f"ответы сохранены в {args.save}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="+", help="файлы записи по порядку (capture.jsonl.2 capture.jsonl.1 ...)")
+    parser.add_argument("--snapshot", action="append", help="снимок БД (по одному на шард и на архив шарда); по умолчанию - из заголовка")
+    parser.add_argument("--speed", type=float, default=1, help="ускорение времени; 0 - запросы строго по одному")
+    parser.add_argument("--limit", type=int, default=0, help="воспроизвести первые N запросов")
+    parser.add_argument("--exclude", default="/static,/docs,/openapi.json,/debug", help="префиксы путей через запятую")
+    parser.add_argument("--server", action="store_true", help="через uvicorn с фоновыми задачами, а не в процессе")
+    parser.add_argument("--save", help="сохранить ответы (JSONL) для сравнения следующей сборки")
+    parser.add_argument("--compare", help="ответы прошлого прогона (--save) той же записи")
+    parser.add_argument("--show-diffs", type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
@@ -2,17 +2,46 @@
 AI Service Platform - FastAPI Backend
 Оптимизировано для Timeweb App Platform
 """
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_UP
 import os
+import re
 import json
+import time
+import heapq
+import asyncio
 import sqlite3
+import random
+import hashlib
+import hmac
+import zlib
+import httpx
+import gzip
+import shutil
+import logging
+import tempfile
+import threading
+from array import array
+from collections import deque
+from email.utils import parsedate_to_datetime
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import parse_qsl, urlencode
+from multipart.multipart import MultipartParser, parse_options_header
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow опционален (см. requirements.txt)
+    Image = None
 
 # ==================== КОНФИГУРАЦИЯ ====================
 
@@ -20,18 +49,371 @@ from pathlib import Path
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 ENVIRONMENT = os.getenv("ENVIRONMENT", "production")
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/ai_service.db")
+# Сколько подключение ждёт чужую транзакцию записи, прежде чем вернуть "database is locked"
+DATABASE_BUSY_TIMEOUT_SECONDS = float(os.getenv("DATABASE_BUSY_TIMEOUT_SECONDS", "30"))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 
+# Фоновый диспетчер pending-заказов (0 - отключён)
+DISPATCH_INTERVAL_SECONDS = float(os.getenv("DISPATCH_INTERVAL_SECONDS", "30"))
+MAX_ACTIVE_JOBS_PER_MASTER = int(os.getenv("MAX_ACTIVE_JOBS_PER_MASTER", "3"))
+
+# Выбор мастера: load_aware (рейтинг с учётом загрузки) или top_rated (только рейтинг)
+MASTER_SELECTION_STRATEGY = os.getenv("MASTER_SELECTION_STRATEGY", "load_aware")
+
+# Фото заявок
+UPLOADS_PATH = os.getenv("UPLOADS_PATH", "./data/uploads")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))  # 0 - без превью
+THUMBNAIL_SIZE = 320
+
+# Архив: завершённые/отменённые заказы старше ARCHIVE_AFTER_DAYS уходят в отдельную БД
+ARCHIVE_DATABASE_PATH = os.getenv("ARCHIVE_DATABASE_PATH", "./data/ai_service_archive.db")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+# Шардирование по городам: число файлов БД (1 - без шардирования) и явное
+# распределение городов "Москва=1;Санкт-Петербург=2" (остальные - по хешу названия)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_CITY_MAP = os.getenv("SHARD_CITY_MAP", "")
+SHARD_ID_BITS = 40  # id мастеров, заказов и транзакций: (шард << 40) + номер внутри шарда
+
+# Резервное копирование: каталог снимков, расписание (0 - только вручную), хранение и темп копирования
+BACKUP_PATH = os.getenv("BACKUP_PATH", "./data/backups")
+BACKUP_INTERVAL_SECONDS = float(os.getenv("BACKUP_INTERVAL_SECONDS", "0"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "false").lower() == "true"
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP_MS = float(os.getenv("BACKUP_STEP_SLEEP_MS", "2"))
+
+# Запись трафика для воспроизведения (пусто - не записывать): телефоны и имена
+# заменяются псевдонимами HMAC(CAPTURE_SALT), JSON-тела больше лимита не сохраняются
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "")
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "") or os.urandom(16).hex()
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(50 * 1024 * 1024)))
+CAPTURE_BACKUP_COUNT = 20
+CAPTURE_MAX_BODY_BYTES = int(os.getenv("CAPTURE_MAX_BODY_BYTES", "16384"))
+
+# Комиссии в базисных пунктах (1 б.п. = 0.01%), деньги считаются в копейках
+PAYMENT_GATEWAY_FEE_BP = 200  # 2% платёжный шлюз
+PLATFORM_COMMISSION_BP = int(round(float(os.getenv("PLATFORM_COMMISSION_RATE", "0.25")) * 10000))
+
+# Трассировка запросов: доля сэмплируемых и порог медленных (0 - не собирать)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+TRACE_PATH = os.getenv("TRACE_PATH", "./data/traces.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = 5
+TRACE_RECENT_LIMIT = 200
+
+# Журнал событий заказов: период и размер пачки встроенных потребителей (0 - не запускать)
+JOB_EVENTS_INTERVAL_SECONDS = float(os.getenv("JOB_EVENTS_INTERVAL_SECONDS", "5"))
+JOB_EVENTS_BATCH_SIZE = int(os.getenv("JOB_EVENTS_BATCH_SIZE", "1000"))
+
+# Присутствие мастеров по heartbeat: TTL и период сброса переходов в БД
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "90"))
+PRESENCE_FLUSH_SECONDS = float(os.getenv("PRESENCE_FLUSH_SECONDS", "5"))
+
+# Уведомления: outbox в БД, фоновая отправка пачками (0 - не отправлять)
+NOTIFY_INTERVAL_SECONDS = float(os.getenv("NOTIFY_INTERVAL_SECONDS", "2"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "100"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_RETRY_BASE_SECONDS = float(os.getenv("NOTIFY_RETRY_BASE_SECONDS", "5"))
+NOTIFY_RETRY_MAX_SECONDS = 900
+NOTIFY_LEASE_SECONDS = 60  # неподтверждённая отправка повторяется после аренды
+NOTIFY_TIMEOUT_SECONDS = 10
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+SMS_API_URL = os.getenv("SMS_API_URL", "")
+SMS_API_KEY = os.getenv("SMS_API_KEY", "")
+# Параллельность и темп (сообщений в секунду) по каналам
+NOTIFY_CHANNEL_LIMITS = {
+    "telegram": (int(os.getenv("NOTIFY_TELEGRAM_CONCURRENCY", "8")), float(os.getenv("NOTIFY_TELEGRAM_RATE", "25"))),
+    "sms": (int(os.getenv("NOTIFY_SMS_CONCURRENCY", "4")), float(os.getenv("NOTIFY_SMS_RATE", "10"))),
+}
+
+# ==================== ТРАССИРОВКА ====================
+
+class Trace:
+    """Спаны одного запроса; экспортируется, если сэмплирован или медленный"""
+    __slots__ = ("trace_id", "sampled", "spans")
+    
+    def __init__(self, sampled: bool):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.spans: List[tuple] = []
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span_id: ContextVar[Optional[str]] = ContextVar("current_span_id", default=None)
+
+# Последние сохранённые трейсы для /debug/slow
+recent_traces: deque = deque(maxlen=TRACE_RECENT_LIMIT)
+trace_logger: Optional[logging.Logger] = None
+
+class Span:
+    """Спан текущего запроса; без активного трейса ничего не записывает
+    
+    Внутри with доступен словарь атрибутов, в который можно дописать
+    значения до закрытия спана.
+    """
+    __slots__ = ("name", "attributes", "trace", "span_id", "parent_id", "token", "start")
+    
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+    
+    def __enter__(self) -> Dict[str, Any]:
+        self.trace = current_trace.get()
+        if self.trace is not None:
+            self.span_id = os.urandom(8).hex()
+            self.parent_id = current_span_id.get()
+            self.token = current_span_id.set(self.span_id)
+            self.start = time.time_ns()
+        return self.attributes
+    
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            current_span_id.reset(self.token)
+            self.trace.spans.append(
+                (self.span_id, self.parent_id, self.name, self.start, time.time_ns(), self.attributes)
+            )
+        return False
+
+def compact_sql(sql: str) -> str:
+    return " ".join(sql.split())[:200]
+
+class TracedCursor(sqlite3.Cursor):
+    """Курсор, записывающий спан на каждый запрос при активном трейсе"""
+    
+    def execute(self, sql, parameters=()):
+        if current_trace.get() is None:
+            return super().execute(sql, parameters)
+        with Span("db.execute", **{"db.statement": compact_sql(sql)}):
+            return super().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        if current_trace.get() is None:
+            return super().executemany(sql, seq_of_parameters)
+        with Span("db.executemany", **{"db.statement": compact_sql(sql)}):
+            return super().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        if current_trace.get() is None:
+            return super().executescript(sql_script)
+        with Span("db.executescript"):
+            return super().executescript(sql_script)
+    
+    def fetchall(self):
+        if current_trace.get() is None:
+            return super().fetchall()
+        with Span("db.fetchall"):
+            return super().fetchall()
+
+class TracedConnection(sqlite3.Connection):
+    """Подключение с TracedCursor для всех запросов и спаном на commit"""
+    
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+    
+    def commit(self):
+        if current_trace.get() is None:
+            return super().commit()
+        with Span("db.commit"):
+            return super().commit()
+
+class TracedModel(BaseModel):
+    """Модель запроса, валидация которой попадает в трейс отдельным спаном"""
+    
+    @model_validator(mode="wrap")
+    @classmethod
+    def _trace_validation(cls, values, handler):
+        if current_trace.get() is None:
+            return handler(values)
+        with Span("pydantic.validate", model=cls.__name__):
+            return handler(values)
+
+def get_trace_logger() -> logging.Logger:
+    """JSONL-лог трейсов с ротацией; запись идёт в отдельном потоке"""
+    global trace_logger
+    if trace_logger is None:
+        Path(TRACE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        queue = SimpleQueue()
+        handler = RotatingFileHandler(TRACE_PATH, maxBytes=TRACE_MAX_BYTES,
+                                      backupCount=TRACE_BACKUP_COUNT, encoding="utf-8")
+        QueueListener(queue, handler).start()
+        logger = logging.getLogger("ai_service.traces")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(QueueHandler(queue))
+        trace_logger = logger
+    return trace_logger
+
+def otlp_value(value) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def trace_to_otlp(trace: Trace) -> Dict[str, Any]:
+    """Трейс в формате OTLP/JSON (ExportTraceServiceRequest)"""
+    spans = []
+    for span_id, parent_id, name, start, end, attributes in trace.spans:
+        item = {
+            "traceId": trace.trace_id,
+            "spanId": span_id,
+            "name": name,
+            "kind": 2 if parent_id is None else 1,  # SERVER для корня, INTERNAL для остальных
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(end),
+            "attributes": [{"key": key, "value": otlp_value(value)} for key, value in attributes.items()],
+        }
+        if parent_id:
+            item["parentSpanId"] = parent_id
+        spans.append(item)
+    
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "ai-service-platform"}}]},
+        "scopeSpans": [{"scope": {"name": "ai_service.tracing"}, "spans": spans}]
+    }]}
+
+def finish_trace(trace: Trace):
+    """Сохранить трейс, если он сэмплирован или медленнее TRACE_SLOW_MS"""
+    if not trace.spans:
+        return
+    root = trace.spans[-1]  # корневой спан закрывается последним
+    duration_ms = (root[4] - root[3]) / 1e6
+    slow = TRACE_SLOW_MS > 0 and duration_ms >= TRACE_SLOW_MS
+    if not (trace.sampled or slow):
+        return
+    
+    recent_traces.append({
+        "trace_id": trace.trace_id,
+        "name": root[2],
+        "duration_ms": round(duration_ms, 2),
+        "slow": slow,
+        "started_at": datetime.fromtimestamp(root[3] / 1e9).isoformat(),
+        "attributes": root[5],
+        "spans": [
+            {"name": name, "duration_ms": round((end - start) / 1e6, 3),
+             "span_id": span_id, "parent_span_id": parent_id, **attributes}
+            for span_id, parent_id, name, start, end, attributes in trace.spans
+        ]
+    })
+    get_trace_logger().info(json.dumps(trace_to_otlp(trace), ensure_ascii=False))
+
+class TracingMiddleware:
+    """ASGI-middleware: трейс на каждый HTTP-запрос с корневым спаном"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (TRACE_SAMPLE_RATE <= 0 and TRACE_SLOW_MS <= 0):
+            return await self.app(scope, receive, send)
+        
+        trace = Trace(sampled=random.random() < TRACE_SAMPLE_RATE)
+        token = current_trace.set(trace)
+        
+        try:
+            with Span(f"{scope['method']} {scope['path']}",
+                      **{"http.method": scope["method"], "http.target": scope["path"]}) as attributes:
+                async def send_with_status(message):
+                    if message["type"] == "http.response.start":
+                        attributes["http.status_code"] = message["status"]
+                    await send(message)
+                
+                await self.app(scope, receive, send_with_status)
+        finally:
+            current_trace.reset(token)
+            finish_trace(trace)
+
+# ==================== ШАРДЫ ====================
+
+# Мастер, его заказы, транзакции, события и уведомления живут в шарде своего
+# города: заказ назначается только мастеру того же города, поэтому заявка,
+# захват, смена статуса и оплата не выходят за один файл БД и шарды пишут
+# независимо. Шард 0 - сам DATABASE_PATH (без шардирования он единственный),
+# в нём же общие таблицы фото. AUTOINCREMENT в шарде N начинается с
+# N << SHARD_ID_BITS, так что шард определяется по id без справочника.
+
+SHARD_CITIES: Dict[str, int] = {
+    city.strip(): int(shard)
+    for city, shard in (item.split("=") for item in SHARD_CITY_MAP.split(";") if item.strip())
+}
+SHARDS = range(SHARD_COUNT)
+SHARD_SEQUENCE_TABLES = ("masters", "jobs", "transactions")
+shard_pool: Optional[ThreadPoolExecutor] = None
+
+def shard_path(shard: int, base: Optional[str] = None) -> str:
+    """Файл шарда: шард 0 - сам base (по умолчанию DATABASE_PATH), остальные - base_shardN"""
+    base = base or DATABASE_PATH
+    if shard == 0:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}_shard{shard}{ext}"
+
+def shard_for_city(city: str) -> int:
+    if SHARD_COUNT == 1:
+        return 0
+    shard = SHARD_CITIES.get(city)
+    return zlib.crc32(city.encode()) % SHARD_COUNT if shard is None else shard
+
+def shard_for_id(entity_id: int) -> int:
+    """Шард мастера, заказа или транзакции по id; чужой диапазон - шард 0, где запись не найдётся"""
+    shard = entity_id >> SHARD_ID_BITS
+    return shard if 0 <= shard < SHARD_COUNT else 0
+
+def map_shards(func, *args) -> list:
+    """func(shard, *args) по всем шардам параллельно; результаты в порядке шардов
+    
+    sqlite3 отпускает GIL на время запроса, поэтому запросы к разным
+    файлам идут одновременно. Без шардирования - обычный вызов.
+    """
+    global shard_pool
+    if SHARD_COUNT == 1:
+        return [func(0, *args)]
+    if shard_pool is None:
+        shard_pool = ThreadPoolExecutor(max_workers=SHARD_COUNT, thread_name_prefix="shard")
+    return list(shard_pool.map(lambda shard: func(shard, *args), SHARDS))
+
 # ==================== ИНИЦИАЛИЗАЦИЯ БД ====================
 
+def ensure_column(cursor, table: str, column: str, definition: str):
+    """Добавить колонку в существующую таблицу, если её ещё нет"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 def init_database():
-    """Инициализация SQLite базы данных"""
-    db_dir = Path(DATABASE_PATH).parent
-    db_dir.mkdir(parents=True, exist_ok=True)
+    """Инициализация SQLite базы данных (всех шардов)"""
+    misplaced = {city: shard for city, shard in SHARD_CITIES.items() if shard not in SHARDS}
+    if misplaced:
+        raise ValueError(f"SHARD_CITY_MAP: шарды вне 0..{SHARD_COUNT - 1}: {misplaced}")
+    for shard in SHARDS:
+        init_shard_database(shard)
+
+def init_shard_database(shard: int):
+    """Схема одного файла БД"""
+    path = shard_path(shard)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
     
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = sqlite3.connect(path)
     cursor = conn.cursor()
     
+    # WAL: читатели не блокируют писателя при конкурентном захвате заказов
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
     # Таблица мастеров
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS masters (
@@ -41,6 +423,8 @@ def init_database():
             specializations TEXT NOT NULL,
             city TEXT NOT NULL,
             preferred_channel TEXT DEFAULT 'telegram',
+            telegram_chat_id TEXT,
+            last_seen_at INTEGER NOT NULL DEFAULT 0,
             rating REAL DEFAULT 5.0,
             is_active BOOLEAN DEFAULT 1,
             terminal_active BOOLEAN DEFAULT 0,
@@ -57,6 +441,7 @@ def init_database():
             category TEXT NOT NULL,
             problem_description TEXT NOT NULL,
             address TEXT NOT NULL,
+            city TEXT NOT NULL DEFAULT 'Москва',
             estimated_price REAL,
             status TEXT DEFAULT 'pending',
             master_id INTEGER,
@@ -65,6 +450,36 @@ def init_database():
         )
     """)
     
+    # Миграция старых БД: колонка города у заказов, чат мастера в Telegram
+    ensure_column(cursor, "jobs", "city", "TEXT NOT NULL DEFAULT 'Москва'")
+    ensure_column(cursor, "masters", "telegram_chat_id", "TEXT")
+    ensure_column(cursor, "masters", "last_seen_at", "INTEGER NOT NULL DEFAULT 0")
+    ensure_column(cursor, "masters", "dashboard_version", "INTEGER NOT NULL DEFAULT 0")
+    
+    # Гашение терминалов с истёкшим heartbeat без просмотра всех мастеров
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_masters_presence
+        ON masters (last_seen_at) WHERE terminal_active = 1
+    """)
+    
+    # Индекс для выборки свободных заказов по городу и категории
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_pending
+        ON jobs (status, city, category, id)
+    """)
+    
+    # Индекс для подсчёта текущей загрузки мастеров
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_master_status
+        ON jobs (master_id, status)
+    """)
+    
+    # Последние заказы мастера без сортировки всей его истории
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_master_created
+        ON jobs (master_id, created_at)
+    """)
+    
     # Таблица транзакций
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS transactions (
@@ -80,9 +495,964 @@ def init_database():
         )
     """)
     
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_job ON transactions (job_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_created ON transactions (created_at)")
+    
+    # Выплаты мастерам за период (все суммы в копейках)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            master_id INTEGER NOT NULL,
+            period_start TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            jobs_count INTEGER NOT NULL,
+            payments_count INTEGER NOT NULL,
+            gross_kopecks INTEGER NOT NULL,
+            gateway_fee_kopecks INTEGER NOT NULL,
+            platform_commission_kopecks INTEGER NOT NULL,
+            payout_kopecks INTEGER NOT NULL,
+            recorded_earnings_kopecks INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (master_id, period_start, period_end),
+            FOREIGN KEY (master_id) REFERENCES masters(id)
+        )
+    """)
+    
+    # Фото: один файл на содержимое (id = sha256), связи с заказами отдельно
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS photos (
+            id TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            content_type TEXT NOT NULL,
+            path TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_photos (
+            job_id INTEGER NOT NULL,
+            photo_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job_id, photo_id),
+            FOREIGN KEY (job_id) REFERENCES jobs(id),
+            FOREIGN KEY (photo_id) REFERENCES photos(id)
+        )
+    """)
+    
+    # Outbox уведомлений: пишется в одной транзакции с заказом,
+    # отправляется фоновым циклом (время - unix-секунды)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER,
+            recipient TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            address TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            enqueued_at REAL NOT NULL,
+            next_attempt_at REAL NOT NULL,
+            sent_at REAL,
+            FOREIGN KEY (job_id) REFERENCES jobs(id)
+        )
+    """)
+    
+    # Очередь к отправке: только неотправленные строки
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_notifications_due
+        ON notifications (next_attempt_at) WHERE status IN ('pending', 'sending')
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notifications_job ON notifications (job_id)")
+    
+    # Полнотекстовый поиск по описанию и адресу (external content над jobs).
+    # unicode61 не приравнивает ё к е, поэтому индекс строится по тексту,
+    # где ё заменена на е: из представления jobs_fts_source и в триггерах.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'jobs_fts'")
+    fts_exists = cursor.fetchone() is not None
+    
+    cursor.execute("""
+        CREATE VIEW IF NOT EXISTS jobs_fts_source AS
+        SELECT id,
+            replace(replace(problem_description, 'ё', 'е'), 'Ё', 'Е') AS problem_description,
+            replace(replace(address, 'ё', 'е'), 'Ё', 'Е') AS address
+        FROM jobs
+    """)
+    
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS jobs_fts USING fts5(
+            problem_description,
+            address,
+            content='jobs_fts_source',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    
+    cursor.executescript("""
+        CREATE TRIGGER IF NOT EXISTS jobs_fts_insert AFTER INSERT ON jobs BEGIN
+            INSERT INTO jobs_fts (rowid, problem_description, address)
+            VALUES (new.id, replace(replace(new.problem_description, 'ё', 'е'), 'Ё', 'Е'),
+                    replace(replace(new.address, 'ё', 'е'), 'Ё', 'Е'));
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS jobs_fts_delete AFTER DELETE ON jobs BEGIN
+            INSERT INTO jobs_fts (jobs_fts, rowid, problem_description, address)
+            VALUES ('delete', old.id, replace(replace(old.problem_description, 'ё', 'е'), 'Ё', 'Е'),
+                    replace(replace(old.address, 'ё', 'е'), 'Ё', 'Е'));
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS jobs_fts_update AFTER UPDATE OF problem_description, address ON jobs BEGIN
+            INSERT INTO jobs_fts (jobs_fts, rowid, problem_description, address)
+            VALUES ('delete', old.id, replace(replace(old.problem_description, 'ё', 'е'), 'Ё', 'Е'),
+                    replace(replace(old.address, 'ё', 'е'), 'Ё', 'Е'));
+            INSERT INTO jobs_fts (rowid, problem_description, address)
+            VALUES (new.id, replace(replace(new.problem_description, 'ё', 'е'), 'Ё', 'Е'),
+                    replace(replace(new.address, 'ё', 'е'), 'Ё', 'Е'));
+        END;
+    """)
+    
+    # Журнал событий заказов: каждая смена статуса дописывается триггером
+    # в той же транзакции (время - unix-секунды)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            master_id INTEGER,
+            from_status TEXT,
+            to_status TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_events_created ON job_events (created_at)")
+    
+    # Курсоры потребителей журнала: id последнего обработанного события
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS event_consumers (
+            name TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Заказы по статусам, поддерживаемые потребителем status_counts
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_status_counts (
+            status TEXT PRIMARY KEY,
+            jobs INTEGER NOT NULL
+        )
+    """)
+    
+    # Допустимые переходы - копия JOB_TRANSITIONS для триггера-проверки
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_transitions (
+            from_status TEXT NOT NULL,
+            to_status TEXT NOT NULL,
+            PRIMARY KEY (from_status, to_status)
+        )
+    """)
+    cursor.execute("DELETE FROM job_transitions")
+    cursor.executemany(
+        "INSERT INTO job_transitions (from_status, to_status) VALUES (?, ?)",
+        [(old, new) for old, targets in JOB_TRANSITIONS.items() for new in targets]
+    )
+    
+    cursor.executescript("""
+        CREATE TRIGGER IF NOT EXISTS jobs_status_guard BEFORE UPDATE OF status ON jobs
+        WHEN old.status IS NOT new.status AND NOT EXISTS (
+            SELECT 1 FROM job_transitions WHERE from_status = old.status AND to_status = new.status
+        ) BEGIN
+            SELECT RAISE(ABORT, 'job status transition not allowed');
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS jobs_events_insert AFTER INSERT ON jobs BEGIN
+            INSERT INTO job_events (job_id, master_id, from_status, to_status, created_at)
+            VALUES (new.id, new.master_id, NULL, new.status, (julianday('now') - 2440587.5) * 86400.0);
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS jobs_events_update AFTER UPDATE OF status ON jobs
+        WHEN old.status IS NOT new.status BEGIN
+            INSERT INTO job_events (job_id, master_id, from_status, to_status, created_at)
+            VALUES (new.id, new.master_id, old.status, new.status, (julianday('now') - 2440587.5) * 86400.0);
+        END;
+    """)
+    
+    # Версия панели мастера для ETag: любая запись, меняющая его заказы
+    # или оплаты, увеличивает masters.dashboard_version
+    cursor.executescript("""
+        CREATE TRIGGER IF NOT EXISTS jobs_dashboard_insert AFTER INSERT ON jobs
+        WHEN new.master_id IS NOT NULL BEGIN
+            UPDATE masters SET dashboard_version = dashboard_version + 1 WHERE id = new.master_id;
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS jobs_dashboard_update AFTER UPDATE OF status, master_id ON jobs BEGIN
+            UPDATE masters SET dashboard_version = dashboard_version + 1
+            WHERE id IN (old.master_id, new.master_id);
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS jobs_dashboard_delete AFTER DELETE ON jobs
+        WHEN old.master_id IS NOT NULL BEGIN
+            UPDATE masters SET dashboard_version = dashboard_version + 1 WHERE id = old.master_id;
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS transactions_dashboard_insert AFTER INSERT ON transactions BEGIN
+            UPDATE masters SET dashboard_version = dashboard_version + 1
+            WHERE id = (SELECT master_id FROM jobs WHERE id = new.job_id);
+        END;
+    """)
+    
+    # Индекс создан впервые на уже заполненной БД - проиндексировать историю
+    if not fts_exists:
+        cursor.execute("INSERT INTO jobs_fts (jobs_fts) VALUES ('rebuild')")
+    
+    # Диапазон id шарда: AUTOINCREMENT продолжит с shard << SHARD_ID_BITS
+    if shard:
+        cursor.executemany("""
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT :name, :start WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)
+        """, [{"name": table, "start": shard << SHARD_ID_BITS} for table in SHARD_SEQUENCE_TABLES])
+    
+    conn.commit()
+    conn.close()
+
+def rebuild_job_search_index(shard: int = 0):
+    """Перестроить полнотекстовый индекс заказов шарда с нуля"""
+    conn = get_db_connection(shard)
+    conn.execute("INSERT INTO jobs_fts (jobs_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO jobs_fts (jobs_fts) VALUES ('optimize')")
     conn.commit()
     conn.close()
 
+# ==================== АРХИВ ====================
+
+ARCHIVED_STATUSES = ('completed', 'cancelled')
+
+def archive_path(shard: int = 0) -> str:
+    return shard_path(shard, ARCHIVE_DATABASE_PATH)
+
+def attach_archive(conn) -> List[str]:
+    """Подключить архивную БД шарда (если она есть) и вернуть список схем для запросов"""
+    path = archive_path(getattr(conn, "shard", 0))
+    if not os.path.exists(path):
+        return ["main"]
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    return ["main", "archive"]
+
+def history_union(schemas: List[str], branch_sql: str) -> str:
+    """Размножить запрос по живой и архивной схемам через UNION ALL
+    
+    Каждая ветка выполняется по индексам своей БД - в отличие от
+    объединяющего представления, к которому нельзя применить JOIN по индексу.
+    """
+    return " UNION ALL ".join(branch_sql.format(db=schema) for schema in schemas)
+
+def init_archive_database(cursor):
+    """Создать в подключённой архивной БД копии таблиц jobs, transactions и job_events
+    
+    Схема берётся из живой БД, недостающие колонки добавляются,
+    так что архив следует за миграциями.
+    """
+    for table in ("jobs", "transactions", "job_events"):
+        cursor.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        ddl = cursor.fetchone()[0]
+        cursor.execute(re.sub(r"^CREATE TABLE \"?\w+\"?", f"CREATE TABLE IF NOT EXISTS archive.{table}", ddl))
+        
+        cursor.execute(f"PRAGMA archive.table_info({table})")
+        archived = {row[1] for row in cursor.fetchall()}
+        cursor.execute(f"PRAGMA main.table_info({table})")
+        for row in cursor.fetchall():
+            if row[1] not in archived:
+                default = f" DEFAULT {row[4]}" if row[4] is not None else ""
+                cursor.execute(f"ALTER TABLE archive.{table} ADD COLUMN {row[1]} {row[2]}{default}")
+    
+    cursor.executescript("""
+        CREATE INDEX IF NOT EXISTS archive.idx_jobs_master_status ON jobs (master_id, status);
+        CREATE INDEX IF NOT EXISTS archive.idx_transactions_job ON transactions (job_id);
+        CREATE INDEX IF NOT EXISTS archive.idx_transactions_created ON transactions (created_at);
+        CREATE INDEX IF NOT EXISTS archive.idx_job_events_job ON job_events (job_id, id);
+        
+        -- Итоги по архиву для /api/v1/stats без сканирования истории
+        CREATE TABLE IF NOT EXISTS archive.archive_totals (
+            status TEXT PRIMARY KEY,
+            jobs INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0
+        );
+    """)
+
+def table_columns(cursor, table: str) -> str:
+    cursor.execute(f"PRAGMA main.table_info({table})")
+    return ", ".join(row[1] for row in cursor.fetchall())
+
+def archive_old_jobs(older_than_days: Optional[int] = None, batch_size: Optional[int] = None,
+                     max_batches: Optional[int] = None) -> Dict[str, Any]:
+    """Перенести старые завершённые и отменённые заказы с транзакциями в архив
+    
+    Работает пачками по batch_size. Каждая пачка - две короткие транзакции:
+    копирование в архив (с обновлением archive_totals), затем удаление из
+    живых таблиц. Уже скопированные строки при повторе не дублируются,
+    поэтому прерванный запуск безопасно продолжается следующим.
+    У каждого шарда свой архив, шарды переносятся параллельно.
+    """
+    started = time.perf_counter()
+    results = map_shards(archive_shard_jobs, older_than_days, batch_size, max_batches)
+    return {
+        "archived_jobs": sum(result["archived_jobs"] for result in results),
+        "archived_transactions": sum(result["archived_transactions"] for result in results),
+        "batches": sum(result["batches"] for result in results),
+        "seconds": round(time.perf_counter() - started, 2)
+    }
+
+def archive_shard_jobs(shard: int, older_than_days: Optional[int] = None, batch_size: Optional[int] = None,
+                       max_batches: Optional[int] = None) -> Dict[str, Any]:
+    older_than_days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    
+    Path(archive_path(shard)).parent.mkdir(parents=True, exist_ok=True)
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.execute("ATTACH DATABASE ? AS archive", (archive_path(shard),))
+    init_archive_database(cursor)
+    conn.commit()
+    
+    job_columns = table_columns(cursor, "jobs")
+    transaction_columns = table_columns(cursor, "transactions")
+    event_columns = table_columns(cursor, "job_events")
+    
+    # События, ещё не прочитанные отстающим потребителем, из журнала не уходят
+    cursor.execute("SELECT MIN(position) FROM main.event_consumers")
+    consumed = cursor.fetchone()[0]
+    consumed = (1 << 63) - 1 if consumed is None else consumed
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY, fresh INTEGER NOT NULL)")
+    
+    started = time.perf_counter()
+    archived_jobs = 0
+    archived_transactions = 0
+    batches = 0
+    
+    while max_batches is None or batches < max_batches:
+        cursor.execute("DELETE FROM archive_batch")
+        cursor.execute("""
+            INSERT INTO archive_batch (id, fresh)
+            SELECT j.id, NOT EXISTS (SELECT 1 FROM archive.jobs a WHERE a.id = j.id)
+            FROM main.jobs j
+            WHERE j.status IN ('completed', 'cancelled')
+            AND j.created_at < datetime('now', ?)
+            AND NOT EXISTS (SELECT 1 FROM main.job_events e WHERE e.job_id = j.id AND e.id > ?)
+            ORDER BY j.id
+            LIMIT ?
+        """, (f"-{older_than_days} days", consumed, batch_size))
+        if cursor.rowcount == 0:
+            break
+        
+        # Транзакция 1: копирование в архив. Строки сверяются с архивом по id, а не по
+        # заказу: после прерванного прогона заказ уже в архиве, а его транзакции
+        # и события, появившиеся позже, ещё нет. Итоги считаются до копирования.
+        cursor.execute("""
+            INSERT INTO archive.archive_totals (status, jobs, revenue)
+            SELECT j.status, SUM(b.fresh), COALESCE(SUM(t.revenue), 0)
+            FROM archive_batch b
+            JOIN main.jobs j ON j.id = b.id
+            LEFT JOIN (
+                SELECT job_id, SUM(amount) AS revenue FROM main.transactions
+                WHERE job_id IN (SELECT id FROM archive_batch)
+                AND id NOT IN (SELECT id FROM archive.transactions)
+                GROUP BY job_id
+            ) t ON t.job_id = j.id
+            GROUP BY j.status
+            ON CONFLICT (status) DO UPDATE SET
+                jobs = jobs + excluded.jobs,
+                revenue = revenue + excluded.revenue
+        """)
+        cursor.execute(f"""
+            INSERT INTO archive.jobs ({job_columns})
+            SELECT {job_columns} FROM main.jobs
+            WHERE id IN (SELECT id FROM archive_batch WHERE fresh = 1)
+        """)
+        archived_jobs += cursor.rowcount
+        cursor.execute(f"""
+            INSERT INTO archive.transactions ({transaction_columns})
+            SELECT {transaction_columns} FROM main.transactions
+            WHERE job_id IN (SELECT id FROM archive_batch)
+            AND id NOT IN (SELECT id FROM archive.transactions)
+        """)
+        archived_transactions += cursor.rowcount
+        cursor.execute(f"""
+            INSERT INTO archive.job_events ({event_columns})
+            SELECT {event_columns} FROM main.job_events
+            WHERE job_id IN (SELECT id FROM archive_batch)
+            AND id NOT IN (SELECT id FROM archive.job_events)
+        """)
+        conn.commit()
+        
+        # Транзакция 2: удаление из живых таблиц только того, что уже лежит в архиве
+        # (уведомления по заказу не архивируются)
+        cursor.execute("DELETE FROM main.notifications WHERE job_id IN (SELECT id FROM archive_batch)")
+        cursor.execute("""
+            DELETE FROM main.job_events WHERE job_id IN (SELECT id FROM archive_batch)
+            AND id IN (SELECT id FROM archive.job_events)
+        """)
+        cursor.execute("""
+            DELETE FROM main.transactions WHERE job_id IN (SELECT id FROM archive_batch)
+            AND id IN (SELECT id FROM archive.transactions)
+        """)
+        cursor.execute("""
+            DELETE FROM main.jobs WHERE id IN (SELECT id FROM archive_batch)
+            AND id IN (SELECT id FROM archive.jobs)
+        """)
+        conn.commit()
+        batches += 1
+    
+    conn.close()
+    
+    return {
+        "archived_jobs": archived_jobs,
+        "archived_transactions": archived_transactions,
+        "batches": batches,
+        "seconds": round(time.perf_counter() - started, 2)
+    }
+
+# ==================== ПРИСУТСТВИЕ МАСТЕРОВ ====================
+
+# Время последнего heartbeat (unix-секунды) по слоту мастера: 4 байта на мастера,
+# 0 - не было. presence_flushed - что последний раз записано в masters.last_seen_at.
+# Слот - номер мастера внутри шарда, чередующийся по шардам (без шардирования - id).
+presence_seen = array("I")
+presence_flushed = array("I")
+presence_dirty: set = set()
+presence_stats: Dict[str, Any] = {"flushes": 0, "last_flush": None, "last_flush_ms": None,
+                                  "last_written": 0, "last_went_offline": 0}
+
+# last_seen_at обновляется в БД не чаще раза в треть TTL: даже с задержкой
+# сброса отметка в БД свежее TTL, пока мастер шлёт heartbeat хоть одному воркеру
+PRESENCE_WRITE_INTERVAL = max(1, PRESENCE_TTL_SECONDS // 3)
+SHARD_ID_MASK = (1 << SHARD_ID_BITS) - 1
+
+def presence_slot(master_id: int) -> int:
+    return (master_id & SHARD_ID_MASK) * SHARD_COUNT + (master_id >> SHARD_ID_BITS)
+
+def grow_presence(master_id: int) -> bool:
+    """Расширить таблицу присутствия до слота master_id, если такой мастер есть в БД"""
+    if presence_slot(master_id) < len(presence_seen):
+        return True
+    conn = get_db_connection(shard_for_id(master_id))
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM masters").fetchone()[0]
+    conn.close()
+    if master_id > max_id:
+        return False
+    local = max_id & SHARD_ID_MASK
+    size = (local + 1 + local // 4) * SHARD_COUNT  # запас, чтобы не расширять на каждой регистрации
+    for table in (presence_seen, presence_flushed):
+        table.frombytes(bytes(table.itemsize * (size - len(table))))
+    return True
+
+def record_heartbeat(master_id: int, only_if_seen: bool = False) -> bool:
+    """Отметить мастера живым; False - мастера с таким id нет
+    
+    Горячий путь без обращений к БД: запись в массив и, раз в
+    PRESENCE_WRITE_INTERVAL, пометка для пакетного сброса.
+    only_if_seen - продлить присутствие, только если мастер уже слал
+    heartbeat (активация и захват заказа не включают TTL терминалам без heartbeat).
+    """
+    if master_id <= 0 or master_id >> SHARD_ID_BITS >= SHARD_COUNT:
+        return False
+    slot = (master_id & SHARD_ID_MASK) * SHARD_COUNT + (master_id >> SHARD_ID_BITS)
+    if only_if_seen and (slot >= len(presence_seen) or presence_seen[slot] == 0):
+        return True
+    if slot >= len(presence_seen) and not grow_presence(master_id):
+        return False
+    now = int(time.time())
+    presence_seen[slot] = now
+    if now - presence_flushed[slot] >= PRESENCE_WRITE_INTERVAL:
+        presence_dirty.add(master_id)
+    return True
+
+def presence_expired(master_id: int) -> bool:
+    """Мастер слал heartbeat этому воркеру, но TTL истёк
+    
+    Мастера, о которых воркер ничего не знает, оцениваются по
+    masters.terminal_active - его поддерживает flush_presence.
+    """
+    slot = presence_slot(master_id)
+    if slot >= len(presence_seen):
+        return False
+    seen = presence_seen[slot]
+    return seen != 0 and time.time() - seen > PRESENCE_TTL_SECONDS
+
+def write_presence(shard: int, updates: Dict[int, List[tuple]], now: int) -> int:
+    """Записать отметки присутствия шарда пачкой и погасить терминалы с истёкшим TTL
+    
+    Мастера, ни разу не приславшие heartbeat (last_seen_at = 0, терминал
+    старой версии), не гасятся: для них остаётся прежний флаг terminal_active.
+    """
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.executemany("""
+        UPDATE masters SET last_seen_at = MAX(last_seen_at, ?), terminal_active = 1
+        WHERE id = ?
+    """, updates.get(shard, []))
+    cursor.execute("""
+        UPDATE masters SET terminal_active = 0
+        WHERE terminal_active = 1 AND last_seen_at > 0 AND last_seen_at < ?
+    """, (now - PRESENCE_TTL_SECONDS,))
+    went_offline = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return went_offline
+
+async def flush_presence() -> Dict[str, Any]:
+    """Сбросить накопленные переходы присутствия в masters
+    
+    Снимок берётся в event loop, где пишут heartbeat, запись в БД -
+    в отдельном потоке. При ошибке отметки остаются для следующего сброса.
+    """
+    global presence_dirty
+    started = time.perf_counter()
+    now = int(time.time())
+    dirty, presence_dirty = presence_dirty, set()
+    updates = [(presence_seen[presence_slot(master_id)], master_id) for master_id in dirty]
+    by_shard: Dict[int, List[tuple]] = {}
+    for update in updates:
+        by_shard.setdefault(shard_for_id(update[1]), []).append(update)
+    try:
+        went_offline = sum(await asyncio.to_thread(map_shards, write_presence, by_shard, now))
+    except sqlite3.Error:
+        presence_dirty |= dirty
+        raise
+    for seen, master_id in updates:
+        presence_flushed[presence_slot(master_id)] = seen
+    
+    presence_stats.update({
+        "flushes": presence_stats["flushes"] + 1,
+        "last_flush": datetime.now().isoformat(),
+        "last_flush_ms": round((time.perf_counter() - started) * 1000, 2),
+        "last_written": len(updates),
+        "last_went_offline": went_offline,
+    })
+    return dict(presence_stats)
+
+async def presence_loop():
+    """Периодический сброс присутствия в БД"""
+    while True:
+        await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
+        try:
+            await flush_presence()
+        except sqlite3.Error as e:
+            print(f"⚠️ Ошибка сброса присутствия: {e}")
+
+# Heartbeat обслуживается до роутинга FastAPI: это самый частый запрос
+# (каждый онлайн-мастер раз в 20-30 секунд), ему не нужны трассировка,
+# валидация и сериализация
+HEARTBEAT_PATH = re.compile(r"/api/v1/terminal/(\d+)/heartbeat")
+HEARTBEAT_RESPONSES = {
+    status: (status, [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                      (b"access-control-allow-origin", b"*")], body)
+    for status, body in (
+        (200, json.dumps({"ok": True, "ttl_seconds": PRESENCE_TTL_SECONDS}).encode()),
+        (404, json.dumps({"detail": "Мастер не найден"}, ensure_ascii=False).encode()),
+    )
+}
+
+class PresenceMiddleware:
+    """ASGI-middleware: POST /api/v1/terminal/{id}/heartbeat без фреймворка"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            match = HEARTBEAT_PATH.fullmatch(scope["path"])
+            if match:
+                status, headers, body = HEARTBEAT_RESPONSES[200 if record_heartbeat(int(match.group(1))) else 404]
+                await send({"type": "http.response.start", "status": status, "headers": headers})
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+# ==================== РЕЗЕРВНОЕ КОПИРОВАНИЕ ====================
+
+# Задержки записывающих запросов (время завершения, мс) - для оценки влияния бэкапа
+write_latencies: deque = deque(maxlen=20000)
+
+backup_lock = threading.Lock()
+BACKUP_CHECK_OPS_PER_STEP = 20000  # инструкций VDBE integrity_check между паузами
+
+# Результаты последнего снимка
+backup_stats: Dict[str, Any] = {
+    "runs": 0,
+    "failures": 0,
+    "running": False,
+    "last_run": None,
+    "last_snapshot": None,
+    "last_seconds": None,
+    "last_copy_seconds": None,
+    "last_check_seconds": None,
+    "last_bytes": None,
+    "last_stored_bytes": None,
+    "last_steps": None,
+    "last_error": None,
+    "write_p99_ms_before": None,
+    "write_p99_ms_during": None,
+}
+
+class WriteLatencyMiddleware:
+    """ASGI-middleware: время ответа на POST/PUT/PATCH/DELETE для метрик бэкапа"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            write_latencies.append((time.time(), (time.perf_counter() - started) * 1000))
+
+def write_p99(start: float, end: float) -> Optional[float]:
+    """p99 задержки записывающих запросов, завершившихся в [start, end)"""
+    values = sorted(ms for finished, ms in write_latencies if start <= finished < end)
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(0.99 * len(values)))], 2)
+
+def database_file(shard: int = 0, archive: bool = False) -> str:
+    """Файл шарда или его архива (у каждого свои снимки)"""
+    return archive_path(shard) if archive else shard_path(shard)
+
+def snapshot_prefix(shard: int, archive: bool = False) -> str:
+    return Path(database_file(shard, archive)).stem + "-"
+
+def list_snapshots(shard: int = 0, archive: bool = False) -> List[Path]:
+    """Снимки шарда (или его архива) в BACKUP_PATH, от новых к старым"""
+    directory = Path(BACKUP_PATH)
+    if not directory.is_dir():
+        return []
+    prefix = snapshot_prefix(shard, archive)
+    return sorted(
+        (path for path in directory.iterdir()
+         if path.name.startswith(prefix) and path.name.endswith((".db", ".db.gz"))),
+        key=lambda path: path.name, reverse=True
+    )
+
+def prune_snapshots(keep: Optional[int] = None, shard: int = 0, archive: bool = False) -> int:
+    """Удалить снимки шарда (или его архива) сверх keep самых новых"""
+    keep = BACKUP_KEEP if keep is None else keep
+    stale = list_snapshots(shard, archive)[keep:]
+    for path in stale:
+        path.unlink()
+    return len(stale)
+
+def backup_database(compress: Optional[bool] = None, prune: bool = True, shard: int = 0,
+                    archive: bool = False) -> Dict[str, Any]:
+    """Снять снимок файла шарда (archive=True - его архива) в BACKUP_PATH через online backup API
+    
+    Источник держит одну читающую транзакцию на всё копирование: снимок
+    согласован, backup API не начинает заново из-за записей других
+    подключений, а писатели в WAL её не ждут. Страницы копируются по
+    BACKUP_PAGES_PER_STEP с паузой BACKUP_STEP_SLEEP_MS между шагами,
+    чтобы обработчики не стояли за GIL и диском. Снимок переводится
+    в journal_mode=DELETE (один файл), проверяется integrity_check
+    (с такими же паузами через progress handler), при необходимости
+    сжимается и только после этого получает итоговое имя.
+    """
+    compress = BACKUP_COMPRESS if compress is None else compress
+    with backup_lock:
+        directory = Path(BACKUP_PATH)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{snapshot_prefix(shard, archive)}{datetime.now():%Y%m%d-%H%M%S-%f}.db"
+        partial = directory / (name + ".partial")
+        packing = directory / (name + ".gz.partial")
+        steps = 0
+        
+        def progress(status, remaining, total):
+            nonlocal steps
+            steps += 1
+            if remaining and BACKUP_STEP_SLEEP_MS > 0:
+                time.sleep(BACKUP_STEP_SLEEP_MS / 1000)
+        
+        def pause():
+            time.sleep(BACKUP_STEP_SLEEP_MS / 1000)
+            return 0
+        
+        backup_stats["running"] = True
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            target = sqlite3.connect(partial)
+            try:
+                source = sqlite3.connect(database_file(shard, archive), isolation_level=None)
+                try:
+                    source.execute("BEGIN")
+                    source.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+                    source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+                finally:
+                    source.close()
+                copied = time.perf_counter()
+                target.execute("PRAGMA journal_mode=DELETE")
+                if BACKUP_STEP_SLEEP_MS > 0:
+                    target.set_progress_handler(pause, BACKUP_CHECK_OPS_PER_STEP)
+                integrity = target.execute("PRAGMA integrity_check").fetchone()[0]
+                checked = time.perf_counter()
+            finally:
+                target.close()
+            if integrity != "ok":
+                raise sqlite3.DatabaseError(f"integrity_check снимка: {integrity}")
+            
+            size = partial.stat().st_size
+            if compress:
+                final = directory / (name + ".gz")
+                with open(partial, "rb") as raw, gzip.open(packing, "wb", compresslevel=6) as packed:
+                    shutil.copyfileobj(raw, packed, 1 << 20)
+                os.replace(packing, final)
+                partial.unlink()
+            else:
+                final = directory / name
+                os.replace(partial, final)
+        except Exception as e:
+            for path in (partial, packing):
+                if path.exists():
+                    path.unlink()
+            backup_stats.update({"running": False, "failures": backup_stats["failures"] + 1,
+                                 "last_error": str(e)})
+            raise
+        
+        pruned = prune_snapshots(shard=shard, archive=archive) if prune else 0
+        elapsed = time.perf_counter() - started
+        finished_at = started_at + elapsed
+        backup_stats.update({
+            "runs": backup_stats["runs"] + 1,
+            "running": False,
+            "last_run": datetime.fromtimestamp(started_at).isoformat(),
+            "last_snapshot": final.name,
+            "last_seconds": round(elapsed, 2),
+            "last_copy_seconds": round(copied - started, 2),
+            "last_check_seconds": round(checked - copied, 2),
+            "last_bytes": size,
+            "last_stored_bytes": final.stat().st_size,
+            "last_steps": steps,
+            "last_error": None,
+            # Окно до бэкапа той же длины, что и весь бэкап
+            "write_p99_ms_before": write_p99(started_at - elapsed, started_at),
+            "write_p99_ms_during": write_p99(started_at, finished_at),
+        })
+        return dict(backup_stats, snapshot=str(final), pruned=pruned)
+
+def backup_all_shards(compress: Optional[bool] = None) -> Dict[str, Any]:
+    """Снимки всех шардов и их архивов по очереди (копирование и так ограничено по темпу)
+    
+    Архив шарда снимается после самого шарда: архивация сначала копирует
+    заказы в архив и лишь потом удаляет их из шарда, так что в паре
+    снимков заказ может оказаться в обоих файлах, но не пропасть. Такие
+    заказы следующий запуск архивации просто удалит из шарда.
+    """
+    results = []
+    for shard in SHARDS:
+        results.append(backup_database(compress, shard=shard))
+        if os.path.exists(archive_path(shard)):
+            results.append(backup_database(compress, shard=shard, archive=True))
+    return dict(results[-1], snapshots=[result["snapshot"] for result in results],
+                pruned=sum(result["pruned"] for result in results))
+
+def latest_snapshots() -> List[str]:
+    """Имена последних снимков каждого шарда и архива - набор для восстановления"""
+    return [snapshots[0].name for shard in SHARDS for archive in (False, True)
+            for snapshots in [list_snapshots(shard, archive)] if snapshots]
+
+def restore_database(snapshot: str) -> Dict[str, Any]:
+    """Восстановить файл шарда или его архива из снимка; сервер должен быть остановлен
+    
+    Шард и файл (шард или архив) определяются по имени снимка, так что
+    полный набор восстанавливается по снимку за раз. Снимок проверяется до
+    восстановления, текущая БД сначала сохраняется обычным снимком
+    (без ротации), так что восстановление обратимо.
+    """
+    path = Path(snapshot)
+    if not path.exists():
+        path = Path(BACKUP_PATH) / snapshot
+    if not path.exists():
+        raise FileNotFoundError(snapshot)
+    shard, archive = next(((shard, archive) for shard in SHARDS for archive in (False, True)
+                           if path.name.startswith(snapshot_prefix(shard, archive))), (0, False))
+    database = database_file(shard, archive)
+    
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        source_path = path
+        if path.suffix == ".gz":
+            source_path = Path(tmp) / path.stem
+            with gzip.open(path, "rb") as packed, open(source_path, "wb") as raw:
+                shutil.copyfileobj(packed, raw, 1 << 20)
+        
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        try:
+            integrity = source.execute("PRAGMA integrity_check").fetchone()[0]
+            if integrity != "ok":
+                raise sqlite3.DatabaseError(f"integrity_check снимка: {integrity}")
+            previous = (backup_database(compress=False, prune=False, shard=shard, archive=archive)
+                        if os.path.exists(database) else None)
+            target = sqlite3.connect(database)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    
+    return {
+        "restored_from": str(path),
+        "shard": shard,
+        "archive": archive,
+        "previous_snapshot": previous["snapshot"] if previous else None,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+async def backup_loop():
+    """Снимки по расписанию: следующий - через BACKUP_INTERVAL_SECONDS после последнего
+    
+    Отсчёт идёт от времени файла последнего снимка, поэтому перезапуски
+    сервера не сдвигают и не пропускают расписание.
+    """
+    while True:
+        snapshots = list_snapshots()
+        age = time.time() - snapshots[0].stat().st_mtime if snapshots else BACKUP_INTERVAL_SECONDS
+        if age >= BACKUP_INTERVAL_SECONDS:
+            try:
+                await asyncio.to_thread(backup_all_shards)
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️ Ошибка резервного копирования: {e}")
+            age = 0
+        await asyncio.sleep(max(1.0, BACKUP_INTERVAL_SECONDS - age))
+
+# ==================== ЗАПИСЬ ТРАФИКА ====================
+
+# Одна строка JSON на запрос: t - время прихода (unix), m, p, q - метод, путь,
+# query; b - JSON-тело; h - условные заголовки; s, ms - статус и время ответа
+# в продакшене; skip - тело не сохранено (не JSON или больше лимита). Первая
+# строка файла - заголовок с последними снимками БД, на которых запись
+# воспроизводится (benchmarks/replay.py).
+
+capture_logger: Optional[logging.Logger] = None
+
+CAPTURE_NAME_FIELDS = frozenset({"name", "full_name", "client_name"})
+CAPTURE_HEADERS = (b"if-none-match",)
+PHONE_PATTERN = re.compile(r"(?<![\w+])(?:\+\d{10,15}|(?:\+7|8)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2})(?!\d)")
+
+def pseudonym(value: str) -> str:
+    return hmac.new(CAPTURE_SALT.encode(), value.encode(), hashlib.sha256).hexdigest()
+
+def anonymize_phone(phone: str) -> str:
+    """Стабильный псевдоним номера: тот же номер - тот же +7999XXXXXXX, формат проходит валидацию"""
+    digits = re.sub(r"\D", "", phone)
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    return f"+7999{int(pseudonym(digits)[:12], 16) % 10 ** 7:07d}"
+
+def anonymize_text(text: str) -> str:
+    return PHONE_PATTERN.sub(lambda match: anonymize_phone(match.group()), text)
+
+def anonymize_value(value, key: Optional[str] = None):
+    """Заменить имена и телефоны во вложенном JSON; числа и структура не меняются"""
+    if isinstance(value, dict):
+        return {k: anonymize_value(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize_value(item, key) for item in value]
+    if isinstance(value, str):
+        if key in CAPTURE_NAME_FIELDS:
+            return f"Имя {pseudonym(value)[:6]}"
+        return anonymize_text(value)
+    return value
+
+def get_capture_logger() -> logging.Logger:
+    """JSONL-лог трафика с ротацией; запись идёт в отдельном потоке, как у трейсов"""
+    global capture_logger
+    if capture_logger is None:
+        Path(CAPTURE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        queue = SimpleQueue()
+        handler = RotatingFileHandler(CAPTURE_PATH, maxBytes=CAPTURE_MAX_BYTES,
+                                      backupCount=CAPTURE_BACKUP_COUNT, encoding="utf-8")
+        QueueListener(queue, handler).start()
+        logger = logging.getLogger("ai_service.capture")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(QueueHandler(queue))
+        logger.info(json.dumps({
+            "capture": 1,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "shards": SHARD_COUNT,
+            "snapshots": latest_snapshots(),
+        }, ensure_ascii=False, separators=(",", ":")))
+        capture_logger = logger
+    return capture_logger
+
+class CaptureMiddleware:
+    """ASGI-middleware: запись запросов и интервалов между ними (при заданном CAPTURE_PATH)
+    
+    Тело копируется по мере чтения приложением, только для JSON не
+    больше CAPTURE_MAX_BODY_BYTES; сериализация и анонимизация - после
+    ответа, запись в файл - в потоке логгера.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not CAPTURE_PATH:
+            return await self.app(scope, receive, send)
+        
+        arrived = time.time()
+        started = time.perf_counter()
+        headers = dict(scope["headers"])
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        declared = int(headers.get(b"content-length", b"0") or 0)
+        keep = content_type.startswith("application/json") and declared <= CAPTURE_MAX_BODY_BYTES
+        chunks: List[bytes] = []
+        received = 0
+        status = None
+        
+        async def capture_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                received += len(body)
+                if keep and received <= CAPTURE_MAX_BODY_BYTES:
+                    chunks.append(body)
+            return message
+        
+        async def capture_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            entry = {"t": round(arrived, 3), "m": scope["method"], "p": scope["path"]}
+            if scope["query_string"]:
+                query = parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+                entry["q"] = urlencode([(key, anonymize_text(value)) for key, value in query])
+            conditional = {name.decode(): headers[name].decode("latin-1") for name in CAPTURE_HEADERS if name in headers}
+            if conditional:
+                entry["h"] = conditional
+            if received and keep and received <= CAPTURE_MAX_BODY_BYTES:
+                try:
+                    entry["b"] = anonymize_value(json.loads(b"".join(chunks)))
+                except ValueError:
+                    entry["skip"] = "invalid json"
+            elif received:
+                entry["skip"] = content_type.split(";")[0] or "body"
+                entry["bytes"] = received
+            entry["s"] = status
+            entry["ms"] = round((time.perf_counter() - started) * 1000, 2)
+            get_capture_logger().info(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+
 # ==================== FASTAPI APP ====================
 
 app = FastAPI(
@@ -91,6 +1461,8 @@ app = FastAPI(
     version="1.0.0"
 )
 
+app.add_middleware(TracingMiddleware)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -100,6 +1472,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(WriteLatencyMiddleware)
+
+app.add_middleware(PresenceMiddleware)
+
+app.add_middleware(CaptureMiddleware)
+
 # Static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -107,41 +1485,75 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 @app.on_event("startup")
 async def startup_event():
     init_database()
+    sync_master_loads()
+    if DISPATCH_INTERVAL_SECONDS > 0:
+        app.state.dispatch_task = asyncio.create_task(dispatch_loop())
+    if NOTIFY_INTERVAL_SECONDS > 0:
+        app.state.notification_task = asyncio.create_task(notification_loop())
+    if PRESENCE_FLUSH_SECONDS > 0:
+        app.state.presence_task = asyncio.create_task(presence_loop())
+    if JOB_EVENTS_INTERVAL_SECONDS > 0:
+        app.state.job_events_task = asyncio.create_task(job_events_loop())
+    if BACKUP_INTERVAL_SECONDS > 0:
+        app.state.backup_task = asyncio.create_task(backup_loop())
     print(f"🚀 AI Service Platform запущен (Environment: {ENVIRONMENT})")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    for name in ("dispatch_task", "notification_task", "presence_task", "job_events_task", "backup_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    await close_notification_senders()
+    if thumbnail_pool:
+        thumbnail_pool.shutdown(wait=False, cancel_futures=True)
+
 # ==================== МОДЕЛИ ДАННЫХ ====================
 
-class MasterRegister(BaseModel):
+class MasterRegister(TracedModel):
     full_name: str = Field(..., min_length=2, max_length=100)
     phone: str = Field(..., pattern=r'^\+\d{10,15}$')
     specializations: List[str] = Field(..., min_items=1)
     city: str = Field(..., min_length=2, max_length=50)
     preferred_channel: str = Field(default="telegram")
+    telegram_chat_id: Optional[str] = None
 
-class ClientRequest(BaseModel):
+class ClientRequest(TracedModel):
     name: str = Field(..., min_length=2, max_length=100)
     phone: str = Field(..., pattern=r'^\+\d{10,15}$')
     category: str
     problem_description: str = Field(..., min_length=10)
     address: str = Field(..., min_length=5)
-    photos: Optional[List[str]] = None
+    city: str = Field(default="Москва", min_length=2, max_length=50)
+    photos: Optional[List[str]] = None  # id фото из /api/v1/photos/upload
 
-class JobStatusUpdate(BaseModel):
+class JobStatusUpdate(TracedModel):
     status: str = Field(..., pattern=r'^(pending|accepted|in_progress|completed|cancelled)$')
 
-class PaymentProcess(BaseModel):
+class SettlementRun(TracedModel):
+    period_start: date
+    period_end: date
+
+class PaymentProcess(TracedModel):
     job_id: int
     payment_method: str = Field(..., pattern=r'^(cash|card|sbp)$')
     amount: float = Field(..., gt=0)
 
 # ==================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ====================
 
-def get_db_connection():
-    """Получить подключение к БД"""
-    conn = sqlite3.connect(DATABASE_PATH)
+def get_db_connection(shard: int = 0):
+    """Получить подключение к БД шарда (без шардирования - к DATABASE_PATH)"""
+    with Span("db.connect"):
+        conn = sqlite3.connect(shard_path(shard), timeout=DATABASE_BUSY_TIMEOUT_SECONDS, factory=TracedConnection)
     conn.row_factory = sqlite3.Row
+    conn.shard = shard
     return conn
 
+def is_urgent(description: str) -> bool:
+    """Срочная заявка (наценка в calculate_pricing, приоритет в диспетчере)"""
+    text = description.lower()
+    return "срочно" in text or "urgent" in text
+
 def calculate_pricing(category: str, description: str) -> float:
     """Простой расчёт цены на основе категории"""
     base_prices = {
@@ -154,48 +1566,1130 @@ def calculate_pricing(category: str, description: str) -> float:
     base_price = base_prices.get(category, 1500)
     
     # Увеличение цены за срочность или сложность
-    if "срочно" in description.lower() or "urgent" in description.lower():
+    if is_urgent(description):
         base_price *= 1.3
     
     if len(description) > 200:  # Сложная задача
         base_price *= 1.2
     
-    return round(base_price, 2)
+    return round(base_price, 2)
+
+ACTIVE_STATUSES = ('accepted', 'in_progress')
+
+# Число активных заказов (accepted + in_progress) у каждого мастера
+master_load: Dict[int, int] = {}
+master_load_lock = threading.Lock()
+
+def sync_master_loads():
+    """Пересчитать загрузку мастеров по БД
+    
+    Вызывается при старте и в начале каждого цикла диспетчера, что
+    исправляет расхождения между несколькими воркерами.
+    """
+    loads = {}
+    for shard_loads in map_shards(read_master_loads):
+        loads.update(shard_loads)
+    
+    with master_load_lock:
+        master_load.clear()
+        master_load.update(loads)
+
+def read_master_loads(shard: int) -> Dict[int, int]:
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT master_id, COUNT(*) as active_jobs FROM jobs
+        WHERE status IN ('accepted', 'in_progress') AND master_id IS NOT NULL
+        GROUP BY master_id
+    """)
+    loads = {row['master_id']: row['active_jobs'] for row in cursor.fetchall()}
+    conn.close()
+    return loads
+
+def adjust_master_load(master_id: Optional[int], old_status: Optional[str], new_status: str):
+    """Учесть смену статуса заказа в загрузке мастера"""
+    if master_id is None:
+        return
+    delta = (new_status in ACTIVE_STATUSES) - (old_status in ACTIVE_STATUSES)
+    if delta:
+        with master_load_lock:
+            master_load[master_id] = max(0, master_load.get(master_id, 0) + delta)
+
+def master_score(rating: float, active_jobs: int) -> float:
+    """Оценка мастера: рейтинг, делённый на (1 + число активных заказов)"""
+    return rating / (1 + active_jobs)
+
+def choose_master(candidates: List[tuple], loads: Dict[int, int],
+                  strategy: str = "load_aware") -> Optional[int]:
+    """Выбрать мастера из кандидатов (id, rating) по стратегии
+    
+    top_rated - прежнее поведение: лучший рейтинг без учёта загрузки.
+    load_aware - лучший master_score среди мастеров ниже лимита
+    MAX_ACTIVE_JOBS_PER_MASTER.
+    """
+    if strategy == "top_rated":
+        best = max(candidates, key=lambda c: (c[1], -c[0]), default=None)
+        return best[0] if best else None
+    
+    best_id, best_key = None, None
+    for master_id, rating in candidates:
+        active_jobs = loads.get(master_id, 0)
+        if active_jobs >= MAX_ACTIVE_JOBS_PER_MASTER:
+            continue
+        key = (master_score(rating, active_jobs), -master_id)
+        if best_key is None or key > best_key:
+            best_id, best_key = master_id, key
+    return best_id
+
+def find_available_master(category: str, city: str) -> Optional[int]:
+    """Найти доступного мастера и зарезервировать за ним слот загрузки"""
+    conn = get_db_connection(shard_for_city(city))
+    cursor = conn.cursor()
+    
+    # Ищем мастеров по специализации и городу
+    cursor.execute("""
+        SELECT id, rating FROM masters 
+        WHERE is_active = 1 
+        AND terminal_active = 1
+        AND city = ?
+        AND specializations LIKE ?
+    """, (city, f'%{category}%'))
+    
+    candidates = [(row['id'], row['rating']) for row in cursor.fetchall() if not presence_expired(row['id'])]
+    conn.close()
+    
+    with master_load_lock:
+        master_id = choose_master(candidates, master_load, MASTER_SELECTION_STRATEGY)
+        if master_id is not None:
+            master_load[master_id] = master_load.get(master_id, 0) + 1
+    
+    return master_id
+
+def claim_pending_job(master_id: int, job_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Атомарно захватить свободный заказ в городе и по специализации мастера
+    
+    Выбор и назначение выполняются одним условным UPDATE ... RETURNING:
+    из конкурирующих мастеров заказ получает ровно один, остальные
+    получают None и могут сразу пробовать следующий. terminal_active
+    не проверяется: запрос с терминала сам подтверждает присутствие.
+    Мастер с MAX_ACTIVE_JOBS_PER_MASTER активными заказами заказ не получает:
+    счёт идёт внутри той же транзакции записи, так что параллельные захваты
+    одного мастера лимит не превысят.
+    Уведомления о назначении ставятся в outbox в той же транзакции.
+    """
+    conn = get_db_connection(shard_for_id(master_id))
+    cursor = conn.cursor()
+    
+    job_filter = "AND j.id = :job_id" if job_id is not None else ""
+    
+    try:
+        cursor.execute(f"""
+        UPDATE jobs SET status = 'accepted', master_id = :master_id
+        WHERE status = 'pending'
+        AND id = (
+            SELECT j.id FROM jobs j, masters m
+            WHERE m.id = :master_id
+            AND m.is_active = 1
+            AND j.status = 'pending'
+            AND j.city = m.city
+            AND j.category IN (SELECT value FROM json_each(m.specializations))
+            AND (
+                SELECT COUNT(*) FROM jobs a
+                WHERE a.master_id = m.id AND a.status IN ('accepted', 'in_progress')
+            ) < :max_active
+            {job_filter}
+            ORDER BY j.id
+            LIMIT 1
+        )
+        RETURNING *
+        """, {"master_id": master_id, "job_id": job_id, "max_active": MAX_ACTIVE_JOBS_PER_MASTER})
+        job = cursor.fetchone()
+        if job:
+            enqueue_assignment_notifications(cursor, [job['id']])
+        conn.commit()
+    finally:
+        conn.close()
+    
+    if not job:
+        return None
+    
+    adjust_master_load(master_id, 'pending', 'accepted')
+    return dict(job)
+
+def to_kopecks(amount: float) -> int:
+    """Сумма в рублях -> целые копейки (округление половины вверх)"""
+    return int((Decimal(str(amount)) * 100).to_integral_value(ROUND_HALF_UP))
+
+def split_payment_kopecks(amount_kopecks: int) -> Dict[str, int]:
+    """Разбивка платежа в целых копейках
+    
+    Комиссии округляются до копейки половиной вверх, заработок мастера -
+    остаток, поэтому части всегда в точности складываются в сумму.
+    Та же формула повторена в SQL в settle_payouts.
+    """
+    gateway_fee = (amount_kopecks * PAYMENT_GATEWAY_FEE_BP + 5000) // 10000
+    remaining = amount_kopecks - gateway_fee
+    platform_commission = (remaining * PLATFORM_COMMISSION_BP + 5000) // 10000
+    
+    return {
+        "total": amount_kopecks,
+        "payment_gateway_fee": gateway_fee,
+        "platform_commission": platform_commission,
+        "master_earnings": remaining - platform_commission
+    }
+
+def calculate_platform_fee(amount: float) -> Dict[str, float]:
+    """Расчёт комиссий платформы (в рублях, посчитано в копейках)"""
+    fees = split_payment_kopecks(to_kopecks(amount))
+    return {key: value / 100 for key, value in fees.items()}
+
+# ==================== ВЫПЛАТЫ МАСТЕРАМ ====================
+
+# Разбивка каждого платежа в копейках - SQL-версия split_payment_kopecks.
+# Транзакции живой и архивной БД объединяются через history_union.
+PAYMENT_SPLIT_SQL = """
+    SELECT master_id, job_id, transaction_id, created_at, payment_method,
+        amount_kopecks, gateway_fee_kopecks,
+        commission_kopecks,
+        amount_kopecks - gateway_fee_kopecks - commission_kopecks as earnings_kopecks,
+        recorded_earnings_kopecks
+    FROM (
+        SELECT *, ((amount_kopecks - gateway_fee_kopecks) * {commission_bp} + 5000) / 10000 as commission_kopecks
+        FROM (
+            SELECT *, (amount_kopecks * {gateway_bp} + 5000) / 10000 as gateway_fee_kopecks
+            FROM ({payments})
+        )
+    )
+"""
+
+PAYMENTS_BRANCH_SQL = """
+    SELECT j.master_id, t.job_id, t.id as transaction_id, t.created_at, t.payment_method,
+        CAST(ROUND(t.amount * 100) AS INTEGER) as amount_kopecks,
+        CAST(ROUND(t.master_earnings * 100) AS INTEGER) as recorded_earnings_kopecks
+    FROM {db}.transactions t
+    JOIN {db}.jobs j ON j.id = t.job_id
+    WHERE t.created_at >= :period_start AND t.created_at < :period_end
+    AND t.status = 'completed'
+    AND j.master_id IS NOT NULL
+"""
+
+def payment_split_query(schemas: List[str], extra_filter: str = "") -> str:
+    """Запрос построчной разбивки платежей за период по всем схемам"""
+    payments = history_union(schemas, PAYMENTS_BRANCH_SQL + extra_filter)
+    return PAYMENT_SPLIT_SQL.format(
+        payments=payments,
+        gateway_bp=PAYMENT_GATEWAY_FEE_BP,
+        commission_bp=PLATFORM_COMMISSION_BP
+    )
+
+def settle_payouts(period_start: str, period_end: str) -> Dict[str, Any]:
+    """Рассчитать выплаты всем мастерам за период [period_start, period_end)
+    
+    Один проход по транзакциям с агрегацией в SQL и целочисленной
+    арифметикой в копейках. Повторный запуск за тот же период
+    пересчитывает ещё не выплаченные строки payouts и не трогает
+    выплаченные. recorded_earnings_kopecks - сумма заработка, сохранённого
+    process_payment по каждому платежу, для сверки. Выплаты мастера лежат
+    в его шарде, шарды считаются параллельно.
+    """
+    started = time.perf_counter()
+    totals: Dict[str, int] = {}
+    for shard_totals in map_shards(settle_shard_payouts, period_start, period_end):
+        for key, value in shard_totals.items():
+            totals[key] = totals.get(key, 0) + value
+    
+    totals["discrepancy_kopecks"] = totals["payout_kopecks"] - totals["recorded_earnings_kopecks"]
+    totals["seconds"] = round(time.perf_counter() - started, 3)
+    return {"period_start": period_start, "period_end": period_end, **totals}
+
+def settle_shard_payouts(shard: int, period_start: str, period_end: str) -> Dict[str, int]:
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    schemas = attach_archive(conn)
+    
+    cursor.execute(f"""
+        INSERT INTO payouts (
+            master_id, period_start, period_end, jobs_count, payments_count,
+            gross_kopecks, gateway_fee_kopecks, platform_commission_kopecks,
+            payout_kopecks, recorded_earnings_kopecks
+        )
+        SELECT master_id, :period_start, :period_end,
+            COUNT(DISTINCT job_id), COUNT(*),
+            SUM(amount_kopecks), SUM(gateway_fee_kopecks), SUM(commission_kopecks),
+            SUM(earnings_kopecks), SUM(recorded_earnings_kopecks)
+        FROM ({payment_split_query(schemas)})
+        GROUP BY master_id
+        ON CONFLICT (master_id, period_start, period_end) DO UPDATE SET
+            jobs_count = excluded.jobs_count,
+            payments_count = excluded.payments_count,
+            gross_kopecks = excluded.gross_kopecks,
+            gateway_fee_kopecks = excluded.gateway_fee_kopecks,
+            platform_commission_kopecks = excluded.platform_commission_kopecks,
+            payout_kopecks = excluded.payout_kopecks,
+            recorded_earnings_kopecks = excluded.recorded_earnings_kopecks
+        WHERE payouts.status = 'pending'
+    """, {"period_start": period_start, "period_end": period_end})
+    conn.commit()
+    
+    cursor.execute("""
+        SELECT COUNT(*) as masters,
+            COALESCE(SUM(payments_count), 0) as payments,
+            COALESCE(SUM(gross_kopecks), 0) as gross_kopecks,
+            COALESCE(SUM(gateway_fee_kopecks), 0) as gateway_fee_kopecks,
+            COALESCE(SUM(platform_commission_kopecks), 0) as platform_commission_kopecks,
+            COALESCE(SUM(payout_kopecks), 0) as payout_kopecks,
+            COALESCE(SUM(recorded_earnings_kopecks), 0) as recorded_earnings_kopecks
+        FROM payouts WHERE period_start = ? AND period_end = ?
+    """, (period_start, period_end))
+    totals = dict(cursor.fetchone())
+    conn.close()
+    return totals
+
+# ==================== ЖУРНАЛ СОБЫТИЙ ЗАКАЗОВ ====================
+
+# Машина состояний заказа; в БД её проверяет триггер jobs_status_guard
+JOB_TRANSITIONS: Dict[str, tuple] = {
+    'pending': ('accepted', 'cancelled'),
+    'accepted': ('in_progress', 'cancelled'),
+    'in_progress': ('completed', 'cancelled'),
+    'completed': (),
+    'cancelled': (),
+}
+
+def transition_allowed(old_status: str, new_status: str) -> bool:
+    return old_status == new_status or new_status in JOB_TRANSITIONS.get(old_status, ())
+
+def consume_job_events(name: str, apply, bootstrap=None, batch_size: Optional[int] = None,
+                       shard: int = 0) -> int:
+    """Одна пачка событий шарда для потребителя name; вернуть число обработанных
+    
+    Курсор, пачка и изменения производных данных фиксируются одной
+    транзакцией, так что после сбоя пачка просто обрабатывается заново.
+    При первом запуске bootstrap(cursor) строит состояние с нуля, и курсор
+    ставится на конец журнала; без bootstrap читается весь журнал.
+    У каждого шарда свой журнал и свои курсоры.
+    """
+    batch_size = batch_size or JOB_EVENTS_BATCH_SIZE
+    conn = get_db_connection(shard)
+    attach_archive(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT position FROM event_consumers WHERE name = ?", (name,))
+        row = cursor.fetchone()
+        if row is None:
+            position = 0
+            if bootstrap:
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM job_events")
+                position = cursor.fetchone()[0]
+                bootstrap(cursor)
+            cursor.execute("INSERT INTO event_consumers (name, position) VALUES (?, ?)", (name, position))
+            conn.commit()
+            return 0
+        
+        cursor.execute("""
+            SELECT id, job_id, master_id, from_status, to_status, created_at
+            FROM job_events WHERE id > ? ORDER BY id LIMIT ?
+        """, (row['position'], batch_size))
+        events = cursor.fetchall()
+        if events:
+            apply(cursor, events)
+            cursor.execute(
+                "UPDATE event_consumers SET position = ?, updated_at = CURRENT_TIMESTAMP WHERE name = ?",
+                (events[-1]['id'], name)
+            )
+        conn.commit()
+        return len(events)
+    finally:
+        conn.close()
+
+def status_deltas(rows) -> Dict[str, int]:
+    """Изменение числа заказов по статусам: (from_status, to_status[, count])"""
+    deltas: Dict[str, int] = {}
+    for row in rows:
+        count = row[2] if len(row) > 2 else 1
+        if row[0] is not None:
+            deltas[row[0]] = deltas.get(row[0], 0) - count
+        deltas[row[1]] = deltas.get(row[1], 0) + count
+    return deltas
+
+def bootstrap_status_counts(cursor):
+    cursor.execute("DELETE FROM job_status_counts")
+    cursor.execute("INSERT INTO job_status_counts (status, jobs) SELECT status, COUNT(*) FROM jobs GROUP BY status")
+    cursor.execute("SELECT 1 FROM pragma_database_list WHERE name = 'archive'")
+    if cursor.fetchone():
+        cursor.execute("""
+            INSERT INTO job_status_counts (status, jobs)
+            SELECT status, jobs FROM archive.archive_totals WHERE true
+            ON CONFLICT (status) DO UPDATE SET jobs = jobs + excluded.jobs
+        """)
+
+def apply_status_counts(cursor, events):
+    cursor.executemany("""
+        INSERT INTO job_status_counts (status, jobs) VALUES (?, ?)
+        ON CONFLICT (status) DO UPDATE SET jobs = jobs + excluded.jobs
+    """, list(status_deltas((event['from_status'], event['to_status']) for event in events).items()))
+
+# Встроенные потребители: имя -> (обработка пачки, начальное построение)
+JOB_EVENT_CONSUMERS = {
+    "status_counts": (apply_status_counts, bootstrap_status_counts),
+}
+
+def run_job_event_consumers() -> Dict[str, int]:
+    """Довести всех встроенных потребителей до конца журнала во всех шардах"""
+    processed = {name: 0 for name in JOB_EVENT_CONSUMERS}
+    for shard_processed in map_shards(run_shard_event_consumers):
+        for name, count in shard_processed.items():
+            processed[name] += count
+    return processed
+
+def run_shard_event_consumers(shard: int) -> Dict[str, int]:
+    processed = {}
+    for name, (apply, bootstrap) in JOB_EVENT_CONSUMERS.items():
+        processed[name] = 0
+        while True:
+            count = consume_job_events(name, apply, bootstrap, shard=shard)
+            processed[name] += count
+            if count < JOB_EVENTS_BATCH_SIZE:
+                break
+    return processed
+
+def read_status_counts(cursor) -> Optional[Dict[str, int]]:
+    """Заказы по статусам (вместе с архивом) без сканирования jobs
+    
+    Таблица job_status_counts плюс ещё не обработанный хвост журнала;
+    вызывать внутри одной читающей транзакции. None - потребитель
+    status_counts ещё не запускался.
+    """
+    cursor.execute("SELECT position FROM event_consumers WHERE name = 'status_counts'")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute("SELECT status, jobs FROM job_status_counts")
+    counts = {status: jobs for status, jobs in cursor.fetchall()}
+    cursor.execute("""
+        SELECT from_status, to_status, COUNT(*) FROM job_events
+        WHERE id > ? GROUP BY from_status, to_status
+    """, (row['position'],))
+    for status, delta in status_deltas(cursor.fetchall()).items():
+        counts[status] = counts.get(status, 0) + delta
+    return {status: jobs for status, jobs in counts.items() if jobs}
+
+def job_time_in_status(days: int) -> Dict[str, Dict[str, Any]]:
+    """Время пребывания заказов в статусах за последние days дней
+    
+    Длительность шага - разница с моментом следующего события того же
+    заказа (LEAD по журналу); незавершённые шаги не учитываются.
+    """
+    since = time.time() - days * 86400
+    durations: Dict[str, List[float]] = {}
+    for shard_durations in map_shards(read_status_durations, since):
+        for status, values in shard_durations.items():
+            durations.setdefault(status, []).extend(values)
+    
+    metrics = {}
+    for status, values in durations.items():
+        values.sort()
+        pick = lambda pct: round(values[min(len(values) - 1, int(pct * len(values)))], 1)
+        metrics[status] = {
+            "transitions": len(values),
+            "avg_seconds": round(sum(values) / len(values), 1),
+            "p50_seconds": pick(0.50),
+            "p95_seconds": pick(0.95),
+            "max_seconds": round(values[-1], 1),
+        }
+    return metrics
+
+def read_status_durations(shard: int, since: float) -> Dict[str, List[float]]:
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT status, left_at - entered_at FROM (
+            SELECT to_status AS status, created_at AS entered_at,
+                LEAD(created_at) OVER (PARTITION BY job_id ORDER BY id) AS left_at
+            FROM job_events
+            WHERE job_id IN (SELECT job_id FROM job_events WHERE created_at >= ?)
+        )
+        WHERE entered_at >= ? AND left_at IS NOT NULL
+    """, (since, since))
+    durations: Dict[str, List[float]] = {}
+    for status, seconds in cursor.fetchall():
+        durations.setdefault(status, []).append(seconds)
+    conn.close()
+    return durations
+
+async def job_events_loop():
+    """Периодический запуск встроенных потребителей журнала вне event loop"""
+    while True:
+        try:
+            await asyncio.to_thread(run_job_event_consumers)
+        except sqlite3.Error as e:
+            print(f"⚠️ Ошибка обработки журнала событий: {e}")
+        await asyncio.sleep(JOB_EVENTS_INTERVAL_SECONDS)
+
+# ==================== ДИСПЕТЧЕР ЗАКАЗОВ ====================
+
+# Результаты последнего цикла диспетчера
+dispatch_stats: Dict[str, Any] = {
+    "cycles": 0,
+    "last_run": None,
+    "last_cycle_ms": None,
+    "last_assigned": 0,
+    "backlog": None,
+    "urgent_backlog": None,
+}
+
+def dispatch_pending_jobs() -> Dict[str, Any]:
+    """Один цикл распределения всех pending-заказов по доступным мастерам
+    
+    Мастера и заказы читаются двумя запросами, план строится в памяти
+    (срочные заказы первыми через кучу, мастера - по master_score
+    с лимитом MAX_ACTIVE_JOBS_PER_MASTER), а назначения применяются одним
+    UPDATE ... FROM по временной таблице. Условие status = 'pending'
+    оставляет победу за мастером, успевшим взять заказ через claim.
+    Город целиком живёт в одном шарде, поэтому шарды планируются
+    независимо и параллельно.
+    """
+    started = time.perf_counter()
+    sync_master_loads()
+    with master_load_lock:
+        loads = dict(master_load)
+    
+    backlog = urgent_backlog = assigned = urgent_assigned = 0
+    for result in map_shards(dispatch_shard_jobs, loads):
+        backlog += result["backlog"]
+        urgent_backlog += result["urgent_backlog"]
+        assigned += result["assigned"]
+        urgent_assigned += result["urgent_assigned"]
+        for master_id in result["masters"]:
+            adjust_master_load(master_id, 'pending', 'accepted')
+    
+    dispatch_stats.update({
+        "cycles": dispatch_stats["cycles"] + 1,
+        "last_run": datetime.now().isoformat(),
+        "last_cycle_ms": round((time.perf_counter() - started) * 1000, 2),
+        "last_assigned": assigned,
+        "backlog": backlog - assigned,
+        "urgent_backlog": urgent_backlog - urgent_assigned,
+    })
+    return dict(dispatch_stats)
+
+def dispatch_shard_jobs(shard: int, loads: Dict[int, int]) -> Dict[str, Any]:
+    """План и назначения одного шарда; загрузка мастеров - снимок loads"""
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    
+    # Доступные мастера с текущей загрузкой
+    cursor.execute("""
+        SELECT id, city, specializations, rating FROM masters
+        WHERE is_active = 1 AND terminal_active = 1
+    """)
+    
+    load: Dict[int, int] = {}
+    rating: Dict[int, float] = {}
+    buckets: Dict[tuple, list] = {}
+    for row in cursor.fetchall():
+        active_jobs = loads.get(row['id'], 0)
+        if active_jobs >= MAX_ACTIVE_JOBS_PER_MASTER or presence_expired(row['id']):
+            continue
+        load[row['id']] = active_jobs
+        rating[row['id']] = row['rating']
+        for category in json.loads(row['specializations']):
+            buckets.setdefault((row['city'], category), []).append(
+                (-master_score(row['rating'], active_jobs), row['id'], active_jobs)
+            )
+    for heap in buckets.values():
+        heapq.heapify(heap)
+    
+    # Очередь заказов: срочные первыми, внутри - по порядку поступления
+    cursor.execute("""
+        SELECT id, city, category, problem_description
+        FROM jobs WHERE status = 'pending'
+    """)
+    queue = [
+        (0 if is_urgent(row['problem_description']) else 1, row['id'], row['city'], row['category'])
+        for row in cursor.fetchall()
+    ]
+    backlog = len(queue)
+    urgent_backlog = sum(1 for item in queue if item[0] == 0)
+    heapq.heapify(queue)
+    
+    plan = []
+    while queue and buckets:
+        priority, job_id, city, category = heapq.heappop(queue)
+        heap = buckets.get((city, category))
+        if heap is None:
+            continue
+        
+        master_id = None
+        while heap:
+            _, candidate, active_jobs = heapq.heappop(heap)
+            # Запись устарела: мастер уже получил заказ из другой корзины
+            if active_jobs != load[candidate]:
+                if load[candidate] < MAX_ACTIVE_JOBS_PER_MASTER:
+                    heapq.heappush(heap, (-master_score(rating[candidate], load[candidate]), candidate, load[candidate]))
+                continue
+            master_id = candidate
+            load[candidate] += 1
+            if load[candidate] < MAX_ACTIVE_JOBS_PER_MASTER:
+                heapq.heappush(heap, (-master_score(rating[candidate], load[candidate]), candidate, load[candidate]))
+            break
+        
+        if not heap:
+            del buckets[(city, category)]
+        if master_id is not None:
+            plan.append((job_id, master_id, priority == 0))
+    
+    applied = set()
+    assigned = 0
+    urgent_assigned = 0
+    if plan:
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS dispatch_plan (job_id INTEGER PRIMARY KEY, master_id INTEGER NOT NULL)")
+        cursor.execute("DELETE FROM dispatch_plan")
+        cursor.executemany(
+            "INSERT INTO dispatch_plan (job_id, master_id) VALUES (?, ?)",
+            [(job_id, master_id) for job_id, master_id, _ in plan]
+        )
+        cursor.execute("""
+            UPDATE jobs SET status = 'accepted', master_id = p.master_id
+            FROM dispatch_plan p
+            WHERE jobs.id = p.job_id AND jobs.status = 'pending'
+            RETURNING jobs.id
+        """)
+        applied = {row[0] for row in cursor.fetchall()}
+        enqueue_assignment_notifications(cursor, sorted(applied))
+        assigned = len(applied)
+        urgent_assigned = sum(1 for job_id, _, urgent in plan if urgent and job_id in applied)
+    
+    conn.commit()
+    conn.close()
+    
+    return {
+        "backlog": backlog,
+        "urgent_backlog": urgent_backlog,
+        "assigned": assigned,
+        "urgent_assigned": urgent_assigned,
+        "masters": [master_id for job_id, master_id, _ in plan if job_id in applied],
+    }
+
+async def dispatch_loop():
+    """Периодический запуск диспетчера вне event loop"""
+    while True:
+        try:
+            await asyncio.to_thread(dispatch_pending_jobs)
+        except sqlite3.Error as e:
+            print(f"⚠️ Ошибка диспетчера: {e}")
+        await asyncio.sleep(DISPATCH_INTERVAL_SECONDS)
+
+# ==================== УВЕДОМЛЕНИЯ ====================
+
+# Уведомления о назначении: мастеру - в Telegram (если привязан чат), иначе SMS;
+# клиенту - SMS. Вставляются в транзакции, назначившей мастера.
+ASSIGNMENT_NOTIFICATIONS_SQL = """
+    INSERT INTO notifications (job_id, recipient, channel, address, message, enqueued_at, next_attempt_at)
+    SELECT j.id, 'master',
+        CASE WHEN m.preferred_channel = 'telegram' AND m.telegram_chat_id IS NOT NULL THEN 'telegram' ELSE 'sms' END,
+        CASE WHEN m.preferred_channel = 'telegram' AND m.telegram_chat_id IS NOT NULL THEN m.telegram_chat_id ELSE m.phone END,
+        'Новый заказ #' || j.id || ': ' || j.problem_description || '. Адрес: ' || j.address
+            || '. Оценка: ' || printf('%.0f', j.estimated_price) || ' ₽',
+        :now, :now
+    FROM jobs j JOIN masters m ON m.id = j.master_id
+    WHERE j.id IN (SELECT value FROM json_each(:job_ids))
+    UNION ALL
+    SELECT j.id, 'client', 'sms', j.client_phone,
+        'Заявка #' || j.id || ' принята. Мастер ' || m.full_name || ' свяжется с вами.',
+        :now, :now
+    FROM jobs j JOIN masters m ON m.id = j.master_id
+    WHERE j.id IN (SELECT value FROM json_each(:job_ids))
+"""
+
+def enqueue_assignment_notifications(cursor, job_ids: List[int]) -> int:
+    """Поставить в outbox уведомления о назначенных заказах (без commit)"""
+    if not job_ids:
+        return 0
+    cursor.execute(ASSIGNMENT_NOTIFICATIONS_SQL, {"job_ids": json.dumps(list(job_ids)), "now": time.time()})
+    return cursor.rowcount
+
+class DeliveryError(Exception):
+    """Сообщение не доставлено; permanent - повтор бессмыслен"""
+    
+    def __init__(self, message: str, permanent: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число секунд или HTTP-дата (RFC 9110); непонятное - None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+class ChannelSender:
+    """Отправка в один канал: пул соединений, лимит параллельности и темп
+    
+    Один httpx.AsyncClient на канал держит keep-alive соединения,
+    семафор ограничивает число одновременных запросов, а слоты по
+    1/rate секунды не дают превысить лимит провайдера.
+    """
+    
+    def __init__(self, url: str, concurrency: int, rate: float, payload, headers: Optional[Dict[str, str]] = None):
+        self.url = url
+        self.payload = payload
+        self.client = httpx.AsyncClient(
+            timeout=NOTIFY_TIMEOUT_SECONDS,
+            headers=headers,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.next_slot = 0.0
+    
+    async def pace(self):
+        loop_time = asyncio.get_running_loop().time()
+        slot = max(loop_time, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > loop_time:
+            await asyncio.sleep(slot - loop_time)
+    
+    async def send(self, address: str, message: str):
+        async with self.semaphore:
+            await self.pace()
+            try:
+                response = await self.client.post(self.url, json=self.payload(address, message))
+            except httpx.HTTPError as e:
+                raise DeliveryError(f"{type(e).__name__}: {e}")
+        
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            raise DeliveryError("HTTP 429", retry_after=parse_retry_after(retry_after))
+        if response.status_code >= 500:
+            raise DeliveryError(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise DeliveryError(f"HTTP {response.status_code}: {response.text[:200]}", permanent=True)
+    
+    async def close(self):
+        await self.client.aclose()
+
+# Отправители создаются при первом использовании в текущем event loop
+notification_senders: Optional[Dict[str, ChannelSender]] = None
+notification_wakeup: Optional[asyncio.Event] = None
+notification_lags: deque = deque(maxlen=1000)
+notification_stats: Dict[str, Any] = {
+    "batches": 0,
+    "sent": 0,
+    "retried": 0,
+    "failed": 0,
+    "last_run": None,
+    "last_batch_ms": None,
+    "last_batch_per_second": None,
+}
+
+def get_notification_senders() -> Dict[str, ChannelSender]:
+    """Отправители по настроенным каналам"""
+    global notification_senders
+    if notification_senders is None:
+        notification_senders = {}
+        if TELEGRAM_BOT_TOKEN:
+            concurrency, rate = NOTIFY_CHANNEL_LIMITS["telegram"]
+            notification_senders["telegram"] = ChannelSender(
+                f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage", concurrency, rate,
+                lambda address, message: {"chat_id": address, "text": message},
+            )
+        if SMS_API_URL:
+            concurrency, rate = NOTIFY_CHANNEL_LIMITS["sms"]
+            notification_senders["sms"] = ChannelSender(
+                SMS_API_URL, concurrency, rate,
+                lambda address, message: {"to": address, "text": message},
+                headers={"Authorization": f"Bearer {SMS_API_KEY}"} if SMS_API_KEY else None,
+            )
+    return notification_senders
+
+async def close_notification_senders():
+    global notification_senders
+    if notification_senders:
+        for sender in notification_senders.values():
+            await sender.close()
+    notification_senders = None
+
+def wake_notification_loop():
+    """Разбудить цикл отправки сразу после commit (вызывать из event loop)"""
+    if notification_wakeup is not None:
+        notification_wakeup.set()
+
+def claim_notifications(limit: int, channels: List[str]) -> List[Dict[str, Any]]:
+    """Взять пачку готовых к отправке уведомлений в аренду
+    
+    Строка в статусе sending с истёкшей арендой (процесс упал во время
+    отправки) снова попадает в выборку - доставка "хотя бы один раз".
+    Берутся только настроенные каналы: остальные ждут в pending, пока
+    канал не настроят. У каждого шарда свой outbox, поэтому в уведомлении
+    запоминается шард.
+    """
+    return [notification for batch in map_shards(claim_shard_notifications, limit, channels)
+            for notification in batch]
+
+def claim_shard_notifications(shard: int, limit: int, channels: List[str]) -> List[Dict[str, Any]]:
+    now = time.time()
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE notifications
+        SET status = 'sending', attempts = attempts + 1, next_attempt_at = :lease
+        WHERE id IN (
+            SELECT id FROM notifications
+            WHERE status IN ('pending', 'sending') AND next_attempt_at <= :now
+            AND channel IN (SELECT value FROM json_each(:channels))
+            ORDER BY next_attempt_at
+            LIMIT :limit
+        )
+        RETURNING id, channel, address, message, attempts, enqueued_at
+    """, {"now": now, "lease": now + NOTIFY_LEASE_SECONDS, "limit": limit, "channels": json.dumps(channels)})
+    batch = [dict(row, shard=shard) for row in cursor.fetchall()]
+    conn.commit()
+    conn.close()
+    return batch
+
+def retry_delay(attempts: int, retry_after: Optional[float] = None) -> float:
+    """Экспоненциальная задержка со случайным разбросом, не меньше Retry-After"""
+    delay = min(NOTIFY_RETRY_MAX_SECONDS, NOTIFY_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    delay *= random.uniform(0.5, 1.0)
+    return max(delay, retry_after or 0.0)
+
+def record_notification_results(results: List[tuple]):
+    """Записать итоги пачки: (уведомление, статус, ошибка, время), по транзакции на шард"""
+    by_shard: Dict[int, List[tuple]] = {}
+    for notification, status, error, moment in results:
+        by_shard.setdefault(notification["shard"], []).append((notification["id"], status, error, moment))
+    map_shards(record_shard_notification_results, by_shard)
+
+def record_shard_notification_results(shard: int, results_by_shard: Dict[int, List[tuple]]):
+    results = results_by_shard.get(shard)
+    if not results:
+        return
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.executemany("""
+        UPDATE notifications
+        SET status = ?, last_error = ?,
+            sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END,
+            next_attempt_at = ?
+        WHERE id = ?
+    """, [(status, error, status, moment, moment, notification_id)
+          for notification_id, status, error, moment in results])
+    conn.commit()
+    conn.close()
+
+async def deliver_notification(notification: Dict[str, Any]) -> tuple:
+    """Отправить одно уведомление; вернуть (уведомление, статус, ошибка, время)"""
+    sender = get_notification_senders()[notification["channel"]]
+    try:
+        await sender.send(notification["address"], notification["message"])
+    except DeliveryError as e:
+        if e.permanent or notification["attempts"] >= NOTIFY_MAX_ATTEMPTS:
+            return notification, "failed", str(e), time.time()
+        return notification, "pending", str(e), time.time() + retry_delay(notification["attempts"], e.retry_after)
+    except Exception as e:
+        # Непредвиденная ошибка одного уведомления не должна остановить пачку
+        # и оставить её строки в 'sending' - повторяем как временный сбой
+        error = f"{type(e).__name__}: {e}"
+        if notification["attempts"] >= NOTIFY_MAX_ATTEMPTS:
+            return notification, "failed", error, time.time()
+        return notification, "pending", error, time.time() + retry_delay(notification["attempts"])
+    
+    sent_at = time.time()
+    notification_lags.append(sent_at - notification["enqueued_at"])
+    return notification, "sent", None, sent_at
+
+async def drain_notifications(limit: Optional[int] = None) -> Dict[str, Any]:
+    """Отправить одну пачку: аренда в БД, параллельная отправка, запись итогов"""
+    started = time.perf_counter()
+    channels = sorted(get_notification_senders())
+    if not channels:
+        return {"claimed": 0, "sent": 0, "retried": 0, "failed": 0}
+    batch = await asyncio.to_thread(claim_notifications, limit or NOTIFY_BATCH_SIZE, channels)
+    if not batch:
+        return {"claimed": 0, "sent": 0, "retried": 0, "failed": 0}
+    
+    results = await asyncio.gather(*(deliver_notification(notification) for notification in batch))
+    await asyncio.to_thread(record_notification_results, results)
+    
+    counts = {"claimed": len(batch), "sent": 0, "retried": 0, "failed": 0}
+    for _, status, _, _ in results:
+        counts[{"sent": "sent", "pending": "retried", "failed": "failed"}[status]] += 1
+    
+    elapsed = time.perf_counter() - started
+    notification_stats.update({
+        "batches": notification_stats["batches"] + 1,
+        "sent": notification_stats["sent"] + counts["sent"],
+        "retried": notification_stats["retried"] + counts["retried"],
+        "failed": notification_stats["failed"] + counts["failed"],
+        "last_run": datetime.now().isoformat(),
+        "last_batch_ms": round(elapsed * 1000, 2),
+        "last_batch_per_second": round(counts["sent"] / elapsed, 1),
+    })
+    return counts
+
+def notification_lag_percentiles() -> Dict[str, Optional[float]]:
+    """Задержка доставки (постановка в outbox -> ответ провайдера) по последним отправкам"""
+    lags = sorted(notification_lags)
+    if not lags:
+        return {"p50_ms": None, "p95_ms": None, "max_ms": None}
+    pick = lambda pct: round(lags[min(len(lags) - 1, int(pct * len(lags)))] * 1000, 1)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "max_ms": round(lags[-1] * 1000, 1)}
+
+async def notification_loop():
+    """Фоновая отправка: полная пачка - сразу следующая, иначе ждём интервал или пробуждение"""
+    global notification_wakeup
+    notification_wakeup = asyncio.Event()
+    try:
+        while True:
+            try:
+                counts = await drain_notifications()
+            except sqlite3.Error as e:
+                print(f"⚠️ Ошибка отправки уведомлений: {e}")
+                counts = {"claimed": 0}
+            if counts["claimed"] >= NOTIFY_BATCH_SIZE:
+                continue
+            notification_wakeup.clear()
+            try:
+                await asyncio.wait_for(notification_wakeup.wait(), NOTIFY_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        notification_wakeup = None
+
+# ==================== ПОИСК ЗАКАЗОВ ====================
+
+def build_fts_query(text: str) -> Optional[str]:
+    """Превратить пользовательский ввод в запрос FTS5
+    
+    Каждое слово ищется как префикс ("протека" найдёт "протекает",
+    "протекающий"), что покрывает русские окончания без стеммера.
+    Спецсимволы FTS5 из ввода не пропускаются, ё приводится к е, как в индексе.
+    """
+    words = re.findall(r"\w+", text.lower().replace("ё", "е"))
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_jobs(text: str, status: Optional[str] = None, category: Optional[str] = None,
+                master_id: Optional[int] = None, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """Ранжированный поиск заказов по описанию и адресу"""
+    fts_query = build_fts_query(text)
+    if fts_query is None:
+        return {"jobs": [], "has_more": False}
+    
+    filters = []
+    params: List[Any] = [fts_query]
+    if status:
+        filters.append("j.status = ?")
+        params.append(status)
+    if category:
+        filters.append("j.category = ?")
+        params.append(category)
+    if master_id is not None:
+        filters.append("j.master_id = ?")
+        params.append(master_id)
+    
+    # Шаг 1: ранжирование без чтения полей заказов (в сортировку
+    # попадают только rowid, ранг и фрагмент); jobs подключается
+    # лишь для фильтров
+    join = "JOIN jobs j ON j.id = jobs_fts.rowid" if filters else ""
+    where = "".join(f" AND {condition}" for condition in filters)
+    
+    # Лишняя строка показывает, есть ли следующая страница. Заказы мастера
+    # лежат в его шарде; иначе каждый шард отдаёт первые offset + limit + 1
+    # строк, и страница вырезается после слияния по рангу. IDF в bm25 у
+    # каждого шарда свой, так что при слиянии ранги сравнимы лишь примерно:
+    # редкое в своём шарде слово поднимает его заказы выше, чем поднял бы
+    # общий индекс. Порядок внутри шарда и набор найденного от этого не зависят.
+    if master_id is not None or SHARD_COUNT == 1:
+        page = search_shard_jobs(shard_for_id(master_id or 0), join, where, params + [limit + 1, offset])
+    else:
+        hits = map_shards(search_shard_jobs, join, where, params + [offset + limit + 1, 0])
+        page = heapq.nsmallest(offset + limit + 1, (hit for shard_hits in hits for hit in shard_hits),
+                               key=lambda hit: hit['rank'])[offset:]
+    has_more = len(page) > limit
+    return {"jobs": page[:limit], "has_more": has_more}
+
+def search_shard_jobs(shard: int, join: str, where: str, params: List[Any]) -> List[Dict[str, Any]]:
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT jobs_fts.rowid as id,
+            snippet(jobs_fts, -1, '[', ']', '…', 12) as snippet,
+            bm25(jobs_fts, 2.0, 1.0) as rank
+        FROM jobs_fts {join}
+        WHERE jobs_fts MATCH ?{where}
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    """, params)
+    page = [dict(row) for row in cursor.fetchall()]
+    
+    # Шаг 2: поля заказов только для строк страницы
+    jobs = []
+    if page:
+        cursor.execute("""
+            SELECT id, status, category, city, master_id, address, problem_description, created_at
+            FROM jobs WHERE id IN (SELECT value FROM json_each(?))
+        """, (json.dumps([hit['id'] for hit in page]),))
+        by_id = {row['id']: dict(row) for row in cursor.fetchall()}
+        jobs = [{**by_id[hit['id']], **hit} for hit in page if hit['id'] in by_id]
+    conn.close()
+    return jobs
+
+# ==================== ХРАНИЛИЩЕ ФОТО ====================
+
+thumbnail_pool: Optional[ProcessPoolExecutor] = None
+
+class PhotoUploadParser:
+    """Потоковый разбор multipart-запроса с фото
+    
+    Каждый файл пишется во временный файл по мере поступления частей
+    с одновременным подсчётом sha256, так что в памяти держится только
+    текущий чанк, а не весь файл.
+    """
+    
+    def __init__(self, boundary: bytes):
+        self.files: List[Dict[str, Any]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._current: Optional[Dict[str, Any]] = None
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+    
+    def write(self, chunk: bytes):
+        self._parser.write(chunk)
+    
+    def on_part_begin(self):
+        self._headers = {}
+        self._current = None
+    
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+    
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+    
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+    
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if b"filename" not in options:
+            return  # обычные поля формы игнорируются
+        
+        content_type = self._headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+        if not content_type.startswith("image/"):
+            raise HTTPException(status_code=415, detail="Можно загружать только изображения")
+        
+        tmp_dir = Path(UPLOADS_PATH) / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        handle = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        self._current = {
+            "handle": handle,
+            "tmp_path": handle.name,
+            "sha256": hashlib.sha256(),
+            "size": 0,
+            "content_type": content_type,
+        }
+        self.files.append(self._current)
+    
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._current is None:
+            return
+        chunk = data[start:end]
+        self._current["size"] += len(chunk)
+        if self._current["size"] > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Файл слишком большой")
+        self._current["sha256"].update(chunk)
+        self._current["handle"].write(chunk)
+    
+    def on_part_end(self):
+        if self._current is not None:
+            self._current["handle"].close()
+            self._current = None
+    
+    def cleanup(self):
+        """Удалить временные файлы (при ошибке или после переноса)"""
+        for item in self.files:
+            item["handle"].close()
+            if os.path.exists(item["tmp_path"]):
+                os.remove(item["tmp_path"])
 
-def find_available_master(category: str, city: str) -> Optional[int]:
-    """Найти доступного мастера"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def store_photo(tmp_path: str, digest: str, size: int, content_type: str) -> Dict[str, Any]:
+    """Перенести загруженный файл в хранилище по адресу содержимого
     
-    # Ищем мастера по специализации и городу
-    cursor.execute("""
-        SELECT id FROM masters 
-        WHERE is_active = 1 
-        AND terminal_active = 1
-        AND city = ?
-        AND specializations LIKE ?
-        ORDER BY rating DESC
-        LIMIT 1
-    """, (city, f'%{category}%'))
+    Одинаковые файлы хранятся один раз: если путь для хэша уже есть,
+    временный файл просто удаляется.
+    """
+    path = Path(UPLOADS_PATH) / digest[:2] / digest[2:4] / digest
+    deduplicated = path.exists()
     
-    result = cursor.fetchone()
+    if deduplicated:
+        os.remove(tmp_path)
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+    
+    conn = get_db_connection()
+    conn.execute("""
+        INSERT OR IGNORE INTO photos (id, size, content_type, path)
+        VALUES (?, ?, ?, ?)
+    """, (digest, size, content_type, str(path)))
+    conn.commit()
     conn.close()
     
-    return result['id'] if result else None
-
-def calculate_platform_fee(amount: float) -> Dict[str, float]:
-    """Расчёт комиссий платформы"""
-    payment_gateway_fee = amount * 0.02  # 2% платёжный шлюз
-    remaining = amount - payment_gateway_fee
-    platform_commission = remaining * 0.25  # 25% комиссия платформы
-    master_earnings = remaining - platform_commission
+    if not deduplicated:
+        schedule_thumbnail(str(path))
     
-    return {
-        "total": amount,
-        "payment_gateway_fee": round(payment_gateway_fee, 2),
-        "platform_commission": round(platform_commission, 2),
-        "master_earnings": round(master_earnings, 2)
-    }
+    return {"photo_id": digest, "size": size, "content_type": content_type, "deduplicated": deduplicated}
+
+def link_job_photos(cursor, job_id: int, photo_ids: List[str]) -> int:
+    """Привязать уже загруженные фото к заказу (неизвестные id пропускаются)"""
+    if not photo_ids:
+        return 0
+    cursor.executemany("""
+        INSERT OR IGNORE INTO job_photos (job_id, photo_id)
+        SELECT ?, id FROM photos WHERE id = ?
+    """, [(job_id, photo_id) for photo_id in photo_ids])
+    return cursor.rowcount
+
+def make_thumbnail(src: str, dst: str, size: int = THUMBNAIL_SIZE):
+    """Построить JPEG-превью (выполняется в пуле процессов)"""
+    with Image.open(src) as image:
+        image.thumbnail((size, size))
+        image.convert("RGB").save(dst, "JPEG", quality=80)
+
+def thumbnail_path(photo_path: str) -> str:
+    return f"{photo_path}.thumb.jpg"
+
+def schedule_thumbnail(photo_path: str):
+    """Поставить построение превью в фоновый пул процессов"""
+    global thumbnail_pool
+    if Image is None or THUMBNAIL_WORKERS <= 0:
+        return
+    if thumbnail_pool is None:
+        thumbnail_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    thumbnail_pool.submit(make_thumbnail, photo_path, thumbnail_path(photo_path))
 
 # ==================== API ENDPOINTS ====================
 
@@ -224,20 +2718,25 @@ async def health_check():
 
 @app.post("/api/v1/masters/register")
 async def register_master(master: MasterRegister):
-    """Регистрация нового мастера"""
-    conn = get_db_connection()
+    """Регистрация нового мастера в шарде его города"""
+    # UNIQUE по телефону действует внутри файла, остальные шарды проверяются заранее
+    if SHARD_COUNT > 1 and any(map_shards(phone_registered, master.phone)):
+        raise HTTPException(status_code=400, detail="Телефон уже зарегистрирован")
+    
+    conn = get_db_connection(shard_for_city(master.city))
     cursor = conn.cursor()
     
     try:
         cursor.execute("""
-            INSERT INTO masters (full_name, phone, specializations, city, preferred_channel)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO masters (full_name, phone, specializations, city, preferred_channel, telegram_chat_id)
+            VALUES (?, ?, ?, ?, ?, ?)
         """, (
             master.full_name,
             master.phone,
             json.dumps(master.specializations),
             master.city,
-            master.preferred_channel
+            master.preferred_channel,
+            master.telegram_chat_id
         ))
         
         conn.commit()
@@ -251,17 +2750,30 @@ async def register_master(master: MasterRegister):
         }
     
     except sqlite3.IntegrityError:
+        conn.rollback()
         raise HTTPException(status_code=400, detail="Телефон уже зарегистрирован")
     finally:
         conn.close()
 
+def phone_registered(shard: int, phone: str) -> bool:
+    conn = get_db_connection(shard)
+    row = conn.execute("SELECT 1 FROM masters WHERE phone = ?", (phone,)).fetchone()
+    conn.close()
+    return row is not None
+
 @app.post("/api/v1/masters/{master_id}/activate-terminal")
 async def activate_terminal(master_id: int):
-    """Активация терминала мастера"""
-    conn = get_db_connection()
+    """Активация терминала мастера (дальше присутствие держится heartbeat)"""
+    conn = get_db_connection(shard_for_id(master_id))
     cursor = conn.cursor()
     
-    cursor.execute("UPDATE masters SET terminal_active = 1 WHERE id = ?", (master_id,))
+    # Отметка обновляется только у терминалов, уже слающих heartbeat:
+    # иначе активация запустила бы TTL у терминала, который heartbeat не шлёт
+    cursor.execute("""
+        UPDATE masters SET terminal_active = 1,
+            last_seen_at = CASE WHEN last_seen_at > 0 THEN MAX(last_seen_at, ?) ELSE 0 END
+        WHERE id = ?
+    """, (int(time.time()), master_id))
     
     if cursor.rowcount == 0:
         conn.close()
@@ -269,6 +2781,7 @@ async def activate_terminal(master_id: int):
     
     conn.commit()
     conn.close()
+    record_heartbeat(master_id, only_if_seen=True)
     
     return {
         "success": True,
@@ -276,10 +2789,32 @@ async def activate_terminal(master_id: int):
         "terminal_url": f"/terminal/{master_id}"
     }
 
+@app.get("/api/v1/masters/presence")
+async def get_presence_status():
+    """Мастера онлайн по heartbeat этого воркера и состояние сброса в БД"""
+    cutoff = int(time.time()) - PRESENCE_TTL_SECONDS
+    return {
+        "ttl_seconds": PRESENCE_TTL_SECONDS,
+        "online": sum(1 for seen in presence_seen if seen > cutoff),
+        "pending_flush": len(presence_dirty),
+        **presence_stats,
+    }
+
 @app.get("/api/v1/masters/available/{category}")
 async def get_available_masters(category: str, city: Optional[str] = None):
     """Получить список доступных мастеров"""
-    conn = get_db_connection()
+    shards = [shard_for_city(city)] if city else SHARDS
+    masters = [
+        master
+        for shard_masters in map_shards(read_available_masters, category, city)
+        for master in shard_masters
+    ] if len(shards) > 1 else read_available_masters(shards[0], category, city)
+    masters.sort(key=lambda master: -master['rating'])
+    
+    return {"count": len(masters), "masters": masters}
+
+def read_available_masters(shard: int, category: str, city: Optional[str]) -> List[Dict[str, Any]]:
+    conn = get_db_connection(shard)
     cursor = conn.cursor()
     
     query = """
@@ -297,10 +2832,9 @@ async def get_available_masters(category: str, city: Optional[str] = None):
     query += " ORDER BY rating DESC"
     
     cursor.execute(query, params)
-    masters = [dict(row) for row in cursor.fetchall()]
+    masters = [dict(row) for row in cursor.fetchall() if not presence_expired(row['id'])]
     conn.close()
-    
-    return {"count": len(masters), "masters": masters}
+    return masters
 
 # ==================== КЛИЕНТЫ (AI) ====================
 
@@ -309,32 +2843,48 @@ async def process_client_request(request: ClientRequest):
     """Обработка заявки от клиента через веб-форму"""
     
     # Расчёт цены
-    estimated_price = calculate_pricing(request.category, request.problem_description)
+    with Span("calculate_pricing"):
+        estimated_price = calculate_pricing(request.category, request.problem_description)
     
     # Поиск мастера
-    master_id = find_available_master(request.category, "Москва")  # Пока по умолчанию Москва
+    with Span("find_available_master"):
+        master_id = find_available_master(request.category, request.city)
     
-    # Создание заказа
-    conn = get_db_connection()
+    # Создание заказа в шарде города
+    shard = shard_for_city(request.city)
+    conn = get_db_connection(shard)
     cursor = conn.cursor()
     
     cursor.execute("""
-        INSERT INTO jobs (client_name, client_phone, category, problem_description, address, estimated_price, master_id, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO jobs (client_name, client_phone, category, problem_description, address, city, estimated_price, master_id, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         request.name,
         request.phone,
         request.category,
         request.problem_description,
         request.address,
+        request.city,
         estimated_price,
         master_id,
         'accepted' if master_id else 'pending'
     ))
     
-    conn.commit()
     job_id = cursor.lastrowid
+    # Фото общие для всех шардов и хранятся в нулевом
+    if shard == 0:
+        link_job_photos(cursor, job_id, request.photos or [])
+    if master_id:
+        enqueue_assignment_notifications(cursor, [job_id])
+    
+    conn.commit()
     conn.close()
+    if shard != 0 and request.photos:
+        conn = get_db_connection()
+        link_job_photos(conn.cursor(), job_id, request.photos)
+        conn.commit()
+        conn.close()
+    wake_notification_loop()
     
     response = {
         "success": True,
@@ -353,12 +2903,126 @@ async def process_client_request(request: ClientRequest):
     
     return response
 
+# ==================== ПОИСК ====================
+
+@app.get("/api/v1/jobs/search")
+async def search_jobs_endpoint(
+    q: str,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    master_id: Optional[int] = None,
+    limit: int = 20,
+    offset: int = 0
+):
+    """Полнотекстовый поиск заказов по описанию проблемы и адресу"""
+    if not 1 <= limit <= 100 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit от 1 до 100, offset >= 0")
+    
+    result = search_jobs(q, status, category, master_id, limit, offset)
+    
+    return {
+        "query": q,
+        "count": len(result["jobs"]),
+        "offset": offset,
+        "has_more": result["has_more"],
+        "jobs": result["jobs"]
+    }
+
+# ==================== ФОТО ====================
+
+@app.post("/api/v1/photos/upload")
+async def upload_photos(request: Request, job_id: Optional[int] = None):
+    """Потоковая загрузка фото (multipart/form-data, любое число файлов)"""
+    content_type = request.headers.get("content-type", "")
+    _, params = parse_options_header(content_type)
+    if not content_type.startswith("multipart/form-data") or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Ожидается multipart/form-data")
+    
+    if job_id is not None:
+        conn = get_db_connection(shard_for_id(job_id))
+        job = conn.execute("SELECT id FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        conn.close()
+        if not job:
+            raise HTTPException(status_code=404, detail="Заказ не найден")
+    
+    parser = PhotoUploadParser(params[b"boundary"])
+    try:
+        async for chunk in request.stream():
+            # Запись и хэширование вне event loop
+            await asyncio.to_thread(parser.write, chunk)
+        
+        photos = []
+        for item in parser.files:
+            photos.append(await asyncio.to_thread(
+                store_photo, item["tmp_path"], item["sha256"].hexdigest(), item["size"], item["content_type"]
+            ))
+    finally:
+        parser.cleanup()
+    
+    if not photos:
+        raise HTTPException(status_code=400, detail="Файлы не переданы")
+    
+    if job_id is not None:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        link_job_photos(cursor, job_id, [photo["photo_id"] for photo in photos])
+        conn.commit()
+        conn.close()
+    
+    return {"success": True, "count": len(photos), "photos": photos}
+
+def get_photo_record(photo_id: str) -> sqlite3.Row:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM photos WHERE id = ?", (photo_id,))
+    photo = cursor.fetchone()
+    conn.close()
+    
+    if not photo:
+        raise HTTPException(status_code=404, detail="Фото не найдено")
+    return photo
+
+@app.get("/api/v1/photos/{photo_id}")
+async def get_photo(photo_id: str):
+    """Получить фото"""
+    photo = get_photo_record(photo_id)
+    return FileResponse(photo['path'], media_type=photo['content_type'])
+
+@app.get("/api/v1/photos/{photo_id}/thumbnail")
+async def get_photo_thumbnail(photo_id: str):
+    """Получить превью фото (появляется после фоновой обработки)"""
+    photo = get_photo_record(photo_id)
+    path = thumbnail_path(photo['path'])
+    
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Превью ещё не готово")
+    return FileResponse(path, media_type="image/jpeg")
+
+@app.get("/api/v1/jobs/{job_id}/photos")
+async def get_job_photos(job_id: int):
+    """Фото, привязанные к заказу"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        SELECT p.id as photo_id, p.size, p.content_type, jp.created_at
+        FROM job_photos jp
+        JOIN photos p ON p.id = jp.photo_id
+        WHERE jp.job_id = ?
+        ORDER BY jp.created_at
+    """, (job_id,))
+    
+    photos = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    
+    return {"count": len(photos), "photos": photos}
+
 # ==================== ТЕРМИНАЛ МАСТЕРА ====================
 
 @app.get("/api/v1/terminal/jobs/{master_id}")
 async def get_master_jobs(master_id: int, status: Optional[str] = None):
     """Получить заказы мастера"""
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for_id(master_id))
     cursor = conn.cursor()
     
     query = "SELECT * FROM jobs WHERE master_id = ?"
@@ -376,44 +3040,194 @@ async def get_master_jobs(master_id: int, status: Optional[str] = None):
     
     return {"count": len(jobs), "jobs": jobs}
 
+def select_active_job(cursor, master_id: int) -> Optional[Dict[str, Any]]:
+    """Активный заказ мастера (accepted или in_progress, самый свежий)"""
+    # Активных заказов единицы: точечный поиск по статусам дешевле обхода
+    # всей истории мастера по idx_jobs_master_created
+    cursor.execute("""
+        SELECT * FROM jobs INDEXED BY idx_jobs_master_status
+        WHERE master_id = ? AND status IN ('accepted', 'in_progress')
+        ORDER BY created_at DESC LIMIT 1
+    """, (master_id,))
+    job = cursor.fetchone()
+    return dict(job) if job else None
+
+def select_master_earnings(cursor, schemas: List[str], master_id: int) -> Dict[str, Any]:
+    """Итоги мастера по завершённым заказам во всех схемах (main и архив)"""
+    branches = history_union(schemas, """
+        SELECT t.master_earnings, t.amount
+        FROM {db}.jobs j
+        LEFT JOIN {db}.transactions t ON j.id = t.job_id
+        WHERE j.master_id = :master_id AND j.status = 'completed'
+    """)
+    cursor.execute(f"""
+        SELECT 
+            COUNT(*) as total_jobs,
+            COALESCE(SUM(master_earnings), 0) as total_earnings,
+            COALESCE(SUM(amount), 0) as total_revenue
+        FROM ({branches})
+    """, {"master_id": master_id})
+    result = cursor.fetchone()
+    return {
+        "total_jobs": result['total_jobs'],
+        "total_earnings": round(result['total_earnings'], 2),
+        "total_revenue": round(result['total_revenue'], 2)
+    }
+
 @app.get("/api/v1/terminal/jobs/{master_id}/active")
 async def get_active_job(master_id: int):
     """Получить активный заказ мастера"""
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for_id(master_id))
+    job = select_active_job(conn.cursor(), master_id)
+    conn.close()
+    
+    return {"active_job": job}
+
+@app.get("/api/v1/terminal/{master_id}/dashboard")
+async def get_terminal_dashboard(master_id: int, request: Request, recent: int = 20):
+    """Панель терминала одним запросом: активный заказ, последние заказы,
+    счётчики по статусам и заработок
+    
+    ETag - версия данных мастера (masters.dashboard_version), поэтому
+    повторный запрос с If-None-Match при неизменных данных стоит одного
+    чтения по первичному ключу и возвращает 304 без тела.
+    """
+    if not 1 <= recent <= 100:
+        raise HTTPException(status_code=400, detail="recent от 1 до 100")
+    
+    conn = get_db_connection(shard_for_id(master_id))
     cursor = conn.cursor()
     
+    cursor.execute("SELECT dashboard_version FROM masters WHERE id = ?", (master_id,))
+    master = cursor.fetchone()
+    if not master:
+        conn.close()
+        raise HTTPException(status_code=404, detail="Мастер не найден")
+    
+    etag = f'W/"{master_id}.{master["dashboard_version"]}.{recent}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match == "*" or etag in (tag.strip() for tag in if_none_match.split(",")):
+        conn.close()
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    # Все чтения - из одного снимка WAL, согласованного с версией в ETag
+    schemas = attach_archive(conn)
+    cursor.execute("BEGIN")
+    cursor.execute("SELECT dashboard_version FROM masters WHERE id = ?", (master_id,))
+    etag = f'W/"{master_id}.{cursor.fetchone()["dashboard_version"]}.{recent}"'
+    
+    active_job = select_active_job(cursor, master_id)
+    
     cursor.execute("""
-        SELECT * FROM jobs 
-        WHERE master_id = ? AND status IN ('accepted', 'in_progress')
-        ORDER BY created_at DESC LIMIT 1
-    """, (master_id,))
+        SELECT * FROM jobs WHERE master_id = ?
+        ORDER BY created_at DESC LIMIT ?
+    """, (master_id, recent))
+    recent_jobs = [dict(row) for row in cursor.fetchall()]
     
-    job = cursor.fetchone()
+    # Счётчики и заработок - по одной и той же истории (живые таблицы и архив)
+    branches = history_union(schemas, "SELECT status FROM {db}.jobs WHERE master_id = :master_id")
+    cursor.execute(f"""
+        SELECT status, COUNT(*) as count FROM ({branches}) GROUP BY status
+    """, {"master_id": master_id})
+    status_counts = {row['status']: row['count'] for row in cursor.fetchall()}
+    
+    earnings = select_master_earnings(cursor, schemas, master_id)
+    
+    conn.rollback()
     conn.close()
     
-    if not job:
-        return {"active_job": None}
+    body = {
+        "master_id": master_id,
+        "active_job": active_job,
+        "recent_jobs": recent_jobs,
+        "status_counts": status_counts,
+        "earnings": earnings
+    }
+    return Response(
+        content=json.dumps(body, ensure_ascii=False, default=str),
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
+
+@app.post("/api/v1/terminal/{master_id}/heartbeat")
+async def terminal_heartbeat(master_id: int):
+    """Heartbeat терминала (раз в 20-30 секунд); пишется в память, в БД - пачками
+    
+    Обычно отвечает PresenceMiddleware до роутинга; маршрут описывает
+    контракт в /docs.
+    """
+    if not record_heartbeat(master_id):
+        raise HTTPException(status_code=404, detail="Мастер не найден")
+    return {"ok": True, "ttl_seconds": PRESENCE_TTL_SECONDS}
+
+@app.post("/api/v1/terminal/jobs/{master_id}/claim")
+async def claim_job(master_id: int, job_id: Optional[int] = None):
+    """Взять свободный заказ (следующий по очереди или конкретный job_id)"""
+    record_heartbeat(master_id, only_if_seen=True)
+    try:
+        job = claim_pending_job(master_id, job_id)
+    except sqlite3.OperationalError:
+        # Очередь записи не освободилась за DATABASE_BUSY_TIMEOUT_SECONDS - терминал повторит
+        raise HTTPException(status_code=503, detail="База занята, повторите запрос",
+                            headers={"Retry-After": "1"})
+    
+    if job:
+        wake_notification_loop()
+        return {"success": True, "job": job}
+    
+    conn = get_db_connection(shard_for_id(master_id))
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM jobs
+                WHERE master_id = masters.id AND status IN ('accepted', 'in_progress')) as active_jobs
+        FROM masters WHERE id = ?
+    """, (master_id,))
+    master = cursor.fetchone()
+    conn.close()
+    
+    if not master:
+        raise HTTPException(status_code=404, detail="Мастер не найден")
+    if master['active_jobs'] >= MAX_ACTIVE_JOBS_PER_MASTER:
+        return {"success": False, "job": None,
+                "message": f"Достигнут лимит активных заказов ({MAX_ACTIVE_JOBS_PER_MASTER}) - сначала завершите текущие"}
     
-    return {"active_job": dict(job)}
+    return {"success": False, "job": None, "message": "Свободных заказов нет"}
 
 @app.patch("/api/v1/terminal/jobs/{master_id}/status/{job_id}")
 async def update_job_status(master_id: int, job_id: int, update: JobStatusUpdate):
     """Обновить статус заказа"""
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for_id(job_id))
     cursor = conn.cursor()
     
+    # Блокировка записи: прежний статус нужен для учёта загрузки мастера
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT status FROM jobs WHERE id = ? AND master_id = ?", (job_id, master_id))
+    job = cursor.fetchone()
+    
+    if not job:
+        conn.rollback()
+        conn.close()
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+    
+    if not transition_allowed(job['status'], update.status):
+        conn.rollback()
+        conn.close()
+        allowed = ", ".join(JOB_TRANSITIONS[job['status']]) or "нет"
+        raise HTTPException(
+            status_code=409,
+            detail=f"Переход {job['status']} → {update.status} недопустим (допустимые: {allowed})"
+        )
+    
     cursor.execute("""
         UPDATE jobs SET status = ?
         WHERE id = ? AND master_id = ?
     """, (update.status, job_id, master_id))
     
-    if cursor.rowcount == 0:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Заказ не найден")
-    
     conn.commit()
     conn.close()
     
+    adjust_master_load(master_id, job['status'], update.status)
+    
     return {"success": True, "status": update.status}
 
 @app.post("/api/v1/terminal/payment/process")
@@ -423,28 +3237,47 @@ async def process_payment(payment: PaymentProcess):
     # Расчёт комиссий
     fees = calculate_platform_fee(payment.amount)
     
-    # Сохранение транзакции
-    conn = get_db_connection()
+    # Сохранение транзакции в шарде заказа
+    conn = get_db_connection(shard_for_id(payment.job_id))
     cursor = conn.cursor()
     
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT master_id, status FROM jobs WHERE id = ?", (payment.job_id,))
+    job = cursor.fetchone()
+    
+    if not job:
+        conn.rollback()
+        conn.close()
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+    
+    # Оплачивается заказ у мастера; повторная оплата завершённого статус не меняет
+    if job['status'] not in ACTIVE_STATUSES + ('completed',):
+        conn.rollback()
+        conn.close()
+        raise HTTPException(status_code=409, detail=f"Заказ в статусе {job['status']} нельзя оплатить")
+    
     cursor.execute("""
         INSERT INTO transactions (job_id, amount, payment_method, platform_fee, master_earnings)
         VALUES (?, ?, ?, ?, ?)
     """, (
         payment.job_id,
-        payment.amount,
+        fees['total'],
         payment.payment_method,
         fees['platform_commission'],
         fees['master_earnings']
     ))
+    transaction_id = cursor.lastrowid
     
-    # Обновление статуса заказа
+    # Обновление статуса заказа по машине состояний: accepted -> in_progress -> completed
+    if job['status'] == 'accepted':
+        cursor.execute("UPDATE jobs SET status = 'in_progress' WHERE id = ?", (payment.job_id,))
     cursor.execute("UPDATE jobs SET status = 'completed' WHERE id = ?", (payment.job_id,))
     
     conn.commit()
-    transaction_id = cursor.lastrowid
     conn.close()
     
+    adjust_master_load(job['master_id'], job['status'], 'completed')
+    
     return {
         "success": True,
         "transaction_id": transaction_id,
@@ -454,55 +3287,260 @@ async def process_payment(payment: PaymentProcess):
 
 @app.get("/api/v1/terminal/earnings/{master_id}")
 async def get_master_earnings(master_id: int):
-    """Получить заработок мастера"""
-    conn = get_db_connection()
+    """Получить заработок мастера (включая архив)"""
+    conn = get_db_connection(shard_for_id(master_id))
+    schemas = attach_archive(conn)
+    earnings = select_master_earnings(conn.cursor(), schemas, master_id)
+    conn.close()
+    
+    return {"master_id": master_id, **earnings}
+
+# ==================== ЖУРНАЛ СОБЫТИЙ ====================
+
+@app.get("/api/v1/jobs/{job_id}/timeline")
+async def get_job_timeline(job_id: int):
+    """История статусов заказа (включая архив) с длительностью каждого шага"""
+    conn = get_db_connection(shard_for_id(job_id))
     cursor = conn.cursor()
+    schemas = attach_archive(conn)
+    
+    branches = history_union(schemas, """
+        SELECT id, master_id, from_status, to_status, created_at
+        FROM {db}.job_events WHERE job_id = :job_id
+    """)
+    cursor.execute(f"SELECT * FROM ({branches}) ORDER BY id", {"job_id": job_id})
+    events = cursor.fetchall()
+    
+    if not events:
+        branches = history_union(schemas, "SELECT id FROM {db}.jobs WHERE id = :job_id")
+        cursor.execute(branches, {"job_id": job_id})
+        exists = cursor.fetchone()
+        conn.close()
+        if not exists:
+            raise HTTPException(status_code=404, detail="Заказ не найден")
+        # Заказ создан до появления журнала
+        return {"job_id": job_id, "status": None, "events": []}
+    conn.close()
     
+    now = time.time()
+    timeline = []
+    for index, event in enumerate(events):
+        if index + 1 < len(events):
+            left_at = events[index + 1]['created_at']
+        else:
+            left_at = None if not JOB_TRANSITIONS.get(event['to_status']) else now
+        timeline.append({
+            "event_id": event['id'],
+            "from_status": event['from_status'],
+            "status": event['to_status'],
+            "master_id": event['master_id'],
+            "at": datetime.fromtimestamp(event['created_at']).isoformat(timespec="seconds"),
+            "seconds_in_status": round(left_at - event['created_at'], 1) if left_at else None,
+        })
+    
+    return {"job_id": job_id, "status": events[-1]['to_status'], "events": timeline}
+
+@app.get("/api/v1/jobs/time-in-status")
+async def get_time_in_status(days: int = 7):
+    """Время пребывания заказов в статусах за последние days дней"""
+    if days < 1 or days > 365:
+        raise HTTPException(status_code=400, detail="days должен быть от 1 до 365")
+    metrics = await asyncio.to_thread(job_time_in_status, days)
+    return {"days": days, "statuses": metrics}
+
+@app.get("/api/v1/job-events")
+async def get_job_events(after_id: int = 0, limit: int = 500, shard: int = 0):
+    """Чтение журнала шарда после after_id - для внешних потребителей со своим курсором"""
+    if limit < 1 or limit > 5000:
+        raise HTTPException(status_code=400, detail="limit должен быть от 1 до 5000")
+    if shard not in SHARDS:
+        raise HTTPException(status_code=400, detail=f"shard должен быть от 0 до {SHARD_COUNT - 1}")
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
     cursor.execute("""
-        SELECT 
-            COUNT(*) as total_jobs,
-            COALESCE(SUM(t.master_earnings), 0) as total_earnings,
-            COALESCE(SUM(t.amount), 0) as total_revenue
-        FROM jobs j
-        LEFT JOIN transactions t ON j.id = t.job_id
-        WHERE j.master_id = ? AND j.status = 'completed'
-    """, (master_id,))
+        SELECT id, job_id, master_id, from_status, to_status, created_at
+        FROM job_events WHERE id > ? ORDER BY id LIMIT ?
+    """, (after_id, limit))
+    events = [dict(row) for row in cursor.fetchall()]
+    conn.close()
     
-    result = dict(cursor.fetchone())
+    next_id = events[-1]['id'] if events else after_id
+    return {"shard": shard, "events": events, "next_after_id": next_id, "has_more": len(events) == limit}
+
+@app.get("/api/v1/job-events/consumers")
+async def get_job_event_consumers():
+    """Курсоры потребителей журнала и их отставание в событиях по шардам"""
+    return {"shards": await asyncio.to_thread(map_shards, read_event_consumers)}
+
+def read_event_consumers(shard: int) -> Dict[str, Any]:
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM job_events")
+    last_id = cursor.fetchone()[0]
+    cursor.execute("SELECT name, position, updated_at FROM event_consumers ORDER BY name")
+    consumers = [dict(row, lag=last_id - row['position']) for row in cursor.fetchall()]
     conn.close()
+    return {"shard": shard, "last_event_id": last_id, "consumers": consumers}
+
+@app.post("/api/v1/job-events/consume")
+async def run_job_event_consumers_endpoint():
+    """Внеочередной прогон встроенных потребителей"""
+    return {"processed": await asyncio.to_thread(run_job_event_consumers)}
+
+# ==================== РЕЗЕРВНЫЕ КОПИИ ====================
+
+@app.get("/api/v1/backups")
+async def get_backups():
+    """Снимки БД и метрики последнего копирования"""
+    snapshots = [
+        {"name": path.name, "bytes": path.stat().st_size,
+         "created_at": datetime.fromtimestamp(path.stat().st_mtime).isoformat(timespec="seconds")}
+        for shard in SHARDS for archive in (False, True) for path in list_snapshots(shard, archive)
+    ]
+    return {"stats": backup_stats, "snapshots": snapshots}
+
+@app.post("/api/v1/backups/run")
+async def run_backup(compress: Optional[bool] = None):
+    """Снять снимок вне расписания"""
+    if backup_lock.locked():
+        raise HTTPException(status_code=409, detail="Резервное копирование уже выполняется")
+    try:
+        return await asyncio.to_thread(backup_all_shards, compress)
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Снимок не создан: {e}")
+
+# ==================== ОТЛАДКА ====================
+
+@app.get("/debug/slow")
+async def get_slow_traces(limit: int = 20):
+    """Самые медленные из недавно сохранённых трейсов"""
+    traces = sorted(recent_traces, key=lambda trace: trace["duration_ms"], reverse=True)[:limit]
+    return {
+        "sample_rate": TRACE_SAMPLE_RATE,
+        "slow_threshold_ms": TRACE_SLOW_MS,
+        "count": len(traces),
+        "traces": traces
+    }
+
+# ==================== ДИСПЕТЧЕР ====================
+
+@app.get("/api/v1/dispatch/status")
+async def get_dispatch_status():
+    """Состояние фонового диспетчера: время цикла и размер очереди"""
+    return {"interval_seconds": DISPATCH_INTERVAL_SECONDS, **dispatch_stats}
+
+@app.post("/api/v1/dispatch/run")
+async def run_dispatch():
+    """Запустить цикл диспетчера вне расписания"""
+    return await asyncio.to_thread(dispatch_pending_jobs)
+
+# ==================== УВЕДОМЛЕНИЯ ====================
+
+@app.get("/api/v1/notifications/status")
+async def get_notification_status():
+    """Очередь outbox по статусам, пропускная способность и задержка доставки"""
+    counts: Dict[str, int] = {}
+    oldest: Dict[str, float] = {}
+    for rows in await asyncio.to_thread(map_shards, read_notification_queue):
+        for status, count, enqueued_at in rows:
+            counts[status] = counts.get(status, 0) + count
+            oldest[status] = min(oldest.get(status, enqueued_at), enqueued_at)
+    now = time.time()
+    queue = {
+        status: {"count": count, "oldest_seconds": round(now - oldest[status], 1)}
+        for status, count in counts.items()
+    }
     
     return {
-        "master_id": master_id,
-        "total_jobs": result['total_jobs'],
-        "total_earnings": round(result['total_earnings'], 2),
-        "total_revenue": round(result['total_revenue'], 2)
+        "interval_seconds": NOTIFY_INTERVAL_SECONDS,
+        "channels": sorted(get_notification_senders()),
+        "queue": queue,
+        "delivery_lag": notification_lag_percentiles(),
+        **notification_stats,
     }
 
-# ==================== СТАТИСТИКА ====================
+def read_notification_queue(shard: int) -> List[tuple]:
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT status, COUNT(*) as count, MIN(enqueued_at) as oldest
+        FROM notifications WHERE status IN ('pending', 'sending', 'failed')
+        GROUP BY status
+    """)
+    rows = [tuple(row) for row in cursor.fetchall()]
+    conn.close()
+    return rows
 
-@app.get("/api/v1/stats")
-async def get_statistics():
-    """Общая статистика платформы"""
-    conn = get_db_connection()
+@app.post("/api/v1/notifications/drain")
+async def run_notification_drain():
+    """Отправить одну пачку уведомлений вне расписания"""
+    return await drain_notifications()
+
+# ==================== ВЫПЛАТЫ ====================
+
+@app.post("/api/v1/payouts/settle")
+async def run_settlement(run: SettlementRun):
+    """Рассчитать выплаты мастерам за период (повторный запуск безопасен)"""
+    if run.period_end <= run.period_start:
+        raise HTTPException(status_code=400, detail="period_end должен быть позже period_start")
+    
+    return await asyncio.to_thread(settle_payouts, run.period_start.isoformat(), run.period_end.isoformat())
+
+@app.get("/api/v1/payouts/{master_id}/statement")
+async def get_payout_statement(master_id: int, period_start: date, period_end: date):
+    """Выписка мастера за период: итог выплаты и разбивка каждого платежа"""
+    conn = get_db_connection(shard_for_id(master_id))
     cursor = conn.cursor()
+    schemas = attach_archive(conn)
+    params = {
+        "master_id": master_id,
+        "period_start": period_start.isoformat(),
+        "period_end": period_end.isoformat()
+    }
     
-    # Количество мастеров
-    cursor.execute("SELECT COUNT(*) as count FROM masters WHERE is_active = 1")
-    masters_count = cursor.fetchone()['count']
+    cursor.execute("""
+        SELECT * FROM payouts
+        WHERE master_id = :master_id AND period_start = :period_start AND period_end = :period_end
+    """, params)
+    payout = cursor.fetchone()
     
-    # Количество заказов
-    cursor.execute("SELECT COUNT(*) as count FROM jobs")
-    jobs_count = cursor.fetchone()['count']
+    cursor.execute(
+        f"SELECT * FROM ({payment_split_query(schemas, 'AND j.master_id = :master_id')}) ORDER BY created_at",
+        params
+    )
+    payments = [dict(row) for row in cursor.fetchall()]
+    conn.close()
     
-    # Заказы по статусам
-    cursor.execute("SELECT status, COUNT(*) as count FROM jobs GROUP BY status")
-    jobs_by_status = {row['status']: row['count'] for row in cursor.fetchall()}
+    if not payout and not payments:
+        raise HTTPException(status_code=404, detail="Выплат за период нет")
     
-    # Общий доход
-    cursor.execute("SELECT COALESCE(SUM(amount), 0) as total FROM transactions")
-    total_revenue = cursor.fetchone()['total']
+    return {
+        "master_id": master_id,
+        "period_start": params["period_start"],
+        "period_end": params["period_end"],
+        "payout": dict(payout) if payout else None,
+        "payments": payments
+    }
+
+# ==================== СТАТИСТИКА ====================
+
+@app.get("/api/v1/stats")
+async def get_statistics():
+    """Общая статистика платформы (живые таблицы + итоги архива)
     
-    conn.close()
+    Заказы по статусам берутся из job_status_counts (потребитель журнала
+    событий), пока он не запускался - считаются по таблице jobs. Шарды
+    читаются параллельно, итоги складываются.
+    """
+    masters_count = 0
+    jobs_by_status: Dict[str, int] = {}
+    total_revenue = 0.0
+    for shard_masters, shard_jobs, shard_revenue in await asyncio.to_thread(map_shards, read_shard_statistics):
+        masters_count += shard_masters
+        total_revenue += shard_revenue
+        for status, count in shard_jobs.items():
+            jobs_by_status[status] = jobs_by_status.get(status, 0) + count
+    jobs_count = sum(jobs_by_status.values())
     
     return {
         "masters": {"active": masters_count},
@@ -515,9 +3553,87 @@ async def get_statistics():
         }
     }
 
+def read_shard_statistics(shard: int) -> tuple:
+    """(активные мастера, заказы по статусам, доход) одного шарда из одного снимка"""
+    conn = get_db_connection(shard)
+    cursor = conn.cursor()
+    schemas = attach_archive(conn)
+    cursor.execute("BEGIN")
+    
+    # Количество мастеров
+    cursor.execute("SELECT COUNT(*) as count FROM masters WHERE is_active = 1")
+    masters_count = cursor.fetchone()['count']
+    
+    # Заказы по статусам (счётчики уже включают архив)
+    jobs_by_status = read_status_counts(cursor)
+    derived = jobs_by_status is not None
+    if not derived:
+        cursor.execute("SELECT status, COUNT(*) as count FROM jobs GROUP BY status")
+        jobs_by_status = {row['status']: row['count'] for row in cursor.fetchall()}
+    
+    # Общий доход
+    cursor.execute("SELECT COALESCE(SUM(amount), 0) as total FROM transactions")
+    total_revenue = cursor.fetchone()['total']
+    
+    # Архив учитывается по заранее посчитанным итогам
+    if "archive" in schemas:
+        cursor.execute("SELECT status, jobs, revenue FROM archive.archive_totals")
+        for row in cursor.fetchall():
+            if not derived:
+                jobs_by_status[row['status']] = jobs_by_status.get(row['status'], 0) + row['jobs']
+            total_revenue += row['revenue']
+    
+    conn.rollback()
+    conn.close()
+    return masters_count, jobs_by_status, total_revenue
+
 # ==================== ЗАПУСК ====================
 
 if __name__ == "__main__":
+    import sys
+    
+    # Служебные команды: python main.py fts-rebuild | archive [дней] | settle <с> <по> | backup | restore <снимок>
+    if len(sys.argv) > 1 and sys.argv[1] == "fts-rebuild":
+        init_database()
+        started = time.perf_counter()
+        map_shards(rebuild_job_search_index)
+        print(f"✅ Поисковый индекс перестроен за {time.perf_counter() - started:.1f}s")
+        sys.exit(0)
+    
+    # python main.py settle 2026-10-01 2026-11-01
+    if len(sys.argv) > 3 and sys.argv[1] == "settle":
+        init_database()
+        result = settle_payouts(sys.argv[2], sys.argv[3])
+        print(f"✅ Выплаты за {result['period_start']} - {result['period_end']}: "
+              f"мастеров {result['masters']}, к выплате {result['payout_kopecks'] / 100:.2f}₽, "
+              f"расхождение {result['discrepancy_kopecks']} коп. за {result['seconds']}s")
+        sys.exit(0)
+    
+    # python main.py archive [дней]
+    if len(sys.argv) > 1 and sys.argv[1] == "archive":
+        init_database()
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        result = archive_old_jobs(days)
+        print(f"✅ В архив перенесено заказов: {result['archived_jobs']}, "
+              f"транзакций: {result['archived_transactions']} за {result['seconds']}s")
+        sys.exit(0)
+    
+    # python main.py backup [--gzip]
+    if len(sys.argv) > 1 and sys.argv[1] == "backup":
+        init_database()
+        result = backup_all_shards(compress=True if "--gzip" in sys.argv else None)
+        print(f"✅ Снимки {', '.join(result['snapshots'])}: последний {result['last_bytes'] / 1024 / 1024:.1f} МБ "
+              f"за {result['last_seconds']}s, удалено старых: {result['pruned']}")
+        sys.exit(0)
+    
+    # python main.py restore <снимок> - при остановленном сервере
+    if len(sys.argv) > 2 and sys.argv[1] == "restore":
+        result = restore_database(sys.argv[2])
+        target = f"Архив шарда {result['shard']}" if result['archive'] else f"Шард {result['shard']}"
+        print(f"✅ {target} восстановлен из {result['restored_from']} за {result['seconds']}s, "
+              f"прежний файл сохранён в {result['previous_snapshot'] or '- (его не было)'}")
+        sys.exit(0)
+    
     import uvicorn
     port = int(os.getenv("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)